@@ -0,0 +1,199 @@
+"""Binary reference files, for opening by memory-map
+
+JSON references must be parsed in full before the first chunk can be read,
+which for millions of references takes a long time and much memory in every
+process. The format here holds the keys in sorted order with byte offsets
+into a blob, and the references as fixed-width columns, so that a reader
+maps the file and finds any key by binary search without parsing anything
+up front; the operating system's page cache is shared between processes.
+
+Layout (little-endian, sections aligned to 8 bytes)::
+
+    header: MAGIC, number of keys, number of URLs, start of each section
+    key_offsets: uint64[nkeys + 1]  -> keys: UTF-8 blob, keys sorted
+    url_offsets: uint64[nurls + 1]  -> urls: UTF-8 blob
+    url_id: int64[nkeys]  (-1 for data held inline)
+    offset: int64[nkeys]  (into the target, or into the inline blob)
+    size: int64[nkeys]    (-1 for a whole-file reference)
+    inline: blob  (identical values stored once)
+"""
+
+import collections.abc
+import struct
+
+import fsspec
+from fsspec.implementations.local import LocalFileSystem
+import numpy as np
+import ujson
+
+from kerchunk.utils import _as_bytes
+
+MAGIC = b"KCREFS01"
+_HEADER = struct.Struct("<8s10Q")
+_SECTIONS = (
+    "key_offsets",
+    "keys",
+    "url_offsets",
+    "urls",
+    "url_id",
+    "offset",
+    "size",
+    "inline",
+)
+
+
+def write_binary_refs(refs, url, storage_options=None):
+    """Write references to a binary reference file
+
+    Parameters
+    ----------
+    refs: dict-like
+        References, e.g., the output of ``consolidate`` or of a scanner.
+        Simple ``{{name}}`` templates are rendered, since the binary format
+        has none.
+    url: str
+        Output file
+    storage_options: dict | None
+        For opening the output
+    """
+    templates = {}
+    if isinstance(refs, dict) and isinstance(refs.get("refs"), dict):
+        templates = refs.get("templates") or {}
+        refs = refs["refs"]
+    keys = sorted(refs)
+    nkeys = len(keys)
+    url_ids = {}
+    url_id = np.empty(nkeys, dtype="<i8")
+    offset = np.empty(nkeys, dtype="<i8")
+    size = np.empty(nkeys, dtype="<i8")
+    inline = []
+    inline_offsets = {}
+    ninline = 0
+    for i, k in enumerate(keys):
+        v = refs[k]
+        if isinstance(v, list):
+            u = v[0]
+            for name, value in templates.items():
+                u = u.replace("{{%s}}" % name, value)
+            url_id[i] = url_ids.setdefault(u, len(url_ids))
+            offset[i], size[i] = (v[1], v[2]) if len(v) == 3 else (0, -1)
+            continue
+        if isinstance(v, dict):
+            v = ujson.dumps(v)
+        data = _as_bytes(v)
+        url_id[i] = -1
+        size[i] = len(data)
+        if data in inline_offsets:
+            # identical values are stored once
+            offset[i] = inline_offsets[data]
+            continue
+        offset[i] = inline_offsets[data] = ninline
+        inline.append(data)
+        ninline += len(data)
+
+    def blob(strings):
+        encoded = [s.encode() for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+        np.cumsum([len(s) for s in encoded], out=offsets[1:])
+        return offsets.tobytes(), b"".join(encoded)
+
+    key_offsets, key_blob = blob(keys)
+    url_offsets, url_blob = blob(url_ids)
+    sections = [
+        key_offsets,
+        key_blob,
+        url_offsets,
+        url_blob,
+        url_id.tobytes(),
+        offset.tobytes(),
+        size.tobytes(),
+        b"".join(inline),
+    ]
+    starts = []
+    pos = _HEADER.size
+    for s in sections:
+        starts.append(pos)
+        pos += -(-len(s) // 8) * 8
+    with fsspec.open(url, "wb", **(storage_options or {})) as f:
+        f.write(_HEADER.pack(MAGIC, nkeys, len(url_ids), *starts))
+        for s in sections:
+            f.write(s)
+            f.write(b"\x00" * (-len(s) % 8))
+
+
+class BinaryReferences(collections.abc.Mapping):
+    """Read-only mapping of the references in a binary reference file
+
+    A local file is memory-mapped; other files are read into memory whole,
+    which still needs no parsing. Lookups are by binary search of the sorted
+    keys. Values are as from ``LazyReferenceMapper``: ``[url]``,
+    ``[url, offset, size]`` or bytes. Pickles by URL, for use in dask workers,
+    and can be given as ``fo=`` to ``ReferenceFileSystem``.
+    """
+
+    def __init__(self, url, storage_options=None):
+        self.url = url
+        self.storage_options = storage_options
+        fs, path = fsspec.core.url_to_fs(url, **(storage_options or {}))
+        if isinstance(fs, LocalFileSystem):
+            buf = np.memmap(path, dtype="u1", mode="r")
+        else:
+            buf = np.frombuffer(fs.cat_file(path), dtype="u1")
+        header = _HEADER.unpack(buf[: _HEADER.size].tobytes())
+        if header[0] != MAGIC:
+            raise ValueError(f"{url} is not a binary reference file")
+        self._n, nurls = header[1:3]
+        starts = dict(zip(_SECTIONS, header[3:]))
+
+        def array(name, dtype, count):
+            start = starts[name]
+            return buf[start : start + 8 * count].view(dtype)
+
+        self._key_offsets = array("key_offsets", "<u8", self._n + 1)
+        self._keys = buf[starts["keys"] :]
+        self._url_offsets = array("url_offsets", "<u8", nurls + 1)
+        self._urls = buf[starts["urls"] :]
+        self._url_id = array("url_id", "<i8", self._n)
+        self._offset = array("offset", "<i8", self._n)
+        self._size = array("size", "<i8", self._n)
+        self._inline = buf[starts["inline"] :]
+
+    def __reduce__(self):
+        return BinaryReferences, (self.url, self.storage_options)
+
+    def _key(self, i):
+        return self._keys[self._key_offsets[i] : self._key_offsets[i + 1]].tobytes()
+
+    def _find(self, key):
+        k = key.encode()
+        lo, hi = 0, self._n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < k:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._n and self._key(lo) == k:
+            return lo
+        raise KeyError(key)
+
+    def __getitem__(self, key):
+        i = self._find(key)
+        uid, offset, size = self._url_id[i], int(self._offset[i]), int(self._size[i])
+        if uid < 0:
+            return self._inline[offset : offset + size].tobytes()
+        url = self._urls[self._url_offsets[uid] : self._url_offsets[uid + 1]]
+        url = url.tobytes().decode()
+        if size < 0:
+            return [url]
+        return [url, offset, size]
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield self._key(i).decode()
+
+    def __len__(self):
+        return self._n
+
+    def __repr__(self):
+        return f"<BinaryReferences {self.url}: {self._n} references>"
@@ -255,3 +255,61 @@ class ZlibCodec(Codec):
 
     def encode(self, buf):
         return zlib.compress(buf)
+
+
+class GzipIndexCodec(Codec):
+    """Read data from within a gzip file, via a checkpoint index
+
+    Each chunk's buffer is a small JSON description of the uncompressed byte
+    range ``{"offset": ..., "size": ...}`` (or ``{"raw": base64}`` for inlined
+    data), as made by ``kerchunk.gzindex.gzip_references``. Decoding fetches
+    and decompresses from the nearest preceding checkpoint in the index.
+    """
+
+    codec_id = "gzip_index"
+    _indexes = {}
+
+    def __init__(self, index, target=None, storage_options=None):
+        """
+        Parameters
+        ----------
+        index: str
+            location of the sidecar file made by ``kerchunk.gzindex.build_index``
+        target: str | None
+            location of the gzip file, if different from that stored in the index
+        storage_options: dict | None
+            for opening the index and gzip file
+        """
+        self.index = index
+        self.target = target
+        self.storage_options = storage_options
+
+    def _get_index(self):
+        from kerchunk.gzindex import GzipIndex
+
+        key = (self.index, self.target, str(self.storage_options))
+        if key not in self._indexes:
+            self._indexes[key] = GzipIndex.load(
+                self.index, url=self.target, storage_options=self.storage_options
+            )
+        return self._indexes[key]
+
+    def decode(self, buf, out=None):
+        import base64
+        import ujson
+
+        desc = ujson.loads(bytes(buf))
+        if "raw" in desc:
+            data = base64.b64decode(desc["raw"])
+        else:
+            offset = desc["offset"]
+            data = self._get_index().read(offset, offset + desc["size"])
+        if out is not None:
+            return numcodecs.compat.ndarray_copy(data, out)
+        return data
+
+    def encode(self, buf):
+        raise NotImplementedError
+
+
+numcodecs.register_codec(GzipIndexCodec, "gzip_index")
@@ -1,6 +1,10 @@
+import array
 import collections.abc
+import contextlib
+import functools
 import logging
 import re
+import time
 from typing import List
 import warnings
 
@@ -28,6 +32,207 @@ def drop(fields):
     return preproc
 
 
+class _RefTable:
+    """References of one variable, as columns of URL IDs, offsets and sizes"""
+
+    __slots__ = ("rows", "url", "offset", "size", "free")
+
+    def __init__(self):
+        self.rows = {}  # chunk key -> row number
+        self.url = array.array("q")
+        self.offset = array.array("q")
+        self.size = array.array("q")
+        self.free = []  # rows of removed references, for reuse
+
+
+class CompactReferences(collections.abc.MutableMapping):
+    """Dict-like container holding references in compact form
+
+    Each distinct URL is stored once and referred to by integer ID; the
+    ``[url, offset, size]`` references of each variable are kept in int64
+    columns. Lists are only made again when the values are accessed, e.g., by
+    ``consolidate`` at output time. Inlined data and metadata are held as given.
+
+    This is the default output store of ``MultiZarrToZarr``; a ``postprocess``
+    function is given its contents as a plain dict.
+    """
+
+    def __init__(self, refs=None):
+        self.urls = []  # URL ID -> URL
+        self._url_ids = {}  # URL -> URL ID
+        self._tables = {}  # variable -> _RefTable
+        self._other = {}  # everything that is not a reference
+        if refs:
+            self.update(refs)
+
+    def _url_id(self, url):
+        if url is None:
+            return -1
+        try:
+            return self._url_ids[url]
+        except KeyError:
+            self._url_ids[url] = len(self.urls)
+            self.urls.append(url)
+            return self._url_ids[url]
+
+    @staticmethod
+    def _split(key):
+        if "/" in key:
+            return key.rsplit("/", 1)
+        return "", key
+
+    def __setitem__(self, key, value):
+        if (
+            isinstance(value, list)
+            and len(value) in (1, 3)
+            and isinstance(value[0], (str, type(None)))
+        ):
+            self._other.pop(key, None)
+            var, chunk = self._split(key)
+            table = self._tables.get(var)
+            if table is None:
+                table = self._tables[var] = _RefTable()
+            url = self._url_id(value[0])
+            offset, size = (value[1], value[2]) if len(value) == 3 else (0, -1)
+            row = table.rows.get(chunk)
+            if row is None and not table.free:
+                table.rows[chunk] = len(table.url)
+                table.url.append(url)
+                table.offset.append(offset)
+                table.size.append(size)
+            else:
+                if row is None:
+                    row = table.rows[chunk] = table.free.pop()
+                table.url[row] = url
+                table.offset[row] = offset
+                table.size[row] = size
+        else:
+            self._pop_ref(key)
+            self._other[key] = value
+
+    def _pop_ref(self, key):
+        var, chunk = self._split(key)
+        table = self._tables.get(var)
+        if table is None:
+            return False
+        row = table.rows.pop(chunk, None)
+        if row is None:
+            return False
+        table.free.append(row)
+        return True
+
+    def __getitem__(self, key):
+        if key in self._other:
+            return self._other[key]
+        var, chunk = self._split(key)
+        table = self._tables.get(var)
+        if table is None or chunk not in table.rows:
+            raise KeyError(key)
+        row = table.rows[chunk]
+        uid = table.url[row]
+        url = self.urls[uid] if uid >= 0 else None
+        if table.size[row] < 0:
+            return [url]
+        return [url, table.offset[row], table.size[row]]
+
+    def __delitem__(self, key):
+        if key in self._other:
+            del self._other[key]
+        elif not self._pop_ref(key):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in self._other:
+            return True
+        var, chunk = self._split(key)
+        table = self._tables.get(var)
+        return table is not None and chunk in table.rows
+
+    def __iter__(self):
+        yield from self._other
+        for var, table in self._tables.items():
+            prefix = f"{var}/" if var else ""
+            for chunk in table.rows:
+                yield prefix + chunk
+
+    def __len__(self):
+        return len(self._other) + sum(len(t.rows) for t in self._tables.values())
+
+
+class CombineMetrics:
+    """Timings and I/O counters collected while combining
+
+    Stage times are wall-clock seconds, accumulated over calls; stages may nest
+    (e.g., loading of inputs happens inside the second pass, if not done before).
+    Request and byte counts are of fetches made by ``MultiZarrToZarr`` itself,
+    for loading JSON inputs and for inlining; merging of neighbouring ranges by the
+    filesystem may mean that fewer actual requests are made.
+
+    The number of references held is counted after each stage and input only when
+    the output is in memory (a dict or ``CompactReferences``), since counting the
+    keys of, e.g., a ``LazyReferenceMapper`` walks every chunk grid; otherwise
+    ``peak_refs`` is None. References are only ever added, so this is the peak.
+
+    Callbacks are called as ``callback(stage, report)`` at the end of each stage.
+    """
+
+    def __init__(self, callbacks=None):
+        self.callbacks = list(callbacks or [])
+        self.stages = {}
+        self.n_inputs = 0
+        self.keys = 0
+        self.requests = 0
+        self.bytes_fetched = 0
+        self.peak_refs = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.stages[name] = self.stages.get(name, 0) + time.perf_counter() - t0
+            report = self.report()
+            for callback in self.callbacks:
+                callback(name, report)
+
+    def fetched(self, requests, nbytes):
+        self.requests += requests
+        self.bytes_fetched += nbytes
+
+    def refs_count(self, n):
+        self.peak_refs = max(self.peak_refs or 0, n)
+
+    def report(self):
+        """The current state as a JSON-serializable dict"""
+        return {
+            "stages": dict(self.stages),
+            "n_inputs": self.n_inputs,
+            "keys": self.keys,
+            "requests": self.requests,
+            "bytes_fetched": self.bytes_fetched,
+            "peak_refs": self.peak_refs,
+        }
+
+
+def _timed(name):
+    """Record the time of a MultiZarrToZarr method as stage ``name``, if enabled"""
+
+    def deco(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if self.metrics is None:
+                return func(self, *args, **kwargs)
+            with self.metrics.stage(name):
+                out = func(self, *args, **kwargs)
+                self._count_refs()
+                return out
+
+        return wrapper
+
+    return deco
+
+
 class MultiZarrToZarr:
     """
     Combine multiple kerchunk'd datasets into a single logical aggregate dataset
@@ -85,14 +290,24 @@ class MultiZarrToZarr:
         for an example.
     :param postprocess: callable
         Acts on the references dict before output.
-        postprocess(dict)-> dict
+        postprocess(dict)-> dict. If ``out`` is not given, this is a plain dict copy
+        of the default ``CompactReferences`` store.
     :param out: dict-like or None
         This allows you to supply an fsspec.implementations.reference.LazyReferenceMapper
         to write out parquet as the references get filled, or some other dictionary-like class
-        to customise how references get stored
+        to customise how references get stored. By default, references are held in a
+        ``CompactReferences`` instance.
     :param append: bool
         If True, will load the references specified by out and add to them rather than starting
         from scratch. Assumes the same coordinates are being concatenated.
+    :param metrics: bool
+        If True, collect per-stage timings and I/O counts in ``.metrics``
+        (a ``CombineMetrics``), see ``.report``.
+    :param callbacks: list(callable) or None
+        Called as ``callback(stage, report)`` after each stage; implies ``metrics``.
+    :param batch_size: int
+        When the inputs are loaded one at a time in the second pass, inputs given as
+        JSON paths are fetched this many at a time, with one concurrent ``cat``.
     """
 
     inline: int
@@ -112,8 +327,15 @@ class MultiZarrToZarr:
         preprocess=None,
         postprocess=None,
         out=None,
+        metrics=False,
+        callbacks=None,
+        batch_size=32,
     ):
+        self.metrics = CombineMetrics(callbacks) if metrics or callbacks else None
         self._fss = None
+        self._fs0 = None
+        self._batch = {}
+        self.batch_size = batch_size
         self._paths = None
         self._indicts = indicts
         self.ds = None
@@ -145,7 +367,7 @@ class MultiZarrToZarr:
             raise ValueError("Values being mapped cannot also be identical")
         self.preprocess = preprocess
         self.postprocess = postprocess
-        self.out = out if out is not None else {}
+        self.out = out if out is not None else CompactReferences()
         self.coos = None
         self.done = set()
 
@@ -252,37 +474,161 @@ class MultiZarrToZarr:
 
         if self._fss is None:
             logger.debug("setup filesystems")
+            with self._stage("load_inputs"):
+                self._get_paths()
+                if self._indicts is not None:
+                    fo_list = self._indicts
+                elif isinstance(self.path[0], collections.abc.Mapping):
+                    fo_list = self.path
+                else:
+                    fs = fsspec.core.url_to_fs(self.path[0], **self.target_options)[0]
+                    try:
+                        # JSON path
+                        fo_list = fs.cat(self.path)
+                        if self.metrics is not None:
+                            self.metrics.fetched(
+                                len(fo_list), sum(len(v) for v in fo_list.values())
+                            )
+                        fo_list = [ujson.loads(v) for v in fo_list.values()]
+                    except (IOError, TypeError, ValueError):
+                        # tries again sequentially in comprehension below
+                        fo_list = self.path
+
+                self._fss = [
+                    fsspec.filesystem(
+                        "reference",
+                        fo=fo,
+                        remote_protocol=self.remote_protocol,
+                        remote_options=self.remote_options,
+                    )
+                    for fo in fo_list
+                ]
+                if self.metrics is not None:
+                    self.metrics.n_inputs = len(self._fss)
+        return self._fss
+
+    @property
+    def report(self):
+        """Stage timings and I/O counts, if ``metrics`` was enabled, else None"""
+        if self.metrics is None:
+            return None
+        return self.metrics.report()
+
+    def _count_refs(self):
+        # cheap only for in-memory outputs, see CombineMetrics
+        if isinstance(self.out, (dict, CompactReferences)):
+            self.metrics.refs_count(len(self.out))
+
+    def _stage(self, name):
+        if self.metrics is None:
+            return contextlib.nullcontext()
+        return self.metrics.stage(name)
+
+    def _get_paths(self):
+        """Filenames of the inputs (or None for each, if not known)
+
+        This does not need to load any of the inputs.
+        """
+        if self._paths is None:
             if self._indicts is not None:
-                fo_list = self._indicts
                 self._paths = self.path
             elif isinstance(self.path[0], collections.abc.Mapping):
-                fo_list = self.path
-                self._paths = []
-                for path in self.path:
-                    self._paths.append(path.get("templates", {}).get("u", None))
+                self._paths = [
+                    path.get("templates", {}).get("u", None) for path in self.path
+                ]
             else:
-                self._paths = []
-                for of in fsspec.open_files(self.path, **self.target_options):
-                    self._paths.append(of.full_name)
-                fs = fsspec.core.url_to_fs(self.path[0], **self.target_options)[0]
-                try:
-                    # JSON path
-                    fo_list = fs.cat(self.path)
-                    fo_list = [ujson.loads(v) for v in fo_list.values()]
-                except (IOError, TypeError, ValueError):
-                    # tries again sequentially in comprehension below
-                    fo_list = self.path
+                self._paths = [
+                    of.full_name
+                    for of in fsspec.open_files(self.path, **self.target_options)
+                ]
+        return self._paths
+
+    def _n_inputs(self):
+        return len(self._indicts if self._indicts is not None else self.path)
+
+    def _input_fs(self, i):
+        """Filesystem for the i-th input
+
+        If all the inputs were already loaded (by ``.fss``), that instance is used;
+        otherwise only this one input is opened and preprocessed, so that the inputs
+        need not all be held in memory together; JSON paths are fetched in batches
+        (see ``_load_json``). The first input is kept, since it is needed both for
+        global metadata and in the second pass.
+        """
+        if self._fss is not None:
+            return self._fss[i]
+        if i == 0 and self._fs0 is not None:
+            return self._fs0
+        with self._stage("load_inputs"):
+            if self._indicts is not None:
+                fo = self._indicts[i]
+            elif isinstance(self.path[i], str):
+                fo = self._load_json(i)
+            else:
+                fo = self.path[i]
+            fs = fsspec.filesystem(
+                "reference",
+                fo=fo,
+                target_options=self.target_options,
+                remote_protocol=self.remote_protocol,
+                remote_options=self.remote_options,
+            )
+            self._preprocess(fs)
+        if self.metrics is not None:
+            self.metrics.n_inputs = max(self.metrics.n_inputs, i + 1)
+        if i == 0:
+            self._fs0 = fs
+        return fs
 
-            self._fss = [
-                fsspec.filesystem(
-                    "reference",
-                    fo=fo,
-                    remote_protocol=self.remote_protocol,
-                    remote_options=self.remote_options,
-                )
-                for fo in fo_list
-            ]
-        return self._fss
+    def _load_json(self, i):
+        """References of the i-th input path, fetched together with the following ones
+
+        Paths are fetched ``batch_size`` at a time with one concurrent ``cat``, and the
+        raw bytes kept only until each input is used. If the file cannot be loaded as
+        JSON (such as a parquet directory), the path itself is returned.
+        """
+        if i not in self._batch:
+            self._batch.clear()
+            paths = self.path[i : i + self.batch_size]
+            fs = fsspec.core.url_to_fs(paths[0], **self.target_options)[0]
+            data = fs.cat(paths, on_error="return")
+            # results are keyed (and sorted) by path; keep the input order
+            for j, fn in enumerate(paths, i):
+                self._batch[j] = data.get(fs._strip_protocol(fn))
+            if self.metrics is not None:
+                bits = [v for v in data.values() if isinstance(v, bytes)]
+                self.metrics.fetched(len(bits), sum(len(v) for v in bits))
+        value = self._batch.pop(i)
+        if isinstance(value, bytes):
+            try:
+                return ujson.loads(value)
+            except ValueError:
+                pass
+        return self.path[i]
+
+    def _preprocess(self, fs):
+        if self.preprocess:
+            self.preprocess(fs.references)
+            # reset this to force references to update
+            fs.dircache = None
+            fs._dircache_from_items()
+
+    def _coos_known(self):
+        """Whether the concat coordinates can be found without opening any input
+
+        True if the selector for every concat dimension is a list, constant,
+        regex on the filename or "INDEX".
+        """
+        for var in self.concat_dims:
+            selector = self.coo_map[var]
+            if isinstance(selector, collections.abc.Callable):
+                return False
+            if isinstance(selector, str) and (
+                selector == "VARNAME"
+                or selector.startswith(("attr:", "vattr:", "data:", "cf:"))
+            ):
+                return False
+        return True
 
     def _get_value(self, index, z, var, fn=None):
         """derive coordinate value(s) for given input dataset
@@ -352,21 +698,27 @@ class MultiZarrToZarr:
         logger.debug("Decode: %s -> %s", (selector, index, var, fn), o)
         return o
 
+    @_timed("first_pass")
     def first_pass(self):
-        """Accumulate the set of concat coords values across all inputs"""
+        """Accumulate the set of concat coords values across all inputs
 
-        coos = self.coos or {c: set() for c in self.coo_map}
-        for i, fs in enumerate(self.fss):
-            if self.preprocess:
-                self.preprocess(fs.references)
-                # reset this to force references to update
-                fs.dircache = None
-                fs._dircache_from_items()
+        If all the selectors for the concat dims can be evaluated without looking
+        at the data (lists, constants, regex on filename, "INDEX"), no input is
+        opened at this stage.
+        """
 
-            logger.debug("First pass: %s", i)
-            z = zarr.open_group(fs.get_mapper(""))
+        coos = self.coos or {c: set() for c in self.coo_map}
+        if self._coos_known() and self._fss is None:
+            # fast path: values come from the selectors/filenames alone, and
+            # the inputs are opened one at a time, only in the second pass
+            logger.debug("First pass: coordinates known without loading inputs")
+            paths = self._get_paths()
+            inputs = ((i, None, paths[i]) for i in range(self._n_inputs()))
+        else:
+            inputs = self._open_inputs()
+        for i, z, fn in inputs:
             for var in self.concat_dims:
-                value = self._get_value(i, z, var, fn=self._paths[i])
+                value = self._get_value(i, z, var, fn=fn)
                 if isinstance(value, np.ndarray):
                     value = value.ravel()
                 if isinstance(value, (np.ndarray, tuple, list)):
@@ -385,6 +737,14 @@ class MultiZarrToZarr:
         self.done.add(1)
         return coos
 
+    def _open_inputs(self):
+        for i, fs in enumerate(self.fss):
+            self._preprocess(fs)
+            logger.debug("First pass: %s", i)
+            z = zarr.open_group(fs.get_mapper(""))
+            yield i, z, self._paths[i]
+
+    @_timed("store_coords")
     def store_coords(self):
         """
         Write coordinate arrays into the output
@@ -392,7 +752,7 @@ class MultiZarrToZarr:
         kv = {}
         store = zarr.storage.KVStore(kv)
         group = zarr.open(store)
-        m = self.fss[0].get_mapper("")
+        m = self._input_fs(0).get_mapper("")
         z = zarr.open(m)
         for k, v in self.coos.items():
             if k == "var":
@@ -452,6 +812,7 @@ class MultiZarrToZarr:
         logger.debug("Written global metadata")
         self.done.add(2)
 
+    @_timed("second_pass")
     def second_pass(self):
         """map every input chunk to the output"""
         # TODO: this stage cannot be rerun without clearing and rerunning store_coords too,
@@ -462,7 +823,9 @@ class MultiZarrToZarr:
         did_them = set()
         no_deps = None
 
-        for i, fs in enumerate(self.fss):
+        paths = self._get_paths()
+        for i in range(self._n_inputs()):
+            fs = self._input_fs(i)
             to_download = {}
             m = fs.get_mapper("")
             z = zarr.open(m)
@@ -475,7 +838,7 @@ class MultiZarrToZarr:
 
             # Coordinate values for the whole of this dataset
             cvalues = {
-                c: self._get_value(i, z, c, fn=self._paths[i]) for c in self.coo_map
+                c: self._get_value(i, z, c, fn=paths[i]) for c in self.coo_map
             }
             var = cvalues.get("var", None)
             for c, cv in cvalues.copy().items():
@@ -515,7 +878,7 @@ class MultiZarrToZarr:
                 elif chunk_sizes[v] != zarray["chunks"]:
                     raise ValueError(
                         f"""Found chunk size mismatch:
-                        at prefix {v} in iteration {i} (file {self._paths[i]})
+                        at prefix {v} in iteration {i} (file {paths[i]})
                         new chunk: {chunk_sizes[v]}
                         chunks so far: {zarray["chunks"]}"""
                     )
@@ -590,6 +953,11 @@ class MultiZarrToZarr:
                     key = key.rstrip(".")
 
                     ref = fs.references.get(fn)
+                    if self.metrics is not None:
+                        self.metrics.keys += 1
+                        if self.inline > 0 and isinstance(ref, list) and len(ref) == 1:
+                            # size lookup of whole-file reference
+                            self.metrics.fetched(1, 0)
                     if (
                         self.inline > 0
                         and isinstance(ref, list)
@@ -602,9 +970,16 @@ class MultiZarrToZarr:
                     else:
                         self.out[key] = fs.references[fn]
             if to_download:
-                bits = fs.cat(list(to_download.values()))
+                with self._stage("inline"):
+                    bits = fs.cat(list(to_download.values()))
+                if self.metrics is not None:
+                    self.metrics.fetched(
+                        len(bits), sum(len(b) for b in bits.values())
+                    )
                 for key, fn in to_download.items():
                     self.out[key] = bits[fn]
+            if self.metrics is not None:
+                self._count_refs()
         self.done.add(3)
 
     def translate(self, filename=None, storage_options=None):
@@ -621,16 +996,21 @@ class MultiZarrToZarr:
             self.second_pass()
         if 4 not in self.done:
             if self.postprocess is not None:
-                self.out = self.postprocess(self.out)
+                with self._stage("postprocess"):
+                    if isinstance(self.out, CompactReferences):
+                        # as before the compact store was the default
+                        self.out = dict(self.out)
+                    self.out = self.postprocess(self.out)
             self.done.add(4)
-        if isinstance(self.out, dict):
-            out = consolidate(self.out)
-        else:
-            self.out.flush()
-            out = self.out
-        if filename is not None:
-            with fsspec.open(filename, mode="wt", **(storage_options or {})) as f:
-                ujson.dump(out, f)
+        with self._stage("output"):
+            if isinstance(self.out, (dict, CompactReferences)):
+                out = consolidate(self.out)
+            else:
+                self.out.flush()
+                out = self.out
+            if filename is not None:
+                with fsspec.open(filename, mode="wt", **(storage_options or {})) as f:
+                    ujson.dump(out, f)
         return out
 
 
@@ -643,29 +1023,99 @@ def _reorganise(coos):
     return out
 
 
-def merge_vars(files, storage_options=None):
+def merge_vars(
+    files, storage_options=None, out=None, conflicts="overwrite", batch_size=32
+):
     """Merge variables across datasets with identical coordinates
 
+    Inputs given as paths are loaded concurrently, ``batch_size`` at a time, and each
+    is discarded as soon as its references have been added to the output.
+
     :param files: list(dict), list(str) or list(fsspec.OpenFile)
         List of reference dictionaries or list of paths to reference json files to be merged
     :param storage_options: dict
         Dictionary containing kwargs to `fsspec.open_files`
+    :param out: dict-like or None
+        If given, e.g., a ``LazyReferenceMapper``, references are written into this
+        as they are loaded, so the merged set need never be held in memory, and it
+        is flushed and returned at the end. Inputs should not contain templates in
+        this case.
+    :param conflicts: "overwrite", "first" or "raise"
+        What to do when a key appears in more than one input with different
+        values: keep the last, keep the first, or raise ValueError. When writing
+        to ``out``, only metadata keys are checked.
+    :param batch_size: int
+        Number of input files to load at once
     """
+    if conflicts not in ("overwrite", "first", "raise"):
+        raise ValueError(f"Unknown conflicts option: {conflicts}")
+    merged = None
+    refs_out = out
+    seen = {}  # key -> value, for keys that may legitimately repeat
+
+    def _add(refs):
+        for k, v in refs.items():
+            if k in seen or (out is None and k in refs_out):
+                old = seen[k] if k in seen else refs_out[k]
+                if _same_ref(old, v):
+                    continue
+                if conflicts == "raise":
+                    raise ValueError(f"Conflicting values for key {k} in merge")
+                if conflicts == "first":
+                    continue
+            if out is not None and (k.startswith(".z") or "/.z" in k):
+                seen[k] = v
+            refs_out[k] = v
+
+    for refs in _iter_ref_sets(files, storage_options, batch_size):
+        if merged is None:
+            merged = {k: v for k, v in refs.items() if k != "refs"}
+            merged.setdefault("version", 1)
+            if out is None:
+                refs_out = {}
+        _add(refs.get("refs", {}))
+
+    if out is not None:
+        if hasattr(out, "flush"):
+            out.flush()
+        return out
+    merged["refs"] = refs_out
+    return merged
+
+
+def _same_ref(a, b):
+    if isinstance(a, bytes):
+        a = a.decode()
+    if isinstance(b, bytes):
+        b = b.decode()
+    if a == b:
+        return True
+    if isinstance(a, str) and isinstance(b, str):
+        try:
+            # metadata: compare as JSON, ignoring formatting
+            return ujson.loads(a) == ujson.loads(b)
+        except ValueError:
+            return False
+    return False
+
+
+def _iter_ref_sets(files, storage_options=None, batch_size=32):
+    """Generate loaded reference sets, reading paths concurrently in batches"""
     if isinstance(files[0], collections.abc.Mapping):
-        fo_list = files
-        merged = fo_list[0].copy()
-        for file in fo_list[1:]:
-            refs = file["refs"]
-            merged["refs"].update(refs)
+        yield from files
+    elif isinstance(files[0], str):
+        fs = fsspec.core.url_to_fs(files[0], **(storage_options or {}))[0]
+        for i in range(0, len(files), batch_size):
+            paths = files[i : i + batch_size]
+            batch = fs.cat(paths)
+            # results are keyed (and sorted) by path; keep the input order
+            for fn in paths:
+                yield ujson.loads(batch[fs._strip_protocol(fn)])
+            del batch
     else:
-        fo_list = fsspec.open_files(files, mode="rb", **(storage_options or {}))
-        with fo_list[0] as f:
-            merged = ujson.load(f)
-        for file in fo_list[1:]:
+        for file in files:
             with file as f:
-                refs = ujson.load(f)["refs"]
-            merged["refs"].update(refs)
-    return merged
+                yield ujson.load(f)
 
 
 def concatenate_arrays(
@@ -675,37 +1125,56 @@ def concatenate_arrays(
     key_seperator=".",
     path=None,
     check_arrays=False,
+    out=None,
+    batch_size=32,
 ):
-    """Simple concatenate of one zarr array along an axis
+    """Simple concatenate of zarr arrays along an axis
 
     Assumes that each array is identical in shape/type.
 
-    If the inputs are groups, provide the path to the contained array, and all other arrays
-    will be ignored. You could concatentate the arrays separately and then recombine them
-    with ``merge_vars``.
+    If the inputs are groups, provide the path to the contained array, or a list of
+    paths, and all other arrays will be ignored. You could concatentate the arrays
+    separately and then recombine them with ``merge_vars``. If None, all arrays in
+    the group which have the given axis are concatenated, and the others are taken
+    from the first input as they are; group metadata also comes from the first input.
+
+    Note that with ``path=None``, this includes coordinate arrays which have the
+    axis, such as latitude and longitude for ``axis=0``, whose values would then be
+    repeated for every input. Give ``path`` to concatenate only the data arrays.
+
+    Inputs are processed in a single pass over their keys, chunk keys being moved
+    along the axis by the number of chunks in the preceding inputs; no filesystem
+    instance is made for each input.
 
     Parameters
     ----------
     files: list[dict] | list[str]
-        Input reference sets, maybe generated by ``kerchunk.zarr.single_zarr``
+        Input reference sets, maybe generated by ``kerchunk.zarr.single_zarr``; paths
+        may be JSON files or parquet reference directories, and are loaded
+        concurrently in batches.
     storage_options: dict | None
         To create the filesystems, such at target/remote protocol and target/remote options
     key_seperator: str
         "." or "/", how the zarr keys are stored
-    path: str or None
+    path: str, list[str] or None
         If the datasets are groups rather than simple arrays, this is the location in the
-        group hierarchy to concatenate. The group structure will be recreated.
+        group hierarchy to concatenate. The group structure will be recreated. If None,
+        every array which has the axis (see above).
     check_arrays: bool
         Whether we check the size and chunking of the inputs. If True, and an
         inconsistency is found, an exception is raised. If False (default), the
         user is expected to be certain that the chunking and shapes are
         compatible.
+    out: dict-like or None
+        If given, e.g., a ``LazyReferenceMapper``, the output is written into this,
+        metadata first, and it is then flushed and returned.
+    batch_size: int
+        Number of input files to load at once, if given as paths
     """
-    out = {}
-    if path is None:
-        path = ""
-    else:
-        path = "/".join(path.rstrip(".").rstrip("/").split(".")) + "/"
+    # the final shapes are only known at the end, but lazy outputs need them first
+    refs_out = {} if out is None else CompactReferences()
+    if isinstance(path, str):
+        path = [path]
 
     def _replace(l: list, i: int, v) -> list:
         l = l.copy()
@@ -713,61 +1182,193 @@ def concatenate_arrays(
         return l
 
     n_files = len(files)
+    arrays = None
+    for i, refs in enumerate(_iter_flat_refs(files, storage_options, batch_size)):
+        if arrays is None:
+            # plan from the first input: array prefix -> metadata
+            copied = {}  # ndim -> arrays to take from the first input as they are
+            if path is None:
+                if ".zarray" in refs:
+                    names = [""]
+                else:
+                    names = []
+                    for k in refs:
+                        if k.endswith("/.zarray"):
+                            ndim = len(_load_meta(refs[k])["shape"])
+                            if ndim > axis:
+                                names.append(k[: -len(".zarray")])
+                            else:
+                                copied.setdefault(ndim, set()).add(k[: -len(".zarray")])
+            else:
+                names = [
+                    "/".join(p.rstrip(".").rstrip("/").split(".")) + "/" for p in path
+                ]
+            arrays = {
+                name: {
+                    "offset": 0,
+                    "zarray": None,
+                    "base_shape": None,
+                    "base_chunks": None,
+                }
+                for name in names
+            }
+            copied_names = set().union(*copied.values())
+            groups = {
+                "/".join(name.split("/")[:j]) + ("/" if j else "")
+                for name in names + list(copied_names)
+                for j in range(name.count("/"))
+            }
+            by_ndim = {}
+        n_chunks = {}
+        for name, state in arrays.items():
+            zarray = _load_meta(refs[f"{name}.zarray"])
+            shape = zarray["shape"]
+            chunks = zarray["chunks"]
+            n, rem = divmod(shape[axis], chunks[axis])
+            n_chunks[name] = n + (rem > 0)
+            if i == 0:
+                state["zarray"] = zarray
+                state["base_shape"] = _replace(shape, axis, None)
+                state["base_chunks"] = chunks
+                by_ndim.setdefault(len(shape), set()).add(name)
+            else:
+                state["zarray"]["shape"][axis] += shape[axis]
+
+            # Safety checks
+            if check_arrays:
+                base_shape = state["base_shape"]
+                if _replace(shape, axis, None) != base_shape:
+                    expected_shape = (
+                        f"[{', '.join(map(str, _replace(base_shape, axis, '*')))}]"
+                    )
+                    raise ValueError(
+                        f"Incompatible array shape at index {i}. Expected {expected_shape}, got {shape}."
+                    )
+                if chunks != state["base_chunks"]:
+                    raise ValueError(
+                        f"Incompatible array chunks at index {i}. Expected {state['base_chunks']}, "
+                        f"got {chunks}."
+                    )
+                if i < (n_files - 1) and rem != 0:
+                    raise ValueError(
+                        f"Array at index {i} has irregular chunking at its boundary. "
+                        "This is only allowed for the final array."
+                    )
 
-    chunks_offset = 0
-    for i, fn in enumerate(files):
-        fs = fsspec.filesystem("reference", fo=fn, **(storage_options or {}))
-        zarray = ujson.load(fs.open(f"{path}.zarray"))
-        shape = zarray["shape"]
-        chunks = zarray["chunks"]
-        n_chunks, rem = divmod(shape[axis], chunks[axis])
-        n_chunks += rem > 0
+        # Referencing the offset chunks
+        for key in refs:
+            name, parts = _split_chunk_key(key, key_seperator, by_ndim)
+            if name is None:
+                if i == 0 and not key.endswith(".zmetadata"):
+                    parent = key.rsplit("/", 1)[0] + "/" if "/" in key else ""
+                    if _is_meta_key(key):
+                        keep = (
+                            parent in groups
+                            or parent in copied_names
+                            or (parent in arrays and not key.endswith(".zarray"))
+                        )
+                    else:
+                        # chunks of copied arrays; scalars have the single key "0"
+                        copy_of, _ = _split_chunk_key(key, key_seperator, copied)
+                        keep = copy_of is not None or (
+                            key == parent + "0" and parent in copied.get(0, ())
+                        )
+                    if keep:
+                        refs_out[key] = refs[key]
+                continue
+            state = arrays[name]
+            parts[axis] = str(int(parts[axis]) + state["offset"])
+            refs_out[name + key_seperator.join(parts)] = refs[key]
+
+        for name, state in arrays.items():
+            state["offset"] += n_chunks[name]
+
+    for name, state in arrays.items():
+        refs_out[f"{name}.zarray"] = ujson.dumps(state["zarray"])
+
+    if out is None:
+        return consolidate(refs_out)
+    for meta in (True, False):
+        for k in refs_out:
+            if _is_meta_key(k) == meta:
+                out[k] = refs_out[k]
+    if hasattr(out, "flush"):
+        out.flush()
+    return out
 
-        if i == 0:
-            base_shape = _replace(shape, axis, None)
-            base_chunks = chunks
-            # result_* are modified in-place
-            result_zarray = zarray
-            result_shape = shape
-            for name in [".zgroup", ".zattrs", f"{path}.zattrs"]:
-                if name in fs.references:
-                    out[name] = fs.references[name]
-        else:
-            result_shape[axis] += shape[axis]
 
-        # Safety checks
-        if check_arrays:
-            if _replace(shape, axis, None) != base_shape:
-                expected_shape = (
-                    f"[{', '.join(map(str, _replace(base_shape, axis, '*')))}]"
-                )
-                raise ValueError(
-                    f"Incompatible array shape at index {i}. Expected {expected_shape}, got {shape}."
-                )
-            if chunks != base_chunks:
-                raise ValueError(
-                    f"Incompatible array chunks at index {i}. Expected {base_chunks}, got {chunks}."
-                )
-            if i < (n_files - 1) and rem != 0:
-                raise ValueError(
-                    f"Array at index {i} has irregular chunking at its boundary. "
-                    "This is only allowed for the final array."
-                )
+def _is_meta_key(key):
+    return key.startswith(".z") or "/.z" in key
 
-        # Referencing the offset chunks
-        for key in fs.find(""):
-            if key.startswith(f"{path}.z") or not key.startswith(path):
-                continue
-            parts = key.lstrip(path).split(key_seperator)
-            parts[axis] = str(int(parts[axis]) + chunks_offset)
-            key2 = path + key_seperator.join(parts)
-            out[key2] = fs.references[key]
 
-        chunks_offset += n_chunks
+def _load_meta(value):
+    if isinstance(value, dict):
+        return value
+    return ujson.loads(value)
 
-    out[f"{path}.zarray"] = ujson.dumps(result_zarray)
 
-    return consolidate(out)
+def _split_chunk_key(key, sep, by_ndim):
+    """Find the array prefix and chunk index parts of a key
+
+    Returns (None, None) for metadata or keys not belonging to any of the arrays,
+    given as {ndim: {prefix}}.
+    """
+    if _is_meta_key(key):
+        return None, None
+    if sep == ".":
+        prefix, _, chunk = key.rpartition("/")
+        prefix = prefix + "/" if prefix else ""
+        parts = chunk.split(".")
+        if prefix in by_ndim.get(len(parts), ()):
+            return prefix, parts
+        return None, None
+    bits = key.split("/")
+    for ndim, names in by_ndim.items():
+        if ndim and len(bits) >= ndim:
+            prefix = "/".join(bits[:-ndim])
+            prefix = prefix + "/" if prefix else ""
+            if prefix in names:
+                return prefix, bits[-ndim:]
+    return None, None
+
+
+def _iter_flat_refs(files, storage_options=None, batch_size=32):
+    """Generate the flat references dict of each input
+
+    Paths are loaded in batches with one concurrent ``cat``; anything that cannot be
+    loaded as JSON (such as a parquet directory) is opened via ReferenceFileSystem.
+    """
+    so = storage_options or {}
+
+    def _flat(fo):
+        if isinstance(fo, collections.abc.Mapping) and (
+            "refs" not in fo or not (fo.get("templates") or fo.get("gen"))
+        ):
+            return fo.get("refs", fo)
+        return fsspec.filesystem("reference", fo=fo, **so).references
+
+    if not isinstance(files[0], str):
+        for fo in files:
+            yield _flat(fo)
+        return
+    target_options = so.get("target_options") or {}
+    if so.get("target_protocol"):
+        fs = fsspec.filesystem(so["target_protocol"], **target_options)
+    else:
+        fs = fsspec.core.url_to_fs(files[0], **target_options)[0]
+    for i in range(0, len(files), batch_size):
+        batch = files[i : i + batch_size]
+        data = fs.cat(batch, on_error="return")
+        for fn in batch:
+            # results are keyed (and sorted) by path; keep the input order
+            value = data.get(fs._strip_protocol(fn))
+            if isinstance(value, bytes):
+                try:
+                    yield _flat(ujson.loads(value))
+                    continue
+                except ValueError:
+                    pass
+            yield _flat(fn)
 
 
 def auto_dask(
@@ -1,11 +1,15 @@
 import base64
+import codecs
+import concurrent.futures
+import json
 import logging
+import os
+import re
+import threading
 
 import ujson
 import pandas as pd
 import fsspec
-import zarr
-
 
 # example from preffs's README'
 df = pd.DataFrame(
@@ -19,6 +23,9 @@ df = pd.DataFrame(
 )
 
 logger = logging.getLogger("kerchunk.df")
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+_ZARR_META = (".zarray", ".zgroup", ".zattrs")
 
 
 def _proc_raw(r):
@@ -33,7 +40,7 @@ def get_variables(refs, consolidated=True):
     """Get list of variable names from references.
 
     Finds the top-level prefixes in a reference set, corresponding to
-    the directory listing of the root for zarr.
+    the directory listing of the root for zarr. Keys may be nested to any depth.
 
     Parameters
     ----------
@@ -47,24 +54,18 @@ def get_variables(refs, consolidated=True):
     fields : list of str
         List of variable names.
     """
-    fields = []
+    # dict as an insertion-ordered set
+    fields = {}
     meta = {}
     for k in refs:
-        if ".z" in k and consolidated:
-            meta[k] = refs[k]
-        if "/" in k:
-            name, chunk = k.split("/")
-            if name not in fields:
-                fields.append(name)
-            else:
-                continue
-        else:
-            fields.append(k)
+        fields[k.split("/", 1)[0]] = None
+        if consolidated and k.endswith(_ZARR_META):
+            v = refs[k]
+            meta[k] = v if isinstance(v, dict) else ujson.loads(_proc_raw(v))
     if consolidated and ".zmetadata" not in fields:
-        zarr.consolidate_metadata(meta)
-        refs[".zmetadata"] = ujson.loads(meta[".zmetadata"])
-        fields.append(".zmetadata")
-    return fields
+        refs[".zmetadata"] = {"zarr_consolidated_format": 1, "metadata": meta}
+        fields[".zmetadata"] = None
+    return list(fields)
 
 
 def _normalize_json(json_obj):
@@ -106,6 +107,9 @@ def refs_to_dataframe(
     storage_options=None,
     record_size=100_000,
     categorical_threshold=10,
+    blocksize=2**22,
+    max_workers=None,
+    profile=None,
 ):
     """Write references as a parquet files store.
 
@@ -116,7 +120,8 @@ def refs_to_dataframe(
     ----------
     fo : str | dict
         Location of a JSON file containing references or a reference set already loaded
-        into memory.
+        into memory. A JSON file is parsed incrementally, so that memory use depends
+        on ``record_size`` and the number of variables, not the size of the file.
     url : str
         Location for the output, together with protocol. This must be a writable
         directory.
@@ -134,22 +139,25 @@ def refs_to_dataframe(
         Encode urls as pandas.Categorical to reduce memory footprint if the ratio
         of the number of unique urls to total number of refs for each variable
         is greater than or equal to this number. (default 10)
+    blocksize : int
+        Number of bytes to read at a time, when ``fo`` is a JSON file.
+    max_workers : int | None
+        Number of threads encoding and writing record files concurrently; None for the
+        ``concurrent.futures`` default. Records are written as soon as they are full.
+    profile : str | None
+        Parquet encoding of the record files. None writes them like
+        ``LazyReferenceMapper``. "compact" (requires pyarrow) always dictionary-encodes
+        paths and inlined data, so that repeated values are stored once per record
+        file, delta-encodes offsets and sizes, and writes column statistics;
+        typically several times smaller where offsets are monotonic and sizes
+        nearly constant. Either is readable by ``LazyReferenceMapper``.
     """
+    if profile not in (None, "compact"):
+        raise ValueError(f"Unknown parquet encoding profile: {profile}")
+    if profile == "compact":
+        import pyarrow  # noqa: F401
     from fsspec.implementations.reference import LazyReferenceMapper
 
-    if isinstance(fo, str):
-        # JSON file
-        dic = dict(**(target_options or {}), protocol=target_protocol)
-        with fsspec.open(fo, "rb", **dic) as f:
-            logger.info("Read reference from URL %s", fo)
-            refs = ujson.load(f)
-    else:
-        # Mapping object
-        refs = fo
-
-    if "refs" in refs:
-        refs = refs["refs"]
-
     fs, _ = fsspec.core.url_to_fs(url, **(storage_options or {}))
     out = LazyReferenceMapper.create(
         record_size=record_size,
@@ -158,6 +166,350 @@ def refs_to_dataframe(
         categorical_threshold=categorical_threshold,
     )
 
-    for k in sorted(refs):
-        out[k] = refs[k]
+    if isinstance(fo, str):
+        # JSON file, parsed incrementally
+        dic = dict(**(target_options or {}), protocol=target_protocol)
+
+        def items():
+            with fsspec.open(fo, "rb", **dic) as f:
+                logger.info("Read reference from URL %s", fo)
+                yield from _iter_json_refs(f, blocksize)
+
+    else:
+        # Mapping object
+        refs = fo
+        if "refs" in refs:
+            refs = refs["refs"]
+
+        def items():
+            return ((k, refs[k]) for k in sorted(refs))
+
+    records = {}
+    local = threading.local()
+    max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers)
+    futures = set()
+
+    def write(field, record, partition):
+        if profile == "compact":
+            fs.mkdirs(f"{out.root}/{field}", exist_ok=True)
+            with fs.open(f"{out.root}/{field}/refs.{record}.parq", "wb") as f:
+                _write_compact(f, *_partition_columns(partition, record_size))
+            return
+        # each thread has its own mapper, so the in-memory records are not shared
+        if not hasattr(local, "writer"):
+            local.writer = LazyReferenceMapper(
+                out.root, fs, categorical_threshold=categorical_threshold
+            )
+        local.writer._items[(field, record)] = partition
+        local.writer.write(field, record)
+
+    def submit(field, record):
+        futures.add(pool.submit(write, field, record, records.pop((field, record))))
+        if len(futures) > 2 * max_workers:
+            # bound the records held in memory by waiting for writes to finish
+            done, _ = concurrent.futures.wait(
+                futures, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for fut in done:
+                futures.remove(fut)
+                fut.result()
+
+    def put(k, v):
+        if out._is_meta(k):
+            out[k] = v
+            return
+        field = k.rsplit("/", 1)[0]
+        record, i, _ = out._key_to_record(k)
+        partition = records.setdefault((field, record), {})
+        partition[i] = v
+        if len(partition) == record_size:
+            submit(field, record)
+
+    pending = {}
+    npending = 0
+    scanned = False
+    with pool:
+        for k, v in items():
+            field = k.rsplit("/", 1)[0] if "/" in k else None
+            if field is None:
+                out[k] = v
+                continue
+            if out._is_meta(k) or scanned or f"{field}/.zarray" in out.zmetadata:
+                put(k, v)
+                if k.endswith("/.zarray"):
+                    for k2, v2 in pending.pop(field, []):
+                        put(k2, v2)
+                    npending = sum(len(p) for p in pending.values())
+                continue
+            # chunk before its array's metadata: hold on to it for now
+            pending.setdefault(field, []).append((k, v))
+            npending += 1
+            if npending > record_size:
+                # too many to hold; get all the metadata from a separate pass
+                logger.info("Scanning %s for metadata", fo)
+                for k2, v2 in items():
+                    if out._is_meta(k2):
+                        out[k2] = v2
+                scanned = True
+        for field in list(pending):
+            for k, v in pending.pop(field):
+                put(k, v)
+        for field, record in list(records):
+            submit(field, record)
+        for fut in concurrent.futures.as_completed(futures):
+            fut.result()
     out.flush()
+
+
+def _partition_columns(partition, record_size):
+    """Column arrays of one record from its {index: reference} dict"""
+    import numpy as np
+
+    paths = np.full(record_size, None, dtype="O")
+    offsets = np.zeros(record_size, dtype="int64")
+    sizes = np.zeros(record_size, dtype="int64")
+    raws = np.full(record_size, None, dtype="O")
+    for j, data in partition.items():
+        if isinstance(data, list):
+            paths[j] = data[0]
+            if len(data) > 1:
+                offsets[j] = data[1]
+                sizes[j] = data[2]
+        elif data is not None:
+            raws[j] = _proc_raw(data)
+    return paths, offsets, sizes, raws
+
+
+def _write_compact(f, paths, offsets, sizes, raws):
+    """Write one record file with dictionary, delta and statistics encodings"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.table(
+        {
+            "path": pa.array(paths, pa.string()),
+            "offset": pa.array(offsets, pa.int64()),
+            "size": pa.array(sizes, pa.int64()),
+            "raw": pa.array(raws, pa.binary()),
+        }
+    )
+    pq.write_table(
+        table,
+        f,
+        compression="zstd",
+        use_dictionary=["path", "raw"],
+        column_encoding={
+            "offset": "DELTA_BINARY_PACKED",
+            "size": "DELTA_BINARY_PACKED",
+        },
+        write_statistics=True,
+    )
+
+
+def compact_parquet(
+    url,
+    url_out=None,
+    record_size=None,
+    storage_options=None,
+    categorical_threshold=10,
+    profile=None,
+):
+    """Rewrite a parquet reference store into dense, ordered record files
+
+    After many updates (e.g., by ``MultiZarrToZarr.append``), a store may hold
+    partly filled record files, and files or variables no longer described by
+    the metadata. This writes each variable afresh, one record at a time, keeping
+    only the references within the current chunk grid and skipping records with
+    no references at all; ``.zmetadata`` is rebuilt.
+
+    Parameters
+    ----------
+    url : str
+        Location of the parquet reference store
+    url_out : str | None
+        Where to write the compacted store. This is the safe way to compact a
+        store which may be read meanwhile: the original is left as it is, and
+        readers can be pointed at the new location once this returns. If None,
+        the compacted store is written to a sibling directory and then replaces
+        the original, by moving the original to ``<url>.old``, moving the new
+        store to ``url``, and deleting the old one. This is *not* atomic:
+        between the moves there is no store at ``url``, and on object stores
+        each move is a copy then a delete, so readers may find a missing or
+        partial store. If interrupted, the original remains at ``<url>.old``.
+    record_size : int | None
+        References per record file in the output; if None, keep that of the input.
+    storage_options : dict | None
+        Passed to fsspec for reading and writing
+    categorical_threshold : int
+        As for ``refs_to_dataframe``
+    profile : str | None
+        Parquet encoding of the output, as for ``refs_to_dataframe``
+    """
+    import math
+
+    import numpy as np
+    from fsspec.implementations.reference import LazyReferenceMapper
+
+    from kerchunk.utils import _write_parquet_refs
+
+    if profile not in (None, "compact"):
+        raise ValueError(f"Unknown parquet encoding profile: {profile}")
+    fs, root = fsspec.core.url_to_fs(url, **(storage_options or {}))
+    root = root.rstrip("/")
+    # only one record held in the read cache
+    lazy = LazyReferenceMapper(root, fs=fs, cache_size=1)
+    old_size = lazy.record_size
+    record_size = record_size or old_size
+    out_root = (
+        fs._strip_protocol(url_out).rstrip("/") if url_out else f"{root}.compacting"
+    )
+    if fs.exists(out_root):
+        fs.rm(out_root, recursive=True)
+    fs.makedirs(out_root, exist_ok=True)
+
+    def write(field, record, paths, offsets, sizes, raws):
+        if pd.isna(paths).all() and pd.isna(raws).all():
+            return
+        fn = f"{out_root}/{field}/refs.{record}.parq"
+        fs.makedirs(f"{out_root}/{field}", exist_ok=True)
+        with fs.open(fn, "wb") as f:
+            if profile == "compact":
+                _write_compact(f, paths, offsets, sizes, raws)
+                return
+            df = pd.DataFrame(
+                {"path": paths, "offset": offsets, "size": sizes, "raw": raws},
+                copy=False,
+            )
+            if df.path.count() / (df.path.nunique() or 1) > categorical_threshold:
+                df["path"] = df["path"].astype("category")
+            _write_parquet_refs(df, f)
+
+    fields = [k[: -len("/.zarray")] for k in lazy.zmetadata if k.endswith("/.zarray")]
+    for field in fields:
+        nchunks = math.prod(lazy._get_chunk_sizes(field))
+        nold = math.ceil(nchunks / old_size)
+        buffer = []
+        nbuffer = 0
+        record = 0
+        for old in range(nold):
+            # stale rows past the end of the array are dropped
+            n = min(old_size, nchunks - old * old_size)
+            try:
+                refs = lazy.open_refs(field, old) or {}
+            except (OSError, ValueError, TypeError):
+                # no file: no references
+                refs = {}
+            empty = _partition_columns({}, n)
+            buffer.append(
+                [
+                    np.asarray(refs[c][:n], dtype=e.dtype) if c in refs else e
+                    for c, e in zip(["path", "offset", "size", "raw"], empty)
+                ]
+            )
+            nbuffer += n
+            while nbuffer >= record_size or (nbuffer and old == nold - 1):
+                if nbuffer < record_size:
+                    # pad the last record, as LazyReferenceMapper does
+                    buffer.append(_partition_columns({}, record_size - nbuffer))
+                cols = [np.concatenate(c) for c in zip(*buffer)]
+                write(field, record, *(c[:record_size] for c in cols))
+                buffer = [[c[record_size:] for c in cols]]
+                nbuffer = len(cols[0]) - record_size
+                record += 1
+
+    fs.pipe(
+        f"{out_root}/.zmetadata",
+        ujson.dumps({"metadata": lazy.zmetadata, "record_size": record_size}).encode(),
+    )
+    if url_out is None:
+        # not atomic, see the docstring
+        fs.mv(root, f"{root}.old", recursive=True)
+        fs.mv(out_root, root, recursive=True)
+        fs.rm(f"{root}.old", recursive=True)
+
+
+def _iter_json_refs(f, blocksize=2**22):
+    """Yield (key, value) references from an open JSON file, without loading it all
+
+    Handles both the version 0 (flat) and version 1 (with "refs") layouts.
+    "version", "templates" and "gen" are skipped.
+    """
+    s = _JSONStream(f, blocksize)
+    s.expect("{")
+    if s.peek() == "}":
+        return
+    while True:
+        key = s.value()
+        s.expect(":")
+        if key == "refs" and s.peek() == "{":
+            s.pos += 1
+            if s.peek() != "}":
+                while True:
+                    k = s.value()
+                    s.expect(":")
+                    yield k, s.value()
+                    if s.peek() != ",":
+                        break
+                    s.pos += 1
+            s.expect("}")
+        elif key in ("version", "templates", "gen"):
+            s.value()
+        else:
+            yield key, s.value()
+        if s.peek() != ",":
+            break
+        s.pos += 1
+    s.expect("}")
+
+
+class _JSONStream:
+    """Buffered reader of JSON tokens and values from a binary file"""
+
+    def __init__(self, f, blocksize):
+        self.f = f
+        self.blocksize = blocksize
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _more(self):
+        if self.eof:
+            raise ValueError("Unexpected end of JSON references")
+        # read at least as much as is held, so that long values are not
+        # re-parsed many times
+        data = self.f.read(max(self.blocksize, len(self.buf) - self.pos))
+        self.eof = not data
+        self.buf = self.buf[self.pos :] + self.decoder.decode(data, final=self.eof)
+        self.pos = 0
+
+    def peek(self):
+        """Next non-whitespace character"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            self._more()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(
+                f"Expected {char!r} in JSON references, got {self.buf[self.pos]!r}"
+            )
+        self.pos += 1
+
+    def value(self):
+        """Next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+                # a value at the very end of the buffer may be incomplete
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._more()
@@ -5,8 +5,6 @@ import numcodecs.abc
 import numpy as np
 import zarr
 
-from fsspec.implementations.reference import LazyReferenceMapper
-
 
 from kerchunk.utils import class_factory
 from kerchunk.codecs import AsciiTableCodec, VarArrCodec
@@ -71,7 +69,7 @@ def process_file(
     from astropy.io import fits
 
     storage_options = storage_options or {}
-    out = out or {}
+    out = out if out is not None else {}
     g = zarr.open(out)
 
     with fsspec.open(url, mode="rb", **storage_options) as f:
@@ -188,7 +186,7 @@ def process_file(
                     if k != "COMMENT"
                 }
             )
-    if isinstance(out, LazyReferenceMapper):
+    if hasattr(out, "flush"):
         out.flush()
     return out
 
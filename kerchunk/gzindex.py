@@ -0,0 +1,447 @@
+"""Random access into gzip files by way of decompression checkpoints
+
+DEFLATE streams can only be decoded from the start, but decoding can resume at
+any block boundary given the 32kB of output preceding it (as in zlib's
+``examples/zran.c``). ``build_index`` makes one pass over a .gz file, storing
+such checkpoints every ``spacing`` bytes of output in a sidecar file, after
+which any byte range of the uncompressed data costs one fetch and
+decompression from the nearest preceding checkpoint.
+
+Python's zlib does not report block boundaries, so candidate bit positions near
+each intended checkpoint are tried by inflating from them with the known
+preceding output as dictionary, keeping the first whose output matches.
+"""
+
+import bisect
+import functools
+import struct
+import zlib
+
+import fsspec
+import numpy as np
+import ujson
+
+MAGIC = b"KCGZIDX1"
+WINDOW = 32768
+
+
+class GzipIndex:
+    """Checkpoints for random access into one gzip file
+
+    Usually made by ``build_index`` or ``GzipIndex.load``.
+
+    Parameters
+    ----------
+    url: str
+        location of the gzip file
+    checkpoints: list of [uncompressed offset, compressed offset, bit, window]
+        Decoding starts at the given bit (0-7) of the compressed byte; window is
+        bytes or, for an index loaded from file, [start, length] of the window
+        in the sidecar
+    size: int
+        total uncompressed size
+    csize: int
+        total compressed size
+    storage_options: dict | None
+        for reading the gzip file (and sidecar)
+    index_url: str | None
+        location of the sidecar file, if loaded from one
+    """
+
+    def __init__(
+        self, url, checkpoints, size, csize, storage_options=None, index_url=None
+    ):
+        self.url = url
+        self.checkpoints = checkpoints
+        self.uoffsets = [c[0] for c in checkpoints]
+        self.size = size
+        self.csize = csize
+        self.storage_options = storage_options or {}
+        self.index_url = index_url
+        self.fs, self.path = fsspec.core.url_to_fs(url, **self.storage_options)
+
+    @classmethod
+    def load(cls, index_url, url=None, storage_options=None):
+        """Read the checkpoint table from a sidecar file
+
+        The windows are only read from the sidecar when needed.
+        """
+        fs, path = fsspec.core.url_to_fs(index_url, **(storage_options or {}))
+        head = fs.cat_file(path, start=0, end=len(MAGIC) + 8)
+        if head[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a gzip index file: {index_url}")
+        (nhead,) = struct.unpack("<Q", head[len(MAGIC) :])
+        meta = ujson.loads(fs.cat_file(path, start=len(head), end=len(head) + nhead))
+        base = len(head) + nhead
+        checkpoints = [
+            [u, c, b, [base + w0, wl]] for u, c, b, w0, wl in meta["checkpoints"]
+        ]
+        return cls(
+            url or meta["url"],
+            checkpoints,
+            meta["size"],
+            meta["csize"],
+            storage_options=storage_options,
+            index_url=index_url,
+        )
+
+    def save(self, index_url, storage_options=None):
+        """Write the checkpoints to a sidecar file
+
+        Windows are individually zlib-compressed after a JSON table.
+        """
+        table = []
+        blobs = []
+        pos = 0
+        for k, (u, c, b, _) in enumerate(self.checkpoints):
+            w = zlib.compress(self.window(k))
+            table.append([u, c, b, pos, len(w)])
+            blobs.append(w)
+            pos += len(w)
+        meta = ujson.dumps(
+            {
+                "version": 1,
+                "url": self.url,
+                "size": self.size,
+                "csize": self.csize,
+                "checkpoints": table,
+            }
+        ).encode()
+        with fsspec.open(index_url, "wb", **(storage_options or {})) as f:
+            f.write(MAGIC + struct.pack("<Q", len(meta)) + meta)
+            for w in blobs:
+                f.write(w)
+        self.index_url = index_url
+
+    @functools.lru_cache(maxsize=16)
+    def window(self, k):
+        """The uncompressed data preceding checkpoint ``k``"""
+        w = self.checkpoints[k][3]
+        if isinstance(w, bytes):
+            return w
+        if not w[1]:
+            return b""
+        fs, path = fsspec.core.url_to_fs(self.index_url, **self.storage_options)
+        return zlib.decompress(fs.cat_file(path, start=w[0], end=w[0] + w[1]))
+
+    def compressed_range(self, start, end):
+        """Checkpoint number and compressed byte range needed for the given data"""
+        k = bisect.bisect_right(self.uoffsets, start) - 1
+        j = bisect.bisect_left(self.uoffsets, end)
+        cend = self.checkpoints[j][1] + 1 if j < len(self.checkpoints) else self.csize
+        return k, self.checkpoints[k][1], cend
+
+    def read(self, start, end):
+        """Uncompressed bytes start:end of the gzip file"""
+        end = min(end, self.size)
+        if start >= end:
+            return b""
+        k, cstart, cend = self.compressed_range(start, end)
+        u, _, bit, _ = self.checkpoints[k]
+        buf = self.fs.cat_file(self.path, start=cstart, end=cend)
+        return inflate(buf, bit, self.window(k), start - u, end - start)
+
+    def __hash__(self):
+        return id(self)
+
+
+def _gzip_header(buf):
+    """Length of the gzip member header at the start of buf"""
+    if len(buf) < 10 or buf[:2] != b"\x1f\x8b" or buf[2] != 8:
+        raise ValueError("Not a gzip member")
+    flags = buf[3]
+    pos = 10
+    if flags & 4:  # FEXTRA
+        (xlen,) = struct.unpack("<H", buf[pos : pos + 2])
+        pos += 2 + xlen
+    for flag in (8, 16):  # FNAME, FCOMMENT, zero-terminated
+        if flags & flag:
+            pos = buf.index(b"\x00", pos) + 1
+    if flags & 2:  # FHCRC
+        pos += 2
+    if pos > len(buf):
+        raise ValueError("Truncated gzip header")
+    return pos
+
+
+def _shift_bits(buf, bit):
+    """Drop the first ``bit`` bits of buf, realigning the rest to bytes"""
+    if not bit:
+        return bytes(buf)
+    a = np.frombuffer(buf, dtype="uint8").astype("uint16")
+    out = a >> bit
+    out[:-1] |= (a[1:] << (8 - bit)) & 0xFF
+    return out.astype("uint8").tobytes()
+
+
+def inflate(buf, bit, window, skip, size):
+    """Decompress ``size`` bytes after ``skip``, from a raw DEFLATE checkpoint
+
+    ``buf`` starts with the byte containing the checkpoint, of which the first
+    ``bit`` bits are ignored; ``window`` is the preceding output. Further gzip
+    members following the first are also decoded.
+    """
+    buf = bytes(buf)
+    cur = _shift_bits(buf, bit)
+    pos = 0  # where cur starts in buf
+    d = zlib.decompressobj(-15, zdict=window) if window else zlib.decompressobj(-15)
+    data = cur
+    out = bytearray()
+    need = skip + size
+    while len(out) < need:
+        out += d.decompress(data, need - len(out))
+        if d.eof:
+            # find the trailer in the unshifted data: the end of the stream
+            # may be in the last consumed byte or the one after
+            end = pos + len(cur) - len(d.unused_data)
+            for trailer in ((end, end + 1) if bit else (end,)):
+                if buf[trailer + 8 : trailer + 10] == b"\x1f\x8b":
+                    break
+            else:
+                break
+            pos = trailer + 8 + _gzip_header(buf[trailer + 8 :])
+            cur = data = buf[pos:]
+            bit = 0
+            d = zlib.decompressobj(-15)
+        else:
+            data = d.unconsumed_tail
+            if not data:
+                break
+    return bytes(out[skip:need])
+
+
+def _field(bits, start, n, width):
+    """Little-endian integer of ``width`` bits at start+q, for q in range(n)"""
+    return sum(
+        bits[start + i : start + i + n].astype("int16") << i for i in range(width)
+    )
+
+
+def _dynamic_headers(comp, n):
+    """Bit positions < n which could start a dynamic-Huffman DEFLATE block
+
+    Checks the block type, the sizes of the code tables and that the code
+    lengths for the code length alphabet form a complete prefix code, as
+    zlib requires.
+    """
+    # the header needs at most 3 + 14 + 19 * 3 bits
+    bits = np.unpackbits(
+        np.frombuffer(comp.ljust(n // 8 + 10, b"\0"), dtype="uint8"),
+        bitorder="little",
+    )
+    ok = (_field(bits, 1, n, 2) == 2) & (_field(bits, 3, n, 5) < 30)
+    ok &= _field(bits, 8, n, 5) < 30
+    ncodes = _field(bits, 13, n, 4) + 4
+    kraft = np.zeros(n, dtype="int16")
+    for i in range(19):
+        length = _field(bits, 17 + 3 * i, n, 3)
+        kraft += np.where((i < ncodes) & (length > 0), 128 >> length, 0)
+    return np.flatnonzero(ok & (kraft == 128))
+
+
+def _find_boundary(d, comp, history, search, trial=4096, check=256, slab=8192):
+    """Find the first DEFLATE block starting within comp[:search]
+
+    ``d`` is the decompressor positioned at the start of comp and ``history``
+    the output before that. Returns (byte, bit, output offset relative to the
+    start of comp, window) or None.
+    """
+    search = min(search, len(comp) - 1)
+    outs = d.copy().decompress(comp[: search + trial])
+    source = bytes(history[-WINDOW:]) + outs
+    nhist = len(source) - len(outs)
+
+    # output produced after feeding each number of bytes, found as needed;
+    # this starts with any output held back by a previous max_length
+    d2 = d.copy()
+    produced = [len(d2.decompress(b""))]
+
+    def _produced(i):
+        while len(produced) <= i:
+            j = len(produced) - 1
+            produced.append(produced[-1] + len(d2.decompress(comp[j : j + 1])))
+        return produced[i]
+
+    shifted = {}
+    windows = {}
+    for start in range(0, search, slab):
+        # look at a slab at a time, since a boundary is usually found early
+        n = min(slab, search - start) * 8
+        for q in _dynamic_headers(comp[start : start + n // 8 + 10], n).tolist():
+            p, bit = divmod(q, 8)
+            p += start
+            if bit not in shifted:
+                shifted[bit] = _shift_bits(comp[: search + trial], bit)
+            for rel in {_produced(p), _produced(p + 1)}:
+                if rel not in windows:
+                    windows[rel] = source[max(0, nhist + rel - WINDOW) : nhist + rel]
+                window = windows[rel]
+                try:
+                    dec = (
+                        zlib.decompressobj(-15, zdict=window)
+                        if window
+                        else zlib.decompressobj(-15)
+                    )
+                    got = dec.decompress(shifted[bit][p : p + trial], check)
+                except zlib.error:
+                    continue
+                expected = source[nhist + rel : nhist + rel + check]
+                if got and got == expected:
+                    return p, bit, rel, window
+    return None
+
+
+def build_index(
+    url,
+    spacing=2**22,
+    index_url=None,
+    storage_options=None,
+    blocksize=2**20,
+    search=2**18,
+):
+    """Make checkpoints for random access into a gzip file
+
+    Parameters
+    ----------
+    url: str
+        location of the gzip file
+    spacing: int
+        approximate number of uncompressed bytes between checkpoints. Reads will
+        decompress up to this much extra data.
+    index_url: str | None
+        where to write the sidecar file. If None, not written
+    storage_options: dict | None
+        for reading the gzip file and writing the sidecar
+    blocksize: int
+        number of compressed bytes to read at a time
+    search: int
+        how many compressed bytes after each intended checkpoint to look for
+        a block boundary before trying again further on
+
+    Returns
+    -------
+    GzipIndex
+    """
+    fs, path = fsspec.core.url_to_fs(url, **(storage_options or {}))
+    csize = fs.size(path)
+    history = b""
+    uout = 0
+    with fs.open(path, "rb", block_size=blocksize) as f:
+        comp = bytearray(f.read(blocksize))
+        cin = _gzip_header(comp)
+        del comp[:cin]
+        checkpoints = [[0, cin, 0, b""]]
+        target = spacing
+        d = zlib.decompressobj(-15)
+        at_end = False
+        while True:
+            # keep enough look-ahead for a boundary search
+            while not at_end and len(comp) < search + 4096 + blocksize:
+                more = f.read(blocksize)
+                at_end = not more
+                comp += more
+            step = blocksize
+            if uout >= target:
+                found = _find_boundary(d, bytes(comp), history, search)
+                if found:
+                    p, bit, rel, window = found
+                    checkpoints.append([uout + rel, cin + p, bit, window])
+                    target = uout + rel + spacing
+                else:
+                    # search again from just beyond the searched region
+                    step = search
+            piece = bytes(comp[:step])
+            if not piece:
+                break
+            # stop output at the next intended checkpoint
+            out = d.decompress(piece, max(target - uout, 0))
+            uout += len(out)
+            history = (history + out)[-WINDOW:]
+            if d.eof:
+                used = len(piece) - len(d.unused_data)
+                # skip the trailer and move to the next member, if any
+                used += 8
+                rest = bytes(comp[used : used + 4096])
+                if rest[:2] != b"\x1f\x8b":
+                    # end of data, possibly followed by padding
+                    break
+                used += _gzip_header(rest)
+                d = zlib.decompressobj(-15)
+                if uout >= target:
+                    checkpoints.append([uout, cin + used, 0, b""])
+                    target = uout + spacing
+            else:
+                used = len(piece) - len(d.unconsumed_tail)
+            del comp[:used]
+            cin += used
+    index = GzipIndex(url, checkpoints, uout, csize, storage_options=storage_options)
+    if index_url:
+        index.save(index_url, storage_options=storage_options)
+    return index
+
+
+def gzip_references(refs, index, source=None):
+    """Point references made on uncompressed data into the gzip file instead
+
+    Scan the uncompressed data with any kerchunk backend, then call this with
+    the index of the gzip file. Each chunk then holds its uncompressed byte
+    range (zarr passes no chunk location to codecs), and its array gets
+    ``GzipIndexCodec`` as compressor, which decompresses from the nearest
+    checkpoint on read. Any original compressor becomes the last filter.
+
+    Parameters
+    ----------
+    refs: dict
+        references, modified in place
+    index: GzipIndex
+        as saved to a sidecar, whose location is recorded in the codec
+    source: str | None
+        URL of the uncompressed data in refs. If None, all references to
+        byte ranges are taken to be into the uncompressed data
+
+    Returns
+    -------
+    The modified references
+    """
+    from kerchunk.codecs import GzipIndexCodec
+
+    if index.index_url is None:
+        raise ValueError("Save the index to a sidecar before making references")
+    store = refs["refs"] if "refs" in refs else refs
+    codec = GzipIndexCodec(
+        index=index.index_url, target=index.url, storage_options=index.storage_options
+    ).get_config()
+    arrays = set()
+    done = set()
+    for k, v in store.items():
+        if isinstance(v, list) and (source is None or v[0] == source):
+            offset, size = (v[1], v[2]) if len(v) == 3 else (0, index.size)
+            store[k] = ujson.dumps({"offset": offset, "size": size})
+            arrays.add(k.rsplit("/", 1)[0] if "/" in k else "")
+            done.add(k)
+    for k, v in store.items():
+        arr, part = k.rsplit("/", 1) if "/" in k else ("", k)
+        if arr not in arrays or k in done:
+            continue
+        if part == ".zarray":
+            meta = ujson.loads(v)
+            if meta["compressor"] is not None:
+                meta["filters"] = (meta["filters"] or []) + [meta["compressor"]]
+            meta["compressor"] = codec
+            store[k] = ujson.dumps(meta)
+        elif not part.startswith(".z"):
+            # inlined chunks of the same arrays must also pass through the codec
+            store[k] = ujson.dumps({"raw": _b64(v)})
+    # consolidated metadata would now be out of date
+    store.pop(".zmetadata", None)
+    return refs
+
+
+def _b64(v):
+    import base64
+
+    if isinstance(v, str):
+        v = v.encode()
+    if v.startswith(b"base64:"):
+        return v[7:].decode()
+    return base64.b64encode(v).decode()
@@ -5,7 +5,6 @@ import pathlib
 from typing import Union, BinaryIO
 
 import fsspec.core
-from fsspec.implementations.reference import LazyReferenceMapper
 import numpy as np
 import zarr
 import numcodecs
@@ -112,7 +111,7 @@ class SingleHdf5ToZarr:
         if vlen_encode not in ["embed", "null", "leave", "encode"]:
             raise NotImplementedError
         self.vlen = vlen_encode
-        self.store = out or {}
+        self.store = out if out is not None else {}
         self._zroot = zarr.group(store=self.store, overwrite=True)
 
         self._uri = url
@@ -154,7 +153,7 @@ class SingleHdf5ToZarr:
 
         if self.spec < 1:
             return self.store
-        elif isinstance(self.store, LazyReferenceMapper):
+        elif hasattr(self.store, "flush"):
             self.store.flush()
             return self.store
         else:
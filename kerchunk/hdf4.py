@@ -27,7 +27,7 @@ class HDF4ToZarr:
         self.path = path
         self.st = storage_options
         self.thresh = inline_threshold
-        self.out = out or {}
+        self.out = out if out is not None else {}
 
     def read_int(self, n):
         return int.from_bytes(self.f.read(n), "big")
@@ -2,7 +2,6 @@ from functools import reduce
 from operator import mul
 
 import numpy as np
-from fsspec.implementations.reference import LazyReferenceMapper
 import fsspec
 
 from kerchunk.utils import _encode_for_JSON, inline_array
@@ -63,7 +62,7 @@ class NetCDF3ToZarr(netcdf_file):
         self.chunks = {}
         self.threshold = inline_threshold
         self.max_chunk_size = max_chunk_size
-        self.out = out or {}
+        self.out = out if out is not None else {}
         self.storage_options = storage_options
         self.fp = fsspec.open(filename, **(storage_options or {})).open()
         magic = self.fp.read(4)
@@ -291,7 +290,7 @@ class NetCDF3ToZarr(netcdf_file):
                 remote_options=dict(remote_options=self.storage_options),
             )
 
-        if isinstance(out, LazyReferenceMapper):
+        if hasattr(out, "flush"):
             out.flush()
             return out
         else:
@@ -0,0 +1,209 @@
+"""Reference sets held in an SQLite database
+
+A database file gives indexed single-key lookups and cheap in-place updates,
+which suits reference sets that are built up or amended a piece at a time
+(e.g., appending with ``MultiZarrToZarr``), where rewriting JSON or parquet
+record files for each change would be expensive.
+"""
+
+import collections.abc
+import sqlite3
+import threading
+
+from kerchunk.utils import _as_bytes, _open_refs, write_refs
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS refs (
+    key TEXT PRIMARY KEY,
+    url TEXT,
+    offset INTEGER,
+    size INTEGER,
+    raw BLOB
+) WITHOUT ROWID
+"""
+
+
+class SQLiteReferences(collections.abc.MutableMapping):
+    """Dict-like reference set stored in a local SQLite database file
+
+    Each key is one row, holding either the URL, offset and size of a reference
+    or the bytes of inlined data or metadata. Writes are buffered in memory and
+    committed ``batch_size`` at a time, each batch in one transaction; the
+    database uses write-ahead logging, so readers are not blocked by a writer.
+
+    Can be given as ``out=`` to the scanners and ``MultiZarrToZarr``, which
+    call ``flush()`` at the end, and as ``fo=`` to ``ReferenceFileSystem``.
+    Inlined values come back as bytes, as from ``LazyReferenceMapper``.
+    """
+
+    def __init__(self, path, batch_size=10_000, mode="a"):
+        """
+        Parameters
+        ----------
+        path: str
+            Local database file; created if it does not exist
+        batch_size: int
+            Number of changes held in memory before they are committed
+        mode: "a" | "w"
+            "w" removes any references already in the database
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self._pending = {}  # key -> row, or None if deleted
+        self._lock = threading.RLock()
+        # may be read from fsspec's IO thread
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(_SCHEMA)
+            if mode == "w":
+                self._conn.execute("DELETE FROM refs")
+
+    @classmethod
+    def from_refs(cls, refs, path, storage_options=None, **kwargs):
+        """Make a database from references
+
+        Parameters
+        ----------
+        refs: dict | str
+            References, or the URL of a JSON file or parquet directory of them
+        path: str
+            Database file to write; any references already in it are removed
+        storage_options: dict | None
+            For opening ``refs``, if given by URL
+        kwargs: passed to the constructor
+        """
+        out = cls(path, mode="w", **kwargs)
+        refs = _open_refs(refs, storage_options)
+        for k in refs:
+            try:
+                out[k] = refs[k]
+            except KeyError:
+                # listed by a parquet store, but not set
+                pass
+        out.flush()
+        return out
+
+    def to_json(self, url, storage_options=None):
+        """Write all references to a JSON file"""
+        self.flush()
+        write_refs(self, url, storage_options=storage_options)
+
+    def to_parquet(self, url, storage_options=None, record_size=10_000):
+        """Write all references to a parquet reference store"""
+        self.flush()
+        write_refs(
+            self,
+            url,
+            storage_options=storage_options,
+            kind="parquet",
+            record_size=record_size,
+        )
+
+    @staticmethod
+    def _to_row(key, value):
+        if isinstance(value, list):
+            if len(value) == 3:
+                # may be numpy integers, e.g., from parquet
+                return key, value[0], int(value[1]), int(value[2]), None
+            return key, value[0], None, None, None
+        return key, None, None, None, _as_bytes(value)
+
+    @staticmethod
+    def _from_row(url, offset, size, raw):
+        if raw is not None:
+            return raw
+        if offset is None:
+            return [url]
+        return [url, offset, size]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._pending[key] = self._to_row(key, value)
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def __getitem__(self, key):
+        with self._lock:
+            if key in self._pending:
+                row = self._pending[key]
+                if row is None:
+                    raise KeyError(key)
+                return self._from_row(*row[1:])
+            row = self._conn.execute(
+                "SELECT url, offset, size, raw FROM refs WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self._from_row(*row)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        with self._lock:
+            self._pending[key] = None
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key] is not None
+            return (
+                self._conn.execute(
+                    "SELECT 1 FROM refs WHERE key = ?", (key,)
+                ).fetchone()
+                is not None
+            )
+
+    def __iter__(self):
+        # pages of keys, so that the mapping can be changed while iterating
+        last = ""
+        while True:
+            with self._lock:
+                self.flush()
+                keys = [
+                    k
+                    for (k,) in self._conn.execute(
+                        "SELECT key FROM refs WHERE key > ? ORDER BY key LIMIT ?",
+                        (last, self.batch_size),
+                    )
+                ]
+            yield from keys
+            if len(keys) < self.batch_size:
+                return
+            last = keys[-1]
+
+    def __len__(self):
+        with self._lock:
+            self.flush()
+            return self._conn.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+
+    def flush(self):
+        """Commit all pending changes in one transaction"""
+        with self._lock:
+            if not self._pending:
+                return
+            rows = [r for r in self._pending.values() if r is not None]
+            deleted = [(k,) for k, r in self._pending.items() if r is None]
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO refs VALUES (?, ?, ?, ?, ?)", rows
+                )
+                self._conn.executemany("DELETE FROM refs WHERE key = ?", deleted)
+            self._pending.clear()
+
+    def close(self):
+        """Commit pending changes and close the database"""
+        self.flush()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __repr__(self):
+        return f"<SQLiteReferences {self.path}>"
@@ -1,8 +1,9 @@
 import base64
-import copy
+import hashlib
 import itertools
 import warnings
 
+import numpy as np
 import ujson
 
 import fsspec
@@ -42,17 +43,84 @@ def consolidate(refs):
     """Turn raw references into output"""
     out = {}
     for k, v in refs.items():
-        if isinstance(v, bytes):
-            try:
-                # easiest way to test if data is ascii
-                out[k] = v.decode("ascii")
-            except UnicodeDecodeError:
-                out[k] = (b"base64:" + base64.b64encode(v)).decode()
+        if type(v) is list:
+            out[k] = v
+        elif isinstance(v, bytes):
+            out[k] = _encode_bytes(v)
         else:
             out[k] = v
     return {"version": 1, "refs": out}
 
 
+def _encode_bytes(v):
+    try:
+        # easiest way to test if data is ascii
+        return v.decode("ascii")
+    except UnicodeDecodeError:
+        return (b"base64:" + base64.b64encode(v)).decode()
+
+
+def write_refs(
+    refs,
+    url,
+    storage_options=None,
+    kind="json",
+    batch_size=10_000,
+    record_size=10_000,
+):
+    """Write references to JSON or parquet without making a consolidated copy
+
+    Equivalent to dumping the output of ``consolidate``, but the keys are encoded and
+    written ``batch_size`` at a time, so that only one batch of encoded values is
+    in memory at once. Reference lists are passed through as they are; only
+    inlined values are encoded.
+
+    Parameters
+    ----------
+    refs: dict-like
+        Raw references, e.g., as made by a scanner or ``MultiZarrToZarr``
+    url: str
+        Output location (file for JSON, directory for parquet)
+    storage_options: dict | None
+        For opening the output
+    kind: "json" | "parquet" | "binary"
+        Output format; see ``kerchunk.binref`` for "binary"
+    batch_size: int
+        Number of keys to encode and write at once, for JSON
+    record_size: int
+        Number of references per parquet file
+    """
+    if kind == "parquet":
+        from kerchunk.df import refs_to_dataframe
+
+        refs_to_dataframe(
+            refs, url, storage_options=storage_options, record_size=record_size
+        )
+        return
+    if kind == "binary":
+        from kerchunk.binref import write_binary_refs
+
+        write_binary_refs(refs, url, storage_options=storage_options)
+        return
+    if kind != "json":
+        raise ValueError(f"Unknown output kind: {kind}")
+    with fsspec.open(url, mode="wt", **(storage_options or {})) as f:
+        f.write('{"version":1,"refs":{')
+        first = True
+        batch = []
+        for k, v in refs.items():
+            if isinstance(v, bytes):
+                v = _encode_bytes(v)
+            batch.append(f"{ujson.dumps(k)}:{ujson.dumps(v)}")
+            if len(batch) >= batch_size:
+                f.write(("" if first else ",") + ",".join(batch))
+                first = False
+                batch.clear()
+        if batch:
+            f.write(("" if first else ",") + ",".join(batch))
+        f.write("}}")
+
+
 def rename_target(refs, renames):
     """Utility to change URLs in a reference set in a predictable way
 
@@ -116,29 +184,182 @@ def rename_target_files(
         ujson.dump(new, f)
 
 
+def rename_target_parquet(
+    url, renames, url_out=None, storage_options=None, max_workers=None
+):
+    """Perform URL renames on a parquet reference store, file by file
+
+    Only the ``path`` column of each record file is read to find the URLs, and
+    only its dictionary of distinct URLs is renamed; files without any matching
+    URL are left untouched. Changed files are written with the encodings,
+    compression and statistics they had (e.g., of the "compact" profile of
+    ``refs_to_dataframe``). Requires pyarrow. The record files are processed
+    concurrently in threads.
+
+    Parameters
+    ----------
+    url: str
+        Root directory of the parquet references, as made by
+        ``LazyReferenceMapper`` or ``kerchunk.df.refs_to_dataframe``
+    renames: dict[str, str]
+        Mapping from the old URL to new URL
+    url_out: str | None
+        Where to write to. If None, changes the original in place
+    storage_options: dict | None
+        passed to fsspec for the input and output
+    max_workers: int | None
+        Number of threads to use
+
+    Returns
+    -------
+    Number of record files changed
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    fs, root = fsspec.core.url_to_fs(url, **(storage_options or {}))
+    root = root.rstrip("/")
+    if url_out is None:
+        root_out = root
+    else:
+        root_out = fs._strip_protocol(url_out).rstrip("/")
+        fs.makedirs(root_out, exist_ok=True)
+        fs.copy(f"{root}/.zmetadata", f"{root_out}/.zmetadata")
+    files = [f for f in fs.find(root) if f.rsplit("/", 1)[-1].startswith("refs.")]
+
+    def _one(fn):
+        return _rename_parquet_file(fs, fn, root_out + fn[len(root) :], renames)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        return sum(ex.map(_one, files))
+
+
+def _rename_parquet_file(fs, fn, fn_out, renames):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    with fs.open(fn, "rb") as f:
+        pf = pq.ParquetFile(f, read_dictionary=["path"])
+        # only the path column is read to find whether anything changes
+        paths = pf.read(columns=["path"]).column("path").combine_chunks()
+        cats = paths.dictionary.to_pylist()
+        new = [renames.get(c, c) for c in cats]
+        changed = new != cats
+        if changed:
+            table = pf.read()
+            layout = _parquet_layout(pf.metadata)
+    if not changed:
+        if fn_out != fn:
+            fs.copy(fn, fn_out)
+        return False
+    paths = pa.DictionaryArray.from_arrays(paths.indices, pa.array(new, pa.string()))
+    if len(set(new)) < len(new):
+        # renames merge some URLs
+        paths = paths.dictionary_decode().dictionary_encode()
+    table = table.set_column(table.schema.get_field_index("path"), "path", paths)
+    fs.makedirs(fn_out.rsplit("/", 1)[0], exist_ok=True)
+    with fs.open(fn_out, "wb") as f:
+        pq.write_table(table, f, **layout)
+    return True
+
+
+def _parquet_layout(metadata):
+    """pyarrow write options reproducing the encodings of an existing file"""
+    rg = metadata.row_group(0)
+    cols = [rg.column(i) for i in range(rg.num_columns)]
+    return {
+        "use_dictionary": [
+            c.path_in_schema
+            for c in cols
+            if any("DICTIONARY" in e for e in c.encodings)
+        ],
+        "column_encoding": {
+            c.path_in_schema: "DELTA_BINARY_PACKED"
+            for c in cols
+            if "DELTA_BINARY_PACKED" in c.encodings
+        },
+        "compression": {
+            c.path_in_schema: (
+                "none" if c.compression == "UNCOMPRESSED" else c.compression.lower()
+            )
+            for c in cols
+        },
+        "write_statistics": [c.path_in_schema for c in cols if c.is_stats_set],
+    }
+
+
+def _write_parquet_refs(df, f):
+    """Write one record file with the same encoding as LazyReferenceMapper"""
+    df.to_parquet(
+        f,
+        engine="fastparquet",
+        compression="zstd",
+        index=False,
+        stats=False,
+        object_encoding={
+            c: e for c, e in (("raw", "bytes"), ("path", "utf8")) if c in df
+        },
+        has_nulls=[c for c in ("path", "raw") if c in df],
+    )
+
+
+_JSON_START = ("{", "[", b"{", b"[")
+
+
 def _encode_for_JSON(store):
-    """Make store JSON encodable"""
-    for k, v in store.copy().items():
-        if isinstance(v, list):
+    """JSON encodable copy of store; the given store is not changed"""
+    out = {}
+    for k, v in store.items():
+        if type(v) is list:
+            out[k] = v
             continue
-        else:
+        if isinstance(v, (str, bytes)) and v[:64].lstrip()[:1] in _JSON_START:
             try:
                 # minify JSON
                 v = ujson.dumps(ujson.loads(v))
             except (ValueError, TypeError):
                 pass
+        if isinstance(v, bytes):
             try:
-                store[k] = v.decode() if isinstance(v, bytes) else v
+                v = v.decode()
             except UnicodeDecodeError:
-                store[k] = "base64:" + base64.b64encode(v).decode()
-    return store
+                v = "base64:" + base64.b64encode(v).decode()
+        out[k] = v
+    return out
 
 
-def do_inline(store, threshold, remote_options=None, remote_protocol=None):
+def do_inline(
+    store,
+    threshold,
+    remote_options=None,
+    remote_protocol=None,
+    max_gap=64_000,
+    max_block=256_000_000,
+    batch_size=None,
+):
     """Replace short chunks with the value of that chunk and inline metadata
 
     The chunk may need encoding with base64 if not ascii, so actual
     length may be larger than threshold.
+
+    Candidate byte ranges are grouped by target file, and neighbouring ranges
+    merged into single requests. These are fetched concurrently, ``batch_size``
+    at a time, and the results written into the output as each batch arrives.
+
+    Parameters
+    ----------
+    store: dict or dict-like
+        reference set. If not a dict (e.g., LazyReferenceMapper), it is updated in place
+    threshold: int
+        size below which chunks are inlined
+    remote_options, remote_protocol:
+        for accessing the target files
+    max_gap: int
+        merge ranges in the same file that are separated by no more than this many
+        bytes
+    max_block: int
+        do not merge ranges if the result would be bigger than this
+    batch_size: int | None
+        number of requests to make concurrently; default is fsspec's configured value
     """
     fs = fsspec.filesystem(
         "reference",
@@ -146,65 +367,87 @@ def do_inline(store, threshold, remote_options=None, remote_protocol=None):
         remote_options=remote_options,
         remote_protocol=remote_protocol,
     )
-    out = fs.references.copy()
+    refs = fs.references
+    out = refs.copy() if isinstance(refs, dict) else refs
 
     # Inlining is done when one of two conditions are satisfied:
     # 1. The item is small enough, i.e. smaller than the threshold specified in the function call
     # 2. The item is a metadata file, i.e. a .z* file
-    get_keys = [
-        k
-        for k, v in out.items()
-        if (isinstance(v, list) and len(v) == 3 and v[2] < threshold)
-        or (
-            isinstance(v, list)
-            and len(v) == 1
-            and isinstance(v[0], str)
-            and v[0].split("/")[-1].startswith(".z")
-        )
-    ]
-    values = fs.cat(get_keys)
-    for k, v in values.items():
-        try:
-            # easiest way to test if data is ascii
-            v.decode("ascii")
-        except UnicodeDecodeError:
-            v = b"base64:" + base64.b64encode(v)
-        out[k] = v
-    return out
+    ranges = []
+    whole = []
+    for k, v in refs.items():
+        if not isinstance(v, list) or not isinstance(v[0], str):
+            continue
+        if len(v) == 3 and v[2] < threshold:
+            ranges.append((v[0], v[1], v[1] + v[2], k))
+        elif len(v) == 1 and v[0].split("/")[-1].startswith(".z"):
+            whole.append(k)
 
+    if whole:
+        for k, v in fs.cat(whole).items():
+            out[k] = _inline_value(v)
 
-def _inline_array(group, threshold, names, prefix=""):
-    for name, thing in group.items():
-        if prefix:
-            prefix1 = f"{prefix}.{name}"
-        else:
-            prefix1 = name
-        if isinstance(thing, zarr.Group):
-            _inline_array(thing, threshold=threshold, prefix=prefix1, names=names)
-        else:
-            cond1 = threshold and thing.nbytes < threshold
-            cond2 = prefix1 in names
-            if cond1 or cond2:
-                original_attrs = dict(thing.attrs)
-                arr = group.create_dataset(
-                    name=name,
-                    dtype=thing.dtype,
-                    shape=thing.shape,
-                    data=thing[:],
-                    chunks=thing.shape,
-                    compression=None,
-                    overwrite=True,
-                    fill_value=thing.fill_value,
+    blocks = _merge_ranges(ranges, max_gap, max_block)
+    step = batch_size or 1000
+    for i in range(0, len(blocks), step):
+        batch = blocks[i : i + step]
+        by_protocol = {}
+        for block in batch:
+            protocol = fsspec.core.split_protocol(block[0])[0]
+            by_protocol.setdefault(protocol, []).append(block)
+        for protocol, bl in by_protocol.items():
+            target = fs.fss.get(protocol)
+            if target is None:
+                target = fs.fss[protocol] = fsspec.filesystem(
+                    protocol, **(remote_options or {})
                 )
-                arr.attrs.update(original_attrs)
+            kw = {"batch_size": batch_size} if target.async_impl else {}
+            data = target.cat_ranges(
+                [b[0] for b in bl], [b[1] for b in bl], [b[2] for b in bl], **kw
+            )
+            for (_, start, _, members), buf in zip(bl, data):
+                if isinstance(buf, Exception):
+                    raise buf
+                for _, s, e, k in members:
+                    out[k] = _inline_value(buf[s - start : e - start])
+    return out
+
+
+def _inline_value(v):
+    try:
+        # easiest way to test if data is ascii
+        v.decode("ascii")
+    except UnicodeDecodeError:
+        v = b"base64:" + base64.b64encode(v)
+    return v
+
+
+def _merge_ranges(ranges, max_gap, max_block):
+    """Coalesce (url, start, end, key) ranges into (url, start, end, members) blocks"""
+    blocks = []
+    for r in sorted(ranges, key=lambda r: r[:3]):
+        if blocks:
+            url, start, end, members = blocks[-1]
+            if (
+                r[0] == url
+                and r[1] - end <= max_gap
+                and max(end, r[2]) - start <= max_block
+            ):
+                blocks[-1] = (url, start, max(end, r[2]), members)
+                members.append(r)
+                continue
+        blocks.append((r[0], r[1], r[2], [r]))
+    return blocks
 
 
 def inline_array(store, threshold=1000, names=None, remote_options=None):
     """Inline whole arrays by threshold or name, replace with a single metadata chunk
 
     Inlining whole arrays results in fewer keys. If the constituent keys were
-    already inlined, this also results in a smaller file overall. No action is taken
-    for arrays that are already of one chunk (they should be in
+    already inlined, this also results in a smaller file overall.
+
+    All chunks of all the selected arrays are fetched together (concurrently,
+    for async backends), and then decoded and re-encoded in memory.
 
     Parameters
     ----------
@@ -226,39 +469,288 @@ def inline_array(store, threshold=1000, names=None, remote_options=None):
     fs = fsspec.filesystem(
         "reference", fo=store, **(remote_options or {}), skip_instance_cache=True
     )
-    g = zarr.open_group(fs.get_mapper(), mode="r+")
-    _inline_array(g, threshold, names=names or [])
-    return fs.references
+    refs = fs.references
+    names = set(names or [])
+
+    # find the arrays to inline and the keys of all their chunks
+    selected = {}
+    for key in list(refs):
+        if not (key == ".zarray" or key.endswith("/.zarray")):
+            continue
+        path = key[: -len(".zarray")].rstrip("/")
+        meta = zarr.meta.Metadata2.decode_array_metadata(_as_bytes(refs[key]))
+        nbytes = meta["dtype"].itemsize * int(np.prod(meta["shape"]))
+        if (threshold and nbytes < threshold) or path.replace("/", ".") in names:
+            prefix = f"{path}/" if path else ""
+            sep = meta.get("dimension_separator") or "."
+            grid = [-(-s // c) for s, c in zip(meta["shape"], meta["chunks"])]
+            keys = (
+                prefix + (sep.join(map(str, ind)) if ind else "0")
+                for ind in itertools.product(*(range(g) for g in grid))
+            )
+            selected[path] = (prefix, [k for k in keys if k in refs])
+
+    # one concurrent fetch for all
+    wanted = [k for _, keys in selected.values() for k in keys]
+    data = fs.cat(wanted, on_error="return") if wanted else {}
+
+    for prefix, keys in selected.values():
+        inmem = {".zarray": _as_bytes(refs[prefix + ".zarray"])}
+        for k in keys:
+            if isinstance(data[k], Exception):
+                raise data[k]
+            inmem[k[len(prefix) :]] = data[k]
+        arr = zarr.open_array(inmem, mode="r")
+        # object arrays still need their (first) object codec
+        filters = arr.filters if arr.dtype.hasobject else None
+        out = {}
+        zarr.array(
+            arr[...],
+            store=out,
+            chunks=arr.shape or True,
+            dtype=arr.dtype,
+            compressor=None,
+            object_codec=filters[0] if filters else None,
+            filters=filters[1:] if filters else None,
+            fill_value=arr.fill_value,
+            order=arr.order,
+            dimension_separator=arr._dimension_separator,
+        )
+        for k in keys:
+            del refs[k]
+        for k, v in out.items():
+            refs[prefix + k] = v
+    return refs
+
+
+def dedup_inline(refs, url, min_size=64, min_count=2, storage_options=None):
+    """Store inlined chunk data that is repeated across keys only once
 
+    Combined and multi-message reference sets often inline the same bytes under
+    many keys (coordinates, constant levels, fill chunks), each copy encoded
+    separately. Here, every distinct inlined value that appears at least
+    ``min_count`` times is written once to the blob file ``url``, and all the
+    keys holding it are replaced by ``[url, offset, size]`` references to that
+    blob. These are ordinary references, so the output can be written as JSON,
+    parquet or binary references and read by any ``ReferenceFileSystem``.
 
-def subchunk(store, variable, factor):
+    Values are compared after decoding, so that base64 and plain copies of the
+    same bytes are merged. Metadata keys (".z*") are never changed.
+
+    Parameters
+    ----------
+    refs: dict-like | str
+        Reference set, e.g., the output of ``MultiZarrToZarr`` or of a scanner,
+        or the URL of a JSON file or parquet directory of references. A plain
+        dict is copied; other mappings (e.g., ``LazyReferenceMapper``) are
+        updated in place and flushed.
+    url: str
+        Blob file to write; it must remain readable wherever the references
+        are used.
+    min_size: int
+        Values shorter than this many bytes are left inline, since a reference
+        would be no smaller.
+    min_count: int
+        Values that appear fewer times than this are left inline.
+    storage_options: dict | None
+        For opening ``refs``, if given by URL, and for writing ``url``
+
+    Returns
+    -------
+    amended references set (simple style)
+    """
+    refs = _open_refs(refs, storage_options)
+    out = refs.copy() if isinstance(refs, dict) else refs
+
+    def inlined():
+        for k in refs:
+            if k.rsplit("/", 1)[-1].startswith("."):
+                continue
+            try:
+                v = refs[k]
+            except KeyError:
+                # listed by a parquet store, but not set
+                continue
+            if isinstance(v, list):
+                continue
+            v = _as_bytes(v)
+            if len(v) >= min_size:
+                yield k, v, hashlib.sha256(v).digest()
+
+    counts = {}
+    for _, _, digest in inlined():
+        counts[digest] = counts.get(digest, 0) + 1
+
+    fs, path = fsspec.core.url_to_fs(url, **(storage_options or {}))
+    url = fs.unstrip_protocol(path)
+    blobs = {}  # digest -> (offset, size)
+    updates = []
+    with fs.open(path, "wb") as f:
+        for k, v, digest in inlined():
+            if counts[digest] < min_count:
+                continue
+            if digest not in blobs:
+                blobs[digest] = (f.tell(), len(v))
+                f.write(v)
+            updates.append((k, digest))
+    if hasattr(out, "flush"):
+        # LazyReferenceMapper keeps the inlined bytes of a key changed into a
+        # reference in a record already written, unless it is removed first
+        for k, _ in updates:
+            del out[k]
+        out.flush()
+    for k, digest in updates:
+        out[k] = [url, *blobs[digest]]
+    if hasattr(out, "flush"):
+        out.flush()
+    return out
+
+
+def _as_bytes(v):
+    """Inlined reference value as bytes"""
+    if isinstance(v, str):
+        v = v.encode()
+    if v.startswith(b"base64:"):
+        v = base64.b64decode(v[7:])
+    return v
+
+
+def subchunk(
+    store,
+    variable,
+    factor=None,
+    remote_protocol=None,
+    remote_options=None,
+    storage_options=None,
+):
     """
-    Split uncompressed chunks into integer subchunks on the largest axis
+    Split uncompressed chunks into integer subchunks
+
+    Each output chunk is a contiguous byte range of an input chunk, so only
+    leading axes can be reduced to length 1 and one more axis split by an exact
+    divisor; any following axes keep their chunking.
 
     Parameters
     ----------
-    store: dict
-        reference set
-    variable: str
-        the named zarr variable (give as /-separated path if deep)
-    factor: int
-        the number of chunks each input chunk turns into. Must be an exact divisor
-        of the original largest dimension length.
+    store: dict | LazyReferenceMapper | str
+        reference set: a dict of references (optionally wrapped in
+        ``{"version": 1, "refs": ...}``), which is modified in place, or a
+        parquet reference store, whose record files for the variables are
+        rewritten, or the URL of either a JSON file or a parquet store.
+    variable: str | dict[str, int | list[int]]
+        the named zarr variable (give as /-separated path if deep), or a mapping
+        of such variables to the factor or target chunk shape for each. All
+        variables are processed together.
+    factor: int | None
+        the number of chunks each input chunk turns into, when ``variable`` is
+        a single name. The split is done on the largest axis, which must have
+        a chunk length exactly divisible by the factor (or which is the product
+        of leading chunk lengths and a divisor of the next).
+    remote_protocol, remote_options: str, dict
+        to find the size of any references to whole files; all such sizes are
+        found in one bulk call per protocol
+    storage_options: dict | None
+        for opening ``store``, if given by URL
 
     Returns
     -------
-    modified store
+    modified store; for a parquet store, a new ``LazyReferenceMapper`` on it, since
+    any instance opened before caches the old chunking
     """
-    fs = fsspec.filesystem("reference", fo=store)
-    store = fs.references
-    meta_file = f"{variable}/.zarray"
-    meta = ujson.loads(fs.cat(meta_file))
-    if meta["compressor"] is not None:
-        raise ValueError("Can only subchunk an uncompressed array")
-    chunks_orig = meta["chunks"]
+    if isinstance(variable, str):
+        if factor is None:
+            raise ValueError("Must give factor for a single variable")
+        variable = {variable: factor}
+    elif factor is not None:
+        raise ValueError("Give targets in the variable mapping, not as factor")
+    if isinstance(store, str):
+        store = _open_refs(store, storage_options)
+    elif isinstance(store, dict) and (store.get("templates") or store.get("gen")):
+        # rendered by ReferenceFileSystem
+        store = fsspec.filesystem("reference", fo=store).references
+    refs = store["refs"] if isinstance(store.get("refs"), dict) else store
+    parquet = not isinstance(refs, dict)
+    if parquet:
+        # write any pending changes, so that the record files are complete
+        refs.flush()
+        fs = refs.fs
+        root = fs._strip_protocol(refs.root).rstrip("/")
+        zmetadata = ujson.loads(fs.cat_file(f"{root}/.zmetadata"))
+
+    plans = {}
+    for var, target in variable.items():
+        meta = ujson.loads(refs[f"{var}/.zarray"])
+        if meta["compressor"] is not None or meta.get("filters"):
+            raise ValueError("Can only subchunk an uncompressed array")
+        if meta.get("order", "C") != "C":
+            raise ValueError("Can only subchunk C-ordered arrays")
+        chunks = meta["chunks"]
+        if isinstance(target, int):
+            target = _subchunk_factor(chunks, target)
+        plans[var] = (meta, _subchunk_plan(chunks, list(target)))
+
+    # gather existing references as arrays, keyed by variable; size -1 is unknown
+    if parquet:
+        gathered = {
+            var: _subchunk_gather_parquet(
+                fs, f"{root}/{var}", meta, zmetadata["record_size"]
+            )
+            for var, (meta, _) in plans.items()
+        }
+    else:
+        gathered = _subchunk_gather_dict(refs, plans)
+
+    # all unknown sizes in one go
+    whole = set()
+    for urls, _, _, sizes, _ in gathered.values():
+        whole.update(urls[sizes < 0].tolist())
+    if whole:
+        known = _resolve_sizes(sorted(whole), remote_protocol, remote_options)
+        for urls, _, _, sizes, _ in gathered.values():
+            ind = np.flatnonzero(sizes < 0)
+            sizes[ind] = [known[u] for u in urls[ind].tolist()]
+
+    for var, (meta, plan) in plans.items():
+        urls, index, offsets, sizes, keys = gathered[var]
+        src, new_index, new_offsets, new_sizes = _subchunk_apply(
+            plan, meta["shape"], index, offsets, sizes
+        )
+        meta["chunks"] = plan[0]
+        if parquet:
+            _subchunk_write_parquet(
+                fs,
+                f"{root}/{var}",
+                meta,
+                zmetadata["record_size"],
+                urls[src],
+                new_index,
+                new_offsets,
+                new_sizes,
+            )
+            zmetadata["metadata"][f"{var}/.zarray"] = meta
+            continue
+        refs[f"{var}/.zarray"] = ujson.dumps(meta)
+        for k in keys:
+            del refs[k]
+        sep = meta.get("dimension_separator") or "."
+        for u, ind, o, s in zip(
+            urls[src].tolist(),
+            new_index.tolist(),
+            new_offsets.tolist(),
+            new_sizes.tolist(),
+        ):
+            refs[f"{var}/{sep.join(map(str, ind))}"] = [u, o, s]
+    if parquet:
+        from fsspec.implementations.reference import LazyReferenceMapper
+
+        fs.pipe(f"{root}/.zmetadata", ujson.dumps(zmetadata).encode())
+        return LazyReferenceMapper(root, fs=fs)
+    return store
+
+
+def _subchunk_factor(chunks_orig, factor):
+    """Target chunk shape for splitting by the given factor on the largest axis"""
     chunk_new = []
-    # plan
-    multi = None
     for ind, this_chunk in enumerate(chunks_orig):
         if this_chunk == 1:
             chunk_new.append(1)
@@ -267,140 +759,395 @@ def subchunk(store, variable, factor):
             chunk_new.extend([this_chunk // factor] + chunks_orig[ind + 1 :])
             break
         elif factor % this_chunk == 0:
-            # if factor // chunks_orig[0] > 1:
             chunk_new.append(1)
-            if multi is None:
-                multi = this_chunk
             factor //= this_chunk
         else:
             raise ValueError("Must subchunk by exact integer factor")
+    else:
+        raise ValueError("Must subchunk by exact integer factor")
+    return chunk_new
 
-    if multi:
-        # TODO: this reloads the referenceFS; *maybe* reuses it
-        return subchunk(store, variable, multi)
 
-    # execute
-    meta["chunks"] = chunk_new
-    store = copy.deepcopy(store)
-    store[meta_file] = ujson.dumps(meta)
+def _subchunk_plan(chunks, target):
+    """Check target chunking and find the axis at which byte ranges are split
+
+    Returns target chunks, number of pieces along each axis up to and including
+    the split axis and the total number of pieces per input chunk.
+    """
+    if len(target) != len(chunks):
+        raise ValueError("Target chunks must have the same dimensionality")
+    changed = [i for i, (c, t) in enumerate(zip(chunks, target)) if c != t]
+    ax = changed[-1] if changed else -1
+    if any(t != 1 for t in target[:ax]) or (
+        changed and (target[ax] < 1 or chunks[ax] % target[ax])
+    ):
+        raise ValueError(
+            f"Cannot subchunk {chunks} to {target}: leading axes must become 1 "
+            "and one more axis be split by an exact divisor"
+        )
+    parts = chunks[:ax] + [chunks[ax] // target[ax]] if changed else []
+    return target, parts, int(np.prod(parts))
+
+
+def _subchunk_gather_dict(refs, plans):
+    """Chunk references for the given variables, in one pass over the keys"""
+    found = {var: ([], [], [], [], []) for var in plans}
+    # how many times to split a key from the right to get the variable name
+    splits = {
+        len(meta["shape"]) if meta.get("dimension_separator") == "/" else 1
+        for meta, _ in plans.values()
+    }
+    for k, v in refs.items():
+        for nsplit in splits:
+            var, *part = k.rsplit("/", nsplit)
+            if var in found and part and not part[-1].startswith(".z"):
+                break
+        else:
+            continue
+        if isinstance(v, (str, bytes)):
+            raise ValueError("Refusing to sub-chunk inlined data")
+        index, urls, offsets, sizes, keys = found[var]
+        keys.append(k)
+        index.append([int(_) for _ in ".".join(part).split(".")])
+        urls.append(v[0])
+        offsets.append(v[1] if len(v) > 1 else 0)
+        sizes.append(v[2] if len(v) > 1 else -1)
+    out = {}
+    for var, (index, urls, offsets, sizes, keys) in found.items():
+        ndim = len(plans[var][0]["shape"]) or 1
+        out[var] = (
+            np.array(urls, dtype="O"),
+            np.array(index, dtype="int64").reshape(len(index), ndim),
+            np.array(offsets, dtype="int64"),
+            np.array(sizes, dtype="int64"),
+            keys,
+        )
+    return out
 
-    for k, v in store.copy().items():
-        if k.startswith(f"{variable}/"):
-            kpart = k[len(variable) + 1 :]
-            if kpart.startswith(".z"):
-                continue
-            sep = "." if "." in kpart else "/"
-            chunk_index = [int(_) for _ in kpart.split(sep)]
-            if isinstance(v, (str, bytes)):
-                # TODO: check this early, as some refs might have been edited already
-                raise ValueError("Refusing to sub-chunk inlined data")
-            if len(v) > 1:
-                url, offset, size = v
-            else:
-                (url,) = v
-                offset = 0
-                size = fs.size(k)
-            for subpart in range(factor):
-                new_index = (
-                    chunk_index[:ind]
-                    + [chunk_index[ind] * factor + subpart]
-                    + chunk_index[ind + 1 :]
-                )
-                newpart = sep.join(str(_) for _ in new_index)
-                newv = [url, offset + subpart * size // factor, size // factor]
-                store[f"{variable}/{newpart}"] = newv
-    return store
 
+def _subchunk_gather_parquet(fs, path, meta, record_size):
+    """Chunk references of one variable in a parquet store, as arrays"""
+    import pandas as pd
+
+    grid = [-(-s // c) for s, c in zip(meta["shape"], meta["chunks"])] or [1]
+    n = int(np.prod(grid))
+    urls = np.full(n, None, dtype="O")
+    offsets = np.zeros(n, dtype="int64")
+    sizes = np.zeros(n, dtype="int64")
+    for rec in range(-(-n // record_size)):
+        try:
+            with fs.open(f"{path}/refs.{rec}.parq", "rb") as f:
+                part = pd.read_parquet(f, engine="fastparquet")
+        except FileNotFoundError:
+            continue
+        if "raw" in part and part["raw"].notna().any():
+            raise ValueError("Refusing to sub-chunk inlined data")
+        if "path" not in part:
+            continue
+        # record files may be padded beyond the number of chunks
+        count = min(len(part), n - rec * record_size)
+        sl = slice(rec * record_size, rec * record_size + count)
+        urls[sl] = part["path"].to_numpy(dtype="O")[:count]
+        offsets[sl] = part["offset"].to_numpy()[:count]
+        sizes[sl] = part["size"].to_numpy()[:count]
+    valid = np.flatnonzero(pd.notna(urls))
+    # in this format, offset and size both zero is a reference to a whole file
+    sizes[(offsets == 0) & (sizes == 0)] = -1
+    index = np.stack(np.unravel_index(valid, grid), axis=1)
+    return urls[valid], index, offsets[valid], sizes[valid], None
+
+
+def _subchunk_apply(plan, shape, index, offsets, sizes):
+    """New chunk indices and byte ranges; ``src`` gives the originating row"""
+    target, parts, npieces = plan
+    if (sizes % npieces).any():
+        raise ValueError("Chunk byte sizes are not divisible by the subchunk factor")
+    n = len(index)
+    src = np.repeat(np.arange(n), npieces)
+    new_index = index[src]
+    if parts:
+        sub = np.indices(parts).reshape(len(parts), -1).T
+        new_index[:, : len(parts)] *= parts
+        new_index[:, : len(parts)] += np.tile(sub, (n, 1))
+    piece = sizes[src] // npieces
+    new_offsets = offsets[src] + np.tile(np.arange(npieces), n) * piece
+    # drop pieces which fall wholly outside the array
+    grid = [-(-s // c) for s, c in zip(shape, target)]
+    keep = (new_index < grid).all(axis=1) if shape else slice(None)
+    return src[keep], new_index[keep], new_offsets[keep], piece[keep]
+
+
+def _subchunk_write_parquet(
+    fs, path, meta, record_size, urls, index, offsets, sizes, categorical_threshold=10
+):
+    """Replace all reference record files of one variable in a parquet store"""
+    import pandas as pd
+
+    grid = [-(-s // c) for s, c in zip(meta["shape"], meta["chunks"])] or [1]
+    n = int(np.prod(grid))
+    flat = np.ravel_multi_index(index.T, grid) if len(index) else []
+    cols = {
+        "path": np.full(n, None, dtype="O"),
+        "offset": np.zeros(n, dtype="int64"),
+        "size": np.zeros(n, dtype="int64"),
+        "raw": np.full(n, None, dtype="O"),
+    }
+    cols["path"][flat] = urls
+    cols["offset"][flat] = offsets
+    cols["size"][flat] = sizes
+    fs.makedirs(path, exist_ok=True)
+    # there are at least as many records as before, so all old files are replaced
+    for rec in range(-(-n // record_size)):
+        sl = slice(rec * record_size, (rec + 1) * record_size)
+        df = pd.DataFrame({c: v[sl] for c, v in cols.items()}, copy=False)
+        if df.path.count() / (df.path.nunique() or 1) > categorical_threshold:
+            df["path"] = df["path"].astype("category")
+        with fs.open(f"{path}/refs.{rec}.parq", "wb") as f:
+            _write_parquet_refs(df, f)
 
-def dereference_archives(references, remote_options=None):
+
+def _resolve_sizes(urls, remote_protocol=None, remote_options=None):
+    """Sizes of the given whole files, with one bulk call per protocol"""
+    by_protocol = {}
+    for u in urls:
+        protocol = fsspec.core.split_protocol(u)[0] or remote_protocol or "file"
+        by_protocol.setdefault(protocol, []).append(u)
+    out = {}
+    for protocol, us in by_protocol.items():
+        fs = fsspec.filesystem(protocol, **(remote_options or {}))
+        out.update(zip(us, fs.sizes(us)))
+    return out
+
+
+def dereference_archives(
+    references, remote_options=None, index_cache=None, max_workers=None, max_gap=64_000
+):
     """Directly point to uncompressed byte ranges in ZIP/TAR archives
 
     If a set of references have been made for files contained within ZIP or
     (uncompressed) TAR archives, the "zip://..." and "tar://..." URLs should
     be converted to byte ranges in the overall file.
 
+    The archives are indexed concurrently. For ZIP, only the end-of-central-
+    directory record(s), the central directory and the local headers of the
+    members are read, by range requests. TAR has no central directory, so
+    the member headers throughout the archive must be read.
+
     Parameters
     ----------
     references: dict
-        a simple reference set
+        a simple reference set; it is not modified
     remote_options: dict or None
         For opening the archives
+    index_cache: str | MutableMapping | None
+        Where to keep the member offsets found for each archive, so that they
+        can be reused in later runs: the URL of a JSON file (which need not
+        exist yet), or a mapping which is updated in place. An entry is only
+        reused if the archive size still matches.
+    max_workers: int | None
+        Number of archives to index at once
+    max_gap: int
+        ZIP local header reads closer than this many bytes are merged
     """
-    import zipfile
-    import tarfile
+    from concurrent.futures import ThreadPoolExecutor
 
     if "version" in references and references["version"] == 1:
         references = references["refs"]
 
-    target_files = [l[0] for l in references.values() if isinstance(l, list)]
-    target_files = {
-        (t.split("::", 1)[1], t[:3])
-        for t in target_files
-        if t.startswith(("tar://", "zip://"))
-    }
+    targets = {}
+    for v in references.values():
+        if isinstance(v, list) and str(v[0]).startswith(("tar://", "zip://")):
+            targets[v[0].split("::", 1)[1]] = v[0][:3]
+
+    if isinstance(index_cache, str):
+        try:
+            with fsspec.open(index_cache, "rb") as f:
+                cache = ujson.load(f)
+        except FileNotFoundError:
+            cache = {}
+    else:
+        cache = {} if index_cache is None else index_cache
 
     # find all member file offsets in all archives
-    offsets = {}
-    for target, tar_or_zip in target_files:
-        with fsspec.open(target, **(remote_options or {})) as tf:
-            if tar_or_zip == "tar":
-                tar = tarfile.TarFile(fileobj=tf)
-                offsets[target] = {
-                    ti.name: {"offset": ti.offset_data, "size": ti.size, "comp": False}
-                    for ti in tar.getmembers()
-                    if ti.isfile()
-                }
-            elif tar_or_zip == "zip":
-                zf = zipfile.ZipFile(file=tf)
-                offsets[target] = {}
-                for zipinfo in zf.filelist:
-                    if zipinfo.is_dir():
-                        continue
-                    # if uncompressed, include only the buffer. In compressed (DEFLATE), include
-                    # also the header, and must use DeflateCodec
-                    if zipinfo.compress_type == zipfile.ZIP_DEFLATED:
-                        # TODO: find relevant .zarray and add filter directly
-                        header = 0
-                        warnings.warn(
-                            "ZIP file contains compressed files, must use DeflateCodec"
-                        )
-                        tail = len(zipinfo.FileHeader())
-                    elif zipinfo.compress_type == zipfile.ZIP_STORED:
-                        header = len(zipinfo.FileHeader())
-                        tail = 0
-                    else:
-                        comp = zipfile.compressor_names[zipinfo.compress_type]
-                        raise ValueError(
-                            f"ZIP compression method not supported: {comp}"
-                        )
-                    offsets[target][zipinfo.filename] = {
-                        "offset": zipinfo.header_offset + header,
-                        "size": zipinfo.compress_size + tail,
-                        "comp": zipinfo.compress_type != zipfile.ZIP_STORED,
-                    }
-
-    # modify references
-    mods = copy.deepcopy(references)
-    for k, v in mods.items():
-        if not isinstance(v, list):
-            continue
-        target = v[0].split("::", 1)[1]
-        infile = v[0].split("::", 1)[0][6:]  # strip "zip://" or "tar://"
-        if target not in offsets:
-            continue
-        detail = offsets[target][infile]
-        if detail["comp"]:
-            # leave compressed member file alone
-            pass
-        v[0] = target
-        if len(v) == 1:
-            v.append(detail["offset"])
-            v.append(detail["size"])
-        else:
-            v[1] += detail["offset"]
+    def _index(target):
+        return _archive_index(
+            target, targets[target], cache.get(target), remote_options, max_gap
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        offsets = dict(zip(targets, ex.map(_index, targets)))
+    for target, index in offsets.items():
+        if any(comp for _, _, comp in index["members"].values()):
+            # TODO: find relevant .zarray and add filter directly
+            warnings.warn(
+                f"ZIP file {target} contains compressed files, must use DeflateCodec"
+            )
+    if index_cache is not None and any(
+        cache.get(t) != index for t, index in offsets.items()
+    ):
+        cache.update(offsets)
+        if isinstance(index_cache, str):
+            with fsspec.open(index_cache, "wb") as f:
+                f.write(ujson.dumps(cache).encode())
+
+    # modify references; unchanged values are shared with the input
+    mods = {}
+    for k, v in references.items():
+        if isinstance(v, list) and str(v[0]).startswith(("tar://", "zip://")):
+            infile, target = v[0].split("::", 1)
+            offset, size, _ = offsets[target]["members"][infile[6:]]
+            if len(v) == 1:
+                v = [target, offset, size]
+            else:
+                v = [target, v[1] + offset] + v[2:]
+        mods[k] = v
     return mods
 
 
+def _archive_index(target, kind, cached, remote_options, max_gap):
+    """Member offsets of one archive, as {"size": ..., "members": {name: [...]}}
+
+    Members are given by [offset, size, compressed]
+    """
+    fs, path = fsspec.core.url_to_fs(target, **(remote_options or {}))
+    size = fs.size(path)
+    if cached and cached["size"] == size:
+        return cached
+    if kind == "tar":
+        members = _tar_index(fs, path)
+    else:
+        members = _zip_index(fs, path, size, max_gap)
+    return {"size": size, "members": members}
+
+
+def _tar_index(fs, path):
+    import tarfile
+
+    with fs.open(path, "rb") as tf:
+        tar = tarfile.TarFile(fileobj=tf)
+        return {
+            ti.name: [ti.offset_data, ti.size, False]
+            for ti in tar.getmembers()
+            if ti.isfile()
+        }
+
+
+def _zip_index(fs, path, size, max_gap):
+    import struct
+    import zipfile
+
+    # the EOCD record is at the end, followed by a comment of up to 64kB
+    start = max(
+        0, size - zipfile.sizeEndCentDir - 65535 - zipfile.sizeEndCentDir64Locator
+    )
+    tail = fs.cat_file(path, start=start, end=size)
+
+    def _read(offset, length):
+        if offset >= start:
+            return tail[offset - start : offset - start + length]
+        return fs.cat_file(path, start=offset, end=offset + length)
+
+    pos = tail.rfind(zipfile.stringEndArchive)
+    if pos < 0:
+        raise ValueError(f"No ZIP end of central directory record in {path}")
+    rec = struct.unpack(
+        zipfile.structEndArchive, tail[pos : pos + zipfile.sizeEndCentDir]
+    )
+    cd_size, cd_offset = rec[zipfile._ECD_SIZE], rec[zipfile._ECD_OFFSET]
+    loc = pos - zipfile.sizeEndCentDir64Locator
+    if loc >= 0 and tail[loc : loc + 4] == zipfile.stringEndArchive64Locator:
+        _, _, offset64, _ = struct.unpack(
+            zipfile.structEndArchive64Locator, tail[loc:pos]
+        )
+        rec = struct.unpack(
+            zipfile.structEndArchive64, _read(offset64, zipfile.sizeEndCentDir64)
+        )
+        cd_size, cd_offset = rec[-2], rec[-1]
+    cd = _read(cd_offset, cd_size)
+
+    entries = []
+    i = 0
+    while i + zipfile.sizeCentralDir <= len(cd):
+        centdir = struct.unpack(
+            zipfile.structCentralDir, cd[i : i + zipfile.sizeCentralDir]
+        )
+        if centdir[0] != zipfile.stringCentralDir:
+            raise ValueError(f"Bad ZIP central directory in {path}")
+        i += zipfile.sizeCentralDir
+        nlen = centdir[zipfile._CD_FILENAME_LENGTH]
+        xlen = centdir[zipfile._CD_EXTRA_FIELD_LENGTH]
+        name = cd[i : i + nlen]
+        extra = cd[i + nlen : i + nlen + xlen]
+        i += nlen + xlen + centdir[zipfile._CD_COMMENT_LENGTH]
+        flags = centdir[zipfile._CD_FLAG_BITS]
+        name = name.decode("utf-8" if flags & 0x800 else "cp437")
+        if name.endswith("/"):
+            continue
+        csize, usize = (
+            centdir[zipfile._CD_COMPRESSED_SIZE],
+            centdir[zipfile._CD_UNCOMPRESSED_SIZE],
+        )
+        offset = centdir[zipfile._CD_LOCAL_HEADER_OFFSET]
+        if 0xFFFFFFFF in (csize, usize, offset):
+            csize, offset = _zip64_extra(extra, csize, usize, offset)
+        method = centdir[zipfile._CD_COMPRESS_TYPE]
+        if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            comp = zipfile.compressor_names.get(method, method)
+            raise ValueError(f"ZIP compression method not supported: {comp}")
+        entries.append((name, offset, csize, method))
+
+    # the local header of each member may have a different extra field from
+    # the central directory, so read the header lengths too
+    ranges = [
+        (path, offset, offset + zipfile.sizeFileHeader, j)
+        for j, (_, offset, _, _) in enumerate(entries)
+    ]
+    blocks = _merge_ranges(ranges, max_gap, 2**24)
+    data = fs.cat_ranges(
+        [b[0] for b in blocks], [b[1] for b in blocks], [b[2] for b in blocks]
+    )
+    members = {}
+    for (_, bstart, _, parts), buf in zip(blocks, data):
+        if isinstance(buf, Exception):
+            raise buf
+        for _, s, e, j in parts:
+            fheader = struct.unpack(
+                zipfile.structFileHeader, buf[s - bstart : e - bstart]
+            )
+            header = (
+                zipfile.sizeFileHeader
+                + fheader[zipfile._FH_FILENAME_LENGTH]
+                + fheader[zipfile._FH_EXTRA_FIELD_LENGTH]
+            )
+            name, offset, csize, method = entries[j]
+            if method == zipfile.ZIP_STORED:
+                # if uncompressed, include only the buffer
+                members[name] = [offset + header, csize, False]
+            else:
+                # DEFLATE: include also the header, and must use DeflateCodec
+                members[name] = [offset, csize + header, True]
+    return members
+
+
+def _zip64_extra(extra, csize, usize, offset):
+    """Compressed size and header offset from a ZIP64 extra field"""
+    import struct
+
+    while len(extra) >= 4:
+        tp, ln = struct.unpack("<HH", extra[:4])
+        if tp == 1:
+            values = list(struct.unpack(f"<{ln // 8}Q", extra[4 : 4 + ln // 8 * 8]))
+            if usize == 0xFFFFFFFF:
+                values.pop(0)
+            if csize == 0xFFFFFFFF:
+                csize = values.pop(0)
+            if offset == 0xFFFFFFFF:
+                offset = values.pop(0)
+            break
+        extra = extra[4 + ln :]
+    return csize, offset
+
+
 def _max_prefix(*strings):
     # https://stackoverflow.com/a/6719272/3821154
     def all_same(x):
@@ -440,3 +1187,675 @@ def templateize(strings, min_length=10, template_name="u"):
     else:
         template = {}
     return template, strings
+
+
+def profile_refs(
+    refs,
+    selection=None,
+    storage_options=None,
+    min_chunk_bytes=100_000,
+    max_targets=10_000,
+    out=None,
+):
+    """Statistics on a reference set, to estimate the cost of reading it
+
+    Goes through the references one variable at a time; parquet stores are
+    read one record file at a time, and JSON files are streamed (twice: once
+    for the array metadata, and once for the references), never loaded whole.
+
+    Parameters
+    ----------
+    refs: dict | str | LazyReferenceMapper
+        references, or the URL of a JSON file or parquet directory of them
+    selection: dict[str, tuple] | None
+        variable names mapped to the region to read, as one slice, integer or
+        [start, stop] pair per dimension; the number of requests this would
+        issue is included in the report
+    storage_options: dict | None
+        for opening the references, if given by URL
+    min_chunk_bytes: int
+        variables with a median reference size below this are warned about
+    max_targets: int
+        a warning is included if more than this many target files are used
+    out: str | None
+        if given, URL to write the report to as JSON
+
+    Returns
+    -------
+    Report dict, with overall counts (``n_refs``, ``n_inlined``, ``inline_bytes``,
+    ``fraction_inlined``, ``n_targets``, ``refs_per_target``), a section per
+    variable under ``variables`` including a power-of-two histogram of
+    reference sizes, ``warnings``, and ``selection`` if given.
+    """
+    import collections
+
+    from fsspec.implementations.reference import LazyReferenceMapper
+
+    items = _json_ref_items(refs, storage_options) if isinstance(refs, str) else None
+    if items is None:
+        refs = _open_refs(refs, storage_options)
+        if not isinstance(refs, LazyReferenceMapper):
+            items = refs.items
+    metas = columns = refs
+    if items is not None:
+        # chunk keys are attributed to arrays by the paths of their metadata
+        metas = {k: v for k, v in items() if k.rsplit("/", 1)[-1] == ".zarray"}
+        arrays = {k[: -len(".zarray")].rstrip("/") for k in metas}
+        columns = (items, arrays)
+        if selection and isinstance(refs, str):
+            # a streamed file: keep only the references the selection needs
+            refs = dict(metas)
+
+            def gather():
+                for k, v in items():
+                    if _array_of_key(k, arrays) in selection:
+                        refs[k] = v
+                    yield k, v
+
+            columns = (gather, arrays)
+
+    targets = collections.Counter()
+    variables = {}
+    n_meta = 0
+    for var, urls, sizes, raw_sizes in _iter_ref_columns(columns):
+        if var is None:
+            n_meta += len(raw_sizes)
+            continue
+        targets.update(urls.tolist())
+        stats = variables.setdefault(
+            var, {"sizes": [], "inline": [], "targets": set(), "whole": 0}
+        )
+        stats["sizes"].append(sizes[sizes > 0])
+        stats["whole"] += int((sizes == 0).sum())
+        stats["inline"].append(raw_sizes)
+        stats["targets"].update(urls.tolist())
+
+    report_vars = {}
+    warnings_ = []
+    for var, stats in sorted(variables.items()):
+        sizes = np.concatenate(stats["sizes"])
+        inline = np.concatenate(stats["inline"])
+        nchunks = len(sizes) + stats["whole"] + len(inline)
+        rep = {
+            "n_chunks": nchunks,
+            "n_inlined": len(inline),
+            "inline_bytes": int(inline.sum()),
+            "n_whole_file": stats["whole"],
+            "n_targets": len(stats["targets"]),
+            "ref_bytes": _describe(sizes),
+            "ref_bytes_histogram": _log2_histogram(sizes),
+        }
+        try:
+            meta = ujson.loads(_as_bytes(metas[f"{var}/.zarray" if var else ".zarray"]))
+            rep.update(
+                shape=meta["shape"],
+                chunks=meta["chunks"],
+                dtype=meta["dtype"],
+                compressor=(meta["compressor"] or {}).get("id"),
+                chunk_nbytes=int(np.prod(meta["chunks"]) * _itemsize(meta["dtype"])),
+            )
+        except (KeyError, TypeError, ValueError):
+            pass
+        if len(sizes) and rep["ref_bytes"]["median"] < min_chunk_bytes:
+            warnings_.append(
+                f"{var}: median reference size {rep['ref_bytes']['median']} bytes "
+                f"is below {min_chunk_bytes}"
+            )
+        report_vars[var] = rep
+
+    n_inlined = sum(v["n_inlined"] for v in report_vars.values())
+    n_chunks = sum(v["n_chunks"] for v in report_vars.values())
+    if len(targets) > max_targets:
+        warnings_.append(f"{len(targets)} target files is more than {max_targets}")
+    report = {
+        "n_refs": n_chunks + n_meta,
+        "n_metadata": n_meta,
+        "n_chunks": n_chunks,
+        "n_inlined": n_inlined,
+        "inline_bytes": sum(v["inline_bytes"] for v in report_vars.values()),
+        "fraction_inlined": n_inlined / n_chunks if n_chunks else 0.0,
+        "n_targets": len(targets),
+        "refs_per_target": _describe(np.array(list(targets.values()))),
+        "variables": report_vars,
+        "warnings": warnings_,
+    }
+    if selection:
+        report["selection"] = {
+            var: _selection_cost(refs, var, sel) for var, sel in selection.items()
+        }
+    if out:
+        with fsspec.open(out, "wb", **(storage_options or {})) as f:
+            f.write(ujson.dumps(report, indent=2).encode())
+    return report
+
+
+def _open_refs(refs, storage_options=None):
+    """References as a mapping, from a dict, JSON URL or parquet directory"""
+    return _open_refs_templates(refs, storage_options)[0]
+
+
+def _open_refs_templates(refs, storage_options=None):
+    """As ``_open_refs``, and the templates of version 1 references, name -> value"""
+    if isinstance(refs, str):
+        fs, path = fsspec.core.url_to_fs(refs, **(storage_options or {}))
+        if fs.isdir(path):
+            from fsspec.implementations.reference import LazyReferenceMapper
+
+            # a full URL, so that records written back go to the same filesystem
+            return LazyReferenceMapper(fs.unstrip_protocol(path), fs=fs), {}
+        with fs.open(path, "rb") as f:
+            from kerchunk.binref import MAGIC, BinaryReferences
+
+            if f.read(len(MAGIC)) == MAGIC:
+                return BinaryReferences(refs, storage_options), {}
+            f.seek(0)
+            refs = ujson.load(f)
+    templates = {}
+    if isinstance(refs, dict) and isinstance(refs.get("refs"), dict):
+        templates = refs.get("templates") or {}
+        refs = refs["refs"]
+    return refs, templates
+
+
+def _render_url(url, templates):
+    """Fill the ``{{name}}`` templates of a reference URL"""
+    for name, value in templates.items():
+        url = url.replace("{{%s}}" % name, value)
+    return url
+
+
+def _iter_ref_columns(refs, batch_size=100_000):
+    """Yield (variable, urls, sizes, inline sizes) arrays for batches of references
+
+    ``refs`` is a LazyReferenceMapper, or a pair of a function giving
+    (key, value) items and the set of array paths. Metadata and other
+    non-chunk keys come with variable None. Whole-file references have size 0.
+    """
+    from fsspec.implementations.reference import LazyReferenceMapper
+
+    if isinstance(refs, LazyReferenceMapper):
+        import pandas as pd
+
+        yield None, None, None, np.ones(len(refs.zmetadata), dtype="int64")
+        for var in refs.listdir():
+            if var.startswith("."):
+                continue
+            n = int(np.prod(refs._get_chunk_sizes(var)))
+            for rec in range(-(-n // refs.record_size)):
+                try:
+                    part = refs.open_refs(var, rec)
+                except FileNotFoundError:
+                    continue
+                if not part:
+                    continue
+                count = min(len(next(iter(part.values()))), n - rec * refs.record_size)
+                raw = part.get("raw", np.full(count, None))[:count]
+                inline = pd.notna(raw)
+                if "path" in part:
+                    paths = part["path"][:count]
+                    has_url = pd.notna(paths) & ~inline
+                    urls = np.asarray(paths[has_url], dtype="O")
+                    sizes = np.asarray(part["size"][:count][has_url], dtype="int64")
+                else:
+                    urls, sizes = np.array([], dtype="O"), np.array([], dtype="int64")
+                raw_sizes = np.fromiter(map(len, raw[inline]), "int64")
+                yield var, urls, sizes, raw_sizes
+        return
+
+    batches = {}
+
+    def _flush(var):
+        urls, sizes, raw = batches.pop(var)
+        return (
+            var,
+            np.array(urls, dtype="O"),
+            np.array(sizes, dtype="int64"),
+            np.array(raw, dtype="int64"),
+        )
+
+    items, arrays = refs
+    meta = 0
+    for k, v in items():
+        var = _array_of_key(k, arrays)
+        if var is None:
+            meta += 1
+            continue
+        urls, sizes, raw = batches.setdefault(var, ([], [], []))
+        if isinstance(v, list):
+            urls.append(v[0])
+            sizes.append(v[2] if len(v) == 3 else 0)
+        else:
+            raw.append(len(_as_bytes(v)))
+        if len(urls) + len(raw) >= batch_size:
+            yield _flush(var)
+    for var in list(batches):
+        yield _flush(var)
+    yield None, None, None, np.ones(meta, dtype="int64")
+
+
+def _array_of_key(key, arrays):
+    """Path of the array a chunk key belongs to, or None for metadata and others
+
+    The longest leading path which is an array is taken, so that chunk keys
+    with "/" as dimension separator and those of a root array ("") are found.
+    """
+    parts = key.split("/")
+    if parts[-1].startswith("."):
+        return None
+    for i in range(len(parts) - 1, -1, -1):
+        path = "/".join(parts[:i])
+        if path in arrays:
+            return path
+    return None
+
+
+def _json_ref_items(url, storage_options=None):
+    """Function streaming (key, value) from a JSON reference file, or None if not JSON"""
+    from kerchunk.binref import MAGIC
+    from kerchunk.df import _iter_json_refs
+
+    fs, path = fsspec.core.url_to_fs(url, **(storage_options or {}))
+    if fs.isdir(path):
+        return None
+    with fs.open(path, "rb") as f:
+        if f.read(len(MAGIC)) == MAGIC:
+            return None
+
+    def items():
+        with fs.open(path, "rb") as f:
+            yield from _iter_json_refs(f)
+
+    return items
+
+
+def _describe(values):
+    if not len(values):
+        return {"count": 0}
+    return {
+        "count": int(len(values)),
+        "min": int(values.min()),
+        "max": int(values.max()),
+        "mean": float(values.mean()),
+        "median": float(np.median(values)),
+        "total": int(values.sum()),
+    }
+
+
+def _log2_histogram(values):
+    """Counts of values in power-of-two bins, keyed by the lower bin edge"""
+    if not len(values):
+        return {}
+    bins = np.bincount(np.log2(np.maximum(values, 1)).astype("int64"))
+    return {str(2**i): int(c) for i, c in enumerate(bins) if c}
+
+
+def _itemsize(dtype):
+    if isinstance(dtype, list):
+        dtype = [tuple(d) for d in dtype]
+    return np.dtype(dtype).itemsize
+
+
+def _selection_bounds(shape, selection):
+    """Normalise a selection to [start, stop) per dimension"""
+    selection = (
+        tuple(selection) if isinstance(selection, (list, tuple)) else (selection,)
+    )
+    if len(selection) > len(shape):
+        raise ValueError(f"Selection {selection} has too many dimensions for {shape}")
+    bounds = []
+    for dim, size in enumerate(shape):
+        sel = selection[dim] if dim < len(selection) else slice(None)
+        if isinstance(sel, (list, tuple)):
+            sel = slice(*sel)
+        if isinstance(sel, slice):
+            start, stop, step = sel.indices(size)
+            if step != 1:
+                raise ValueError("Only contiguous selections are supported")
+        else:
+            start = sel + size if sel < 0 else sel
+            stop = start + 1
+        bounds.append((start, max(start, stop)))
+    return bounds
+
+
+def _selected_chunk_keys(meta, selection, prefix=""):
+    """Keys of the chunks which hold the selected region of an array"""
+    sep = meta.get("dimension_separator") or "."
+    bounds = _selection_bounds(meta["shape"], selection)
+    ranges = [
+        range(start // c, -(-stop // c))
+        for (start, stop), c in zip(bounds, meta["chunks"])
+    ]
+    if not meta["shape"]:
+        return [f"{prefix}0"]
+    return [prefix + sep.join(map(str, ind)) for ind in itertools.product(*ranges)]
+
+
+def _selection_cost(refs, var, selection):
+    """Number of chunks, requests and bytes to read a region of one variable"""
+    prefix = f"{var}/" if var else ""
+    meta = ujson.loads(_as_bytes(refs[f"{prefix}.zarray"]))
+    keys = _selected_chunk_keys(meta, selection, prefix)
+    requests = inlined = missing = nbytes = 0
+    targets = set()
+    for k in keys:
+        try:
+            v = refs[k]
+        except KeyError:
+            missing += 1
+            continue
+        if isinstance(v, list):
+            requests += 1
+            targets.add(v[0])
+            nbytes += v[2] if len(v) == 3 else 0
+        else:
+            inlined += 1
+    return {
+        "n_chunks": len(keys),
+        "n_requests": requests,
+        "n_inlined": inlined,
+        "n_missing": missing,
+        "n_targets": len(targets),
+        "bytes": int(nbytes),
+    }
+
+
+class ReadPlan:
+    """Byte ranges to fetch for reading a region of a variable
+
+    Made by ``plan_read``. Attributes are plain lists and dicts, so a plan can
+    be inspected or serialised.
+
+    Attributes
+    ----------
+    requests: list[[url, start, end]]
+        the merged byte ranges to fetch; end is None for whole files
+    chunks: dict[str, [int, int, int]]
+        chunk key -> index into requests, offset and size within that request
+    inline: dict[str, bytes]
+        chunks which are held in the references themselves
+    missing: list[str]
+        chunks with no reference, which take the fill value
+    """
+
+    def __init__(self, requests, chunks, inline, missing):
+        self.requests = requests
+        self.chunks = chunks
+        self.inline = inline
+        self.missing = missing
+
+    def __repr__(self):
+        return (
+            f"<ReadPlan: {len(self.chunks) + len(self.inline)} chunks in "
+            f"{len(self.requests)} requests>"
+        )
+
+    def fetch(self, remote_protocol=None, remote_options=None, batch_size=None):
+        """Get all the requests concurrently, and return chunk key -> bytes
+
+        The bytes are as stored, i.e., still encoded with the array's codecs.
+        Requests are made with one ``cat_ranges`` call per protocol.
+        """
+        by_protocol = {}
+        for i, (url, _, _) in enumerate(self.requests):
+            protocol = fsspec.core.split_protocol(url)[0] or remote_protocol
+            by_protocol.setdefault(protocol, []).append(i)
+        blocks = [None] * len(self.requests)
+        for protocol, inds in by_protocol.items():
+            fs = fsspec.filesystem(protocol or "file", **(remote_options or {}))
+            kw = {"batch_size": batch_size} if fs.async_impl and batch_size else {}
+            data = fs.cat_ranges(
+                [self.requests[i][0] for i in inds],
+                [self.requests[i][1] for i in inds],
+                [self.requests[i][2] for i in inds],
+                **kw,
+            )
+            for i, buf in zip(inds, data):
+                if isinstance(buf, Exception):
+                    raise buf
+                blocks[i] = buf
+        out = {
+            k: blocks[i][s : None if n is None else s + n]
+            for k, (i, s, n) in self.chunks.items()
+        }
+        out.update(self.inline)
+        return out
+
+
+def plan_read(
+    refs,
+    variable,
+    selection=None,
+    max_gap=64_000,
+    max_block=256_000_000,
+    storage_options=None,
+):
+    """Find the references needed to read a region, and merge them into requests
+
+    Parameters
+    ----------
+    refs: dict | str | LazyReferenceMapper
+        references, or the URL of a JSON file or parquet directory of them
+    variable: str
+        the array to read (give as /-separated path if deep)
+    selection: tuple | None
+        one slice, integer or [start, stop] pair per dimension; missing
+        trailing dimensions, or None, select everything
+    max_gap: int
+        ranges in the same file closer than this are fetched in one request
+    max_block: int
+        do not merge ranges if the result would be bigger than this
+    storage_options: dict | None
+        for opening the references, if given by URL
+
+    Returns
+    -------
+    ReadPlan, whose ``fetch()`` gets the bytes of all the chunks
+    """
+    refs, templates = _open_refs_templates(refs, storage_options)
+    return _plan_refs(refs, templates, variable, selection, max_gap, max_block)
+
+
+def _plan_refs(refs, templates, variable, selection, max_gap, max_block):
+    """``plan_read`` for opened references and their templates"""
+    prefix = f"{variable}/" if variable else ""
+    meta = ujson.loads(_as_bytes(refs[f"{prefix}.zarray"]))
+    keys = _selected_chunk_keys(meta, selection or (), prefix)
+
+    ranges = []
+    whole = []
+    inline = {}
+    missing = []
+    for k in keys:
+        try:
+            v = refs[k]
+        except KeyError:
+            missing.append(k)
+            continue
+        if not isinstance(v, list):
+            inline[k] = _as_bytes(v)
+            continue
+        url = _render_url(v[0], templates)
+        if len(v) == 1 or v[1:] == [0, 0]:
+            whole.append((url, k))
+        else:
+            ranges.append((url, v[1], v[1] + v[2], k))
+    return _build_plan(ranges, whole, inline, missing, max_gap, max_block)
+
+
+def _build_plan(ranges, whole, inline, missing, max_gap, max_block):
+    """Merge (url, start, end, key) ranges and (url, key) whole files into a plan"""
+    requests = []
+    chunks = {}
+    for url, start, end, members in _merge_ranges(ranges, max_gap, max_block):
+        for _, s, e, k in members:
+            chunks[k] = [len(requests), s - start, e - s]
+        requests.append([url, start, end])
+    for url, k in whole:
+        chunks[k] = [len(requests), 0, None]
+        requests.append([url, None, None])
+    return ReadPlan(requests, chunks, inline, missing)
+
+
+def read_region(
+    refs,
+    variable,
+    selection=None,
+    max_gap=None,
+    max_block=256_000_000,
+    storage_options=None,
+    remote_protocol=None,
+    remote_options=None,
+):
+    """Read part of one array, fetching only the bytes which are needed
+
+    For arrays stored with no compressor and no filters (as typically from
+    NetCDF3, contiguous HDF5, FITS images or uncompressed TIFF), only the
+    byte ranges inside each chunk which hold the selection are fetched, so
+    that, for example, extracting a point time series does not load whole
+    chunks. Nearby ranges are merged, see ``max_gap``. Other arrays are read
+    whole chunk by whole chunk and decoded with zarr.
+
+    Parameters
+    ----------
+    refs: dict | str | LazyReferenceMapper
+        references, or the URL of a JSON file or parquet directory of them
+    variable: str
+        the array to read (give as /-separated path if deep)
+    selection: tuple | None
+        one slice or integer per dimension, as for numpy basic indexing;
+        missing trailing dimensions, or None, select everything
+    max_gap: int | None
+        ranges in the same file closer than this are fetched in one request.
+        By default, 64kB for whole chunks, as in ``plan_read``, but only 256
+        bytes for the runs within raw chunks, so that strided selections do not
+        fetch the bytes in between
+    max_block: int
+        do not merge ranges if the result would be bigger than this
+    storage_options: dict | None
+        for opening the references, if given by URL
+    remote_protocol, remote_options: str, dict | None
+        for fetching the data
+
+    Returns
+    -------
+    numpy array
+    """
+    refs, templates = _open_refs_templates(refs, storage_options)
+    prefix = f"{variable}/" if variable else ""
+    zarray = _as_bytes(refs[f"{prefix}.zarray"])
+    meta = zarr.meta.Metadata2.decode_array_metadata(zarray)
+    shape = tuple(meta["shape"])
+    bounds, post = _region_index(shape, selection)
+    block = [list(b) for b in bounds]
+
+    if meta["compressor"] or meta["filters"] or meta["dtype"].hasobject:
+        gap = 64_000 if max_gap is None else max_gap
+        plan = _plan_refs(refs, templates, variable, block, gap, max_block)
+        store = {".zarray": zarray}
+        for k, v in plan.fetch(remote_protocol, remote_options).items():
+            store[k[len(prefix) :]] = v
+        arr = zarr.open_array(store, mode="r")
+        return arr[tuple(slice(*b) for b in bounds)][post]
+
+    dtype, chunks, order = meta["dtype"], tuple(meta["chunks"]), meta["order"]
+    sep = meta.get("dimension_separator") or "."
+    out = np.zeros([stop - start for start, stop in bounds], dtype=dtype)
+    if meta["fill_value"] is not None:
+        out[...] = meta["fill_value"]
+    ranges = []
+    pieces = {}
+    grid = [
+        range(start // c, -(-stop // c)) for (start, stop), c in zip(bounds, chunks)
+    ]
+    for ind in itertools.product(*grid):
+        key = prefix + (sep.join(map(str, ind)) if ind else "0")
+        try:
+            v = refs[key]
+        except KeyError:
+            continue
+        lo = [
+            max(start, i * c) - i * c for (start, _), i, c in zip(bounds, ind, chunks)
+        ]
+        hi = [
+            min(stop, (i + 1) * c) - i * c
+            for (_, stop), i, c in zip(bounds, ind, chunks)
+        ]
+        target = tuple(
+            slice(i * c + l - start, i * c + h - start)
+            for (start, _), i, c, l, h in zip(bounds, ind, chunks, lo, hi)
+        )
+        inner = tuple(slice(l, h) for l, h in zip(lo, hi))
+        if not isinstance(v, list):
+            buf = np.frombuffer(_as_bytes(v), dtype=dtype)
+            out[target] = buf.reshape(chunks, order=order)[inner]
+            continue
+        url = _render_url(v[0], templates)
+        base = v[1] if len(v) > 1 else 0
+        starts, ends = _chunk_runs(chunks, lo, hi, dtype.itemsize, order)
+        for j, (s, e) in enumerate(zip(starts.tolist(), ends.tolist())):
+            ranges.append((url, base + s, base + e, (key, j)))
+        pieces[key] = (target, [h - l for l, h in zip(lo, hi)], len(starts))
+
+    gap = 256 if max_gap is None else max_gap
+    plan = _build_plan(ranges, [], {}, [], gap, max_block)
+    data = plan.fetch(remote_protocol, remote_options)
+    for key, (target, subshape, n) in pieces.items():
+        buf = b"".join(data[(key, j)] for j in range(n))
+        out[target] = np.frombuffer(buf, dtype=dtype).reshape(subshape, order=order)
+    return out[post]
+
+
+def _region_index(shape, selection):
+    """Bounding [start, stop) of a basic selection, and the index to apply to it"""
+    selection = (
+        tuple(selection) if isinstance(selection, (list, tuple)) else (selection,)
+    )
+    if selection == (None,):
+        selection = ()
+    if len(selection) > len(shape):
+        raise ValueError(f"Selection {selection} has too many dimensions for {shape}")
+    bounds = []
+    post = []
+    for dim, size in enumerate(shape):
+        sel = selection[dim] if dim < len(selection) else slice(None)
+        if not isinstance(sel, slice):
+            ind = sel + size if sel < 0 else sel
+            if not 0 <= ind < size:
+                raise IndexError(f"Index {sel} out of bounds for size {size}")
+            bounds.append((ind, ind + 1))
+            post.append(0)
+            continue
+        r = range(*sel.indices(size))
+        if not r:
+            bounds.append((0, 0))
+            post.append(slice(None))
+            continue
+        lo = min(r[0], r[-1])
+        bounds.append((lo, max(r[0], r[-1]) + 1))
+        stop = r[-1] - lo + (1 if r.step > 0 else -1)
+        post.append(slice(r[0] - lo, stop if stop >= 0 else None, r.step))
+    return bounds, tuple(post)
+
+
+def _chunk_runs(chunks, lo, hi, itemsize, order="C"):
+    """Byte (starts, ends) of the contiguous runs holding a block of a raw chunk
+
+    The runs are in the order of the block's elements in the given memory order.
+    """
+    if not chunks:
+        return np.array([0]), np.array([itemsize])
+    if order == "F":
+        chunks, lo, hi = chunks[::-1], lo[::-1], hi[::-1]
+    strides = np.cumprod((1,) + tuple(chunks[:0:-1]))[::-1]
+    # innermost dimension which is not selected in full
+    k = len(chunks) - 1
+    while k > 0 and lo[k] == 0 and hi[k] == chunks[k]:
+        k -= 1
+    offsets = np.array([lo[k] * strides[k]])
+    for d in range(k - 1, -1, -1):
+        offsets = (
+            np.arange(lo[d], hi[d])[:, None] * strides[d] + offsets[None, :]
+        ).ravel()
+    starts = offsets * itemsize
+    return starts, starts + (hi[k] - lo[k]) * strides[k] * itemsize
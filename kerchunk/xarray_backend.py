@@ -1,18 +1,41 @@
-from xarray.backends import BackendEntrypoint
+from xarray.backends import BackendArray, BackendEntrypoint
+from xarray.core import indexing
 import xarray as xr
 import os
 import fsspec
+import ujson
+
+from kerchunk.utils import _as_bytes, read_region
+
+# open_dataset arguments which are applied by xr.decode_cf when reading partially
+_DECODE_OPTIONS = {
+    "decode_cf",
+    "mask_and_scale",
+    "decode_times",
+    "concat_characters",
+    "decode_coords",
+    "drop_variables",
+    "use_cftime",
+    "decode_timedelta",
+}
 
 
 class KerchunkBackend(BackendEntrypoint):
     def open_dataset(
-        self, filename_or_obj, *, storage_options=None, open_dataset_options=None, **kw
+        self,
+        filename_or_obj,
+        *,
+        storage_options=None,
+        open_dataset_options=None,
+        partial_reads=False,
+        **kw,
     ):
         open_dataset_options = (open_dataset_options or {}) | kw
         ref_ds = open_reference_dataset(
             filename_or_obj,
             storage_options=storage_options,
             open_dataset_options=open_dataset_options,
+            partial_reads=partial_reads,
         )
         return ref_ds
 
@@ -20,6 +43,7 @@ class KerchunkBackend(BackendEntrypoint):
         "filename_or_obj",
         "storage_options",
         "open_dataset_options",
+        "partial_reads",
     ]
 
     def guess_can_open(self, filename_or_obj):
@@ -33,9 +57,44 @@ class KerchunkBackend(BackendEntrypoint):
     url = "https://fsspec.github.io/kerchunk/"
 
 
+class ReferenceBackendArray(BackendArray):
+    """Lazy array which reads only the bytes needed for each selection"""
+
+    def __init__(self, refs, variable, shape, dtype, storage_options=None):
+        self.refs = refs
+        self.variable = variable
+        self.shape = shape
+        self.dtype = dtype
+        self.storage_options = storage_options or {}
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(
+            key, self.shape, indexing.IndexingSupport.BASIC, self._getitem
+        )
+
+    def _getitem(self, key):
+        return read_region(
+            self.refs,
+            self.variable,
+            key,
+            remote_protocol=self.storage_options.get("remote_protocol"),
+            remote_options=self.storage_options.get("remote_options"),
+        )
+
+
 def open_reference_dataset(
-    filename_or_obj, *, storage_options=None, open_dataset_options=None
+    filename_or_obj,
+    *,
+    storage_options=None,
+    open_dataset_options=None,
+    partial_reads=False,
 ):
+    """Open references as a dataset with xarray
+
+    With ``partial_reads=True``, variables stored with no compression or filters
+    are read with ``kerchunk.utils.read_region``, so that selections fetch only
+    the bytes they need rather than whole chunks.
+    """
     if storage_options is None:
         storage_options = {}
     if open_dataset_options is None:
@@ -43,4 +102,31 @@ def open_reference_dataset(
 
     m = fsspec.get_mapper("reference://", fo=filename_or_obj, **storage_options)
 
-    return xr.open_dataset(m, engine="zarr", consolidated=False, **open_dataset_options)
+    if not partial_reads:
+        return xr.open_dataset(
+            m, engine="zarr", consolidated=False, **open_dataset_options
+        )
+
+    options = dict(open_dataset_options)
+    decode = {k: options.pop(k) for k in _DECODE_OPTIONS if k in options}
+    chunks = options.pop("chunks", None)
+    ds = xr.open_dataset(
+        m, engine="zarr", consolidated=False, decode_cf=False, **options
+    )
+    refs = m.fs.references
+    group = (options.get("group") or "").strip("/")
+    for name, var in ds.variables.items():
+        if name in ds.indexes:
+            continue
+        path = f"{group}/{name}" if group else name
+        meta = ujson.loads(_as_bytes(refs[f"{path}/.zarray"]))
+        if meta["compressor"] or meta["filters"] or meta["dtype"] == "|O":
+            continue
+        var.data = indexing.LazilyIndexedArray(
+            ReferenceBackendArray(refs, path, var.shape, var.dtype, storage_options)
+        )
+    if decode.pop("decode_cf", True):
+        ds = xr.decode_cf(ds, **decode)
+    if chunks is not None:
+        ds = ds.chunk(chunks)
+    return ds
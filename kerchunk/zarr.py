@@ -1,5 +1,9 @@
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+
 import fsspec
-from fsspec.implementations.reference import LazyReferenceMapper
+import numpy as np
+import ujson
 
 import kerchunk.utils
 
@@ -10,6 +14,7 @@ def single_zarr(
     inline_threshold=100,
     inline=None,
     out=None,
+    max_workers=None,
 ):
     """kerchunk-style view on zarr mapper
 
@@ -19,6 +24,17 @@ def single_zarr(
 
     This is useful for testing, so that we can pass hand-made zarrs to combine.
 
+    For stores on a filesystem, consolidated metadata, if present, gives the
+    arrays, whose chunks are then listed concurrently; otherwise the whole
+    store is listed at once. All metadata files are fetched in one bulk
+    request. Chunk sizes come from the listing, so that inlining needs no
+    further requests to find them.
+
+    Zarr v3 stores (with ``zarr.json`` metadata) are given as zarr v2
+    references. Where an array is sharded, the index of every shard is read
+    (concurrently) and each inner chunk gets its own byte-range reference, so
+    that readers fetch only the chunks they need rather than whole shards.
+
     Parameters
     ----------
     uri_or_store: str or dict-like
@@ -28,6 +44,9 @@ def single_zarr(
         This allows you to supply an fsspec.implementations.reference.LazyReferenceMapper
         to write out parquet as the references get filled, or some other dictionary-like class
         to customise how references get stored
+    max_workers: int or None
+        number of arrays to list at once, when using consolidated metadata,
+        or of shard indexes to read at once, for synchronous filesystems
 
     Returns
     -------
@@ -40,21 +59,273 @@ def single_zarr(
         if isinstance(mapper, fsspec.FSMap) and storage_options is None:
             storage_options = mapper.fs.storage_options
 
-    refs = out or {}
-    for k in mapper:
-        if k.startswith("."):
-            refs[k] = mapper[k]
-        else:
-            refs[k] = [fsspec.utils._unstrip_protocol(mapper._key_to_str(k), mapper.fs)]
+    refs = out if out is not None else {}
+    if isinstance(mapper, fsspec.FSMap) and "zarr.json" in mapper:
+        _scan_v3(mapper, refs, max_workers)
+    elif isinstance(mapper, fsspec.FSMap):
+        _scan_fsmap(mapper, refs, max_workers)
+    else:
+        for k in mapper:
+            if k.startswith("."):
+                refs[k] = mapper[k]
+            else:
+                refs[k] = [
+                    fsspec.utils._unstrip_protocol(mapper._key_to_str(k), mapper.fs)
+                ]
     from kerchunk.utils import do_inline
 
     inline_threshold = inline or inline_threshold
     if inline_threshold:
         refs = do_inline(refs, inline_threshold, remote_options=storage_options)
-    if isinstance(refs, LazyReferenceMapper):
+    if hasattr(refs, "flush"):
         refs.flush()
     refs = kerchunk.utils.consolidate(refs)
     return refs
 
 
+def _scan_fsmap(mapper, refs, max_workers=None):
+    """Add references for everything in a zarr store on a filesystem"""
+    fs = mapper.fs
+    root = mapper.root.rstrip("/")
+    prefix = f"{root}/" if root else ""
+    try:
+        meta = ujson.loads(mapper[".zmetadata"])["metadata"]
+    except (KeyError, ValueError, TypeError):
+        meta = None
+
+    if meta is not None:
+        # the consolidated metadata says where the arrays are
+        arrays = [prefix + k[: -len(".zarray")] for k in meta if k.endswith(".zarray")]
+        with ThreadPoolExecutor(max_workers) as pool:
+            listings = pool.map(
+                lambda path: fs.find(path.rstrip("/") or root, detail=True), arrays
+            )
+            files = {}
+            for listing in listings:
+                files.update(listing)
+        metas = {prefix + k for k in meta} | {prefix + ".zmetadata"}
+    else:
+        files = fs.find(root, detail=True)
+        metas = set()
+    # metadata files are read, not taken from .zmetadata, which may be stale
+    metas.update(p for p in files if p.rsplit("/", 1)[-1].startswith("."))
+    if metas:
+        for path, data in fs.cat(sorted(metas), on_error="omit").items():
+            refs[path[len(prefix) :]] = data
+
+    for path, info in files.items():
+        if path.rsplit("/", 1)[-1].startswith("."):
+            continue
+        url = fsspec.utils._unstrip_protocol(path, fs)
+        size = info.get("size")
+        refs[path[len(prefix) :]] = [url, 0, size] if size else [url]
+
+
+_V3_DTYPES = {
+    "bool": "b1",
+    "int8": "i1",
+    "int16": "i2",
+    "int32": "i4",
+    "int64": "i8",
+    "uint8": "u1",
+    "uint16": "u2",
+    "uint32": "u4",
+    "uint64": "u8",
+    "float16": "f2",
+    "float32": "f4",
+    "float64": "f8",
+    "complex64": "c8",
+    "complex128": "c16",
+}
+_EMPTY = 2**64 - 1  # offset and size of a missing inner chunk
+
+
+def _scan_v3(mapper, refs, max_workers=None):
+    """Add zarr v2 references for everything in a zarr v3 store"""
+    fs = mapper.fs
+    root = mapper.root.rstrip("/")
+    prefix = f"{root}/" if root else ""
+    files = fs.find(root, detail=True)
+    metas = sorted(p for p in files if p.rsplit("/", 1)[-1] == "zarr.json")
+    arrays = {}
+    for path, data in fs.cat(metas).items():
+        node = ujson.loads(data)
+        name = path[len(prefix) : -len("zarr.json")]
+        attrs = dict(node.get("attributes") or {})
+        if node["node_type"] == "group":
+            refs[f"{name}.zgroup"] = ujson.dumps({"zarr_format": 2})
+        else:
+            zarray, layout = _v3_array_meta(node)
+            refs[f"{name}.zarray"] = ujson.dumps(zarray)
+            dims = node.get("dimension_names")
+            if dims and None not in dims:
+                attrs["_ARRAY_DIMENSIONS"] = dims
+            arrays[name] = layout
+        if attrs:
+            refs[f"{name}.zattrs"] = ujson.dumps(attrs)
+
+    # the files holding chunks or shards, by array and grid position
+    objects = []
+    for path, info in files.items():
+        key = path[len(prefix) :]
+        if key.rsplit("/", 1)[-1] == "zarr.json":
+            continue
+        parts = key.split("/")
+        for i in range(len(parts)):
+            name = "/".join(parts[:i] + [""]) if i else ""
+            if name in arrays:
+                index = _v3_chunk_index(key[len(name) :], arrays[name])
+                if index is not None:
+                    objects.append((name, index, path, info["size"]))
+                break
+
+    shards = [o for o in objects if arrays[o[0]]["inner"] is not None]
+    for name, index, path, size in objects:
+        if arrays[name]["inner"] is None:
+            url = fsspec.utils._unstrip_protocol(path, fs)
+            refs[name + ".".join(map(str, index or (0,)))] = (
+                [url, 0, size] if size else [url]
+            )
+    if not shards:
+        return
+
+    # read the index of every shard at once
+    paths, starts, ends = [], [], []
+    for name, _, path, size in shards:
+        layout = arrays[name]
+        start = size - layout["index_size"] if layout["index_at_end"] else 0
+        paths.append(path)
+        starts.append(start)
+        ends.append(start + layout["index_size"])
+    if fs.async_impl:
+        indexes = fs.cat_ranges(paths, starts, ends)
+    else:
+        with ThreadPoolExecutor(max_workers) as pool:
+            indexes = list(pool.map(fs.cat_file, paths, starts, ends))
+
+    for (name, index, path, _), data in zip(shards, indexes):
+        layout = arrays[name]
+        url = fsspec.utils._unstrip_protocol(path, fs)
+        per_shard = layout["per_shard"]
+        entries = np.frombuffer(
+            data, dtype=layout["index_dtype"], count=2 * int(np.prod(per_shard))
+        ).reshape(tuple(per_shard) + (2,))
+        for inner in itertools.product(*(range(n) for n in per_shard)):
+            offset, nbytes = (int(v) for v in entries[inner])
+            if offset == _EMPTY and nbytes == _EMPTY:
+                continue
+            ind = [s * n + i for s, n, i in zip(index, per_shard, inner)]
+            if any(i >= n for i, n in zip(ind, layout["grid"])):
+                # padding beyond the edge of the array
+                continue
+            refs[name + ".".join(map(str, ind or (0,)))] = [url, offset, nbytes]
+
+
+def _v3_array_meta(node):
+    """zarr v2 array metadata, and how to find chunks, for a v3 array"""
+    if node["chunk_grid"]["name"] != "regular":
+        raise NotImplementedError(f"chunk grid {node['chunk_grid']['name']}")
+    if node["data_type"] not in _V3_DTYPES:
+        raise NotImplementedError(f"data type {node['data_type']}")
+    shape = node["shape"]
+    chunks = node["chunk_grid"]["configuration"]["chunk_shape"]
+    encoding = node.get("chunk_key_encoding") or {"name": "default"}
+    if encoding["name"] not in ("default", "v2"):
+        raise NotImplementedError(f"chunk key encoding {encoding['name']}")
+    sep = (encoding.get("configuration") or {}).get(
+        "separator", "/" if encoding["name"] == "default" else "."
+    )
+    layout = {"encoding": encoding["name"], "sep": sep, "inner": None}
+    codecs = node["codecs"]
+    if codecs[0]["name"] == "sharding_indexed":
+        conf = codecs[0]["configuration"]
+        inner = conf["chunk_shape"]
+        if len(codecs) > 1 or any(s % i for s, i in zip(chunks, inner)):
+            raise NotImplementedError(
+                "sharding must be the only codec, on whole shards"
+            )
+        index_codecs = conf.get("index_codecs") or [{"name": "bytes"}]
+        endian = _v3_endian(index_codecs[0])
+        if {c["name"] for c in index_codecs[1:]} - {"crc32c"}:
+            raise NotImplementedError("shard index codecs other than crc32c")
+        per_shard = [c // i for c, i in zip(chunks, inner)]
+        layout.update(
+            inner=inner,
+            per_shard=per_shard,
+            index_dtype=f"{endian}u8",
+            index_size=16 * int(np.prod(per_shard)) + 4 * (len(index_codecs) - 1),
+            index_at_end=conf.get("index_location", "end") == "end",
+        )
+        chunks, codecs = inner, conf["codecs"]
+    layout["grid"] = [-(-s // c) for s, c in zip(shape, chunks)]
+
+    order = "C"
+    if codecs[0]["name"] == "transpose":
+        axes = list(codecs[0]["configuration"]["order"])
+        if axes != list(range(len(shape)))[::-1]:
+            raise NotImplementedError(f"transpose to {axes}")
+        order = "F" if len(shape) > 1 else "C"
+        codecs = codecs[1:]
+    if codecs[0]["name"] != "bytes":
+        raise NotImplementedError(f"codec {codecs[0]['name']}")
+    dtype = np.dtype(_V3_DTYPES[node["data_type"]])
+    dtype = dtype.newbyteorder(_v3_endian(codecs[0])).str
+    compressors = [_v3_codec(c) for c in codecs[1:]]
+    zarray = {
+        "zarr_format": 2,
+        "shape": shape,
+        "chunks": chunks,
+        "dtype": dtype,
+        "compressor": compressors[-1] if compressors else None,
+        "filters": compressors[:-1] or None,
+        "fill_value": node["fill_value"],
+        "order": order,
+        "dimension_separator": ".",
+    }
+    return zarray, layout
+
+
+def _v3_endian(codec):
+    endian = (codec.get("configuration") or {}).get("endian", "little")
+    return "<" if endian == "little" else ">"
+
+
+def _v3_codec(codec):
+    """numcodecs config for a v3 bytes-to-bytes codec"""
+    name, conf = codec["name"], codec.get("configuration") or {}
+    if name == "gzip":
+        return {"id": "gzip", "level": conf.get("level", 1)}
+    if name == "zstd":
+        return {"id": "zstd", "level": conf.get("level", 0)}
+    if name == "blosc":
+        shuffle = {"noshuffle": 0, "shuffle": 1, "bitshuffle": 2}
+        return {
+            "id": "blosc",
+            "cname": conf.get("cname", "zstd"),
+            "clevel": conf.get("clevel", 5),
+            "shuffle": shuffle[conf.get("shuffle", "noshuffle")],
+            "blocksize": conf.get("blocksize", 0),
+        }
+    if name == "crc32c":
+        return {"id": "crc32c"}
+    raise NotImplementedError(f"codec {name}")
+
+
+def _v3_chunk_index(key, layout):
+    """Grid position of the chunk or shard with the given key, if it is one"""
+    if layout["encoding"] == "default":
+        if key == "c":
+            return ()
+        if not key.startswith("c" + layout["sep"]):
+            return None
+        key = key[1 + len(layout["sep"]) :]
+    try:
+        index = tuple(int(i) for i in key.split(layout["sep"]))
+    except ValueError:
+        return None
+    if len(index) != len(layout["grid"]):
+        return None if layout["grid"] or index != (0,) else ()
+    return index
+
+
 ZarrToZarr = kerchunk.utils.class_factory(single_zarr)
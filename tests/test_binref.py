@@ -0,0 +1,87 @@
+import pickle
+
+import fsspec
+import numpy as np
+import pytest
+import ujson
+import xarray as xr
+
+import kerchunk.utils
+from kerchunk.binref import BinaryReferences, write_binary_refs
+from kerchunk.netCDF3 import NetCDF3ToZarr
+
+refs = {
+    "version": 1,
+    "templates": {"u": "memory://file"},
+    "refs": {
+        ".zgroup": '{"zarr_format": 2}',
+        "a/.zarray": {"shape": [3], "chunks": [1]},
+        "a/0": ["{{u}}", 10, 100],
+        "a/1": ["memory://other"],
+        "a/2": "base64:AAAA",
+        "ä/0": "data",
+    },
+}
+
+
+@pytest.fixture
+def mem():
+    # not the "m" fixture, which would clear data that other test modules make on import
+    fs = fsspec.filesystem("memory")
+    yield fs
+    if fs.exists("binref"):
+        fs.rm("binref", recursive=True)
+
+
+@pytest.mark.parametrize("local", [True, False])
+def test_roundtrip(mem, tmpdir, local):
+    url = f"{tmpdir}/refs.bin" if local else "memory://binref/refs.bin"
+    write_binary_refs(refs, url)
+    out = BinaryReferences(url)
+    assert len(out) == 6
+    assert list(out) == sorted(refs["refs"])
+    assert out["a/0"] == ["memory://file", 10, 100]
+    assert out["a/1"] == ["memory://other"]
+    assert out["a/2"] == b"\x00\x00\x00"
+    assert out["ä/0"] == b"data"
+    assert ujson.loads(out["a/.zarray"]) == {"shape": [3], "chunks": [1]}
+    assert "a/3" not in out
+    with pytest.raises(KeyError):
+        out["a/3"]
+    if local:
+        assert isinstance(out._offset.base, np.memmap)
+    out2 = pickle.loads(pickle.dumps(out))
+    assert dict(out2) == dict(out)
+
+    # found by URL by the utilities
+    assert isinstance(kerchunk.utils._open_refs(url), BinaryReferences)
+
+    with fsspec.open(url, "wb") as f:
+        f.write(b"{}" * 100)
+    with pytest.raises(ValueError):
+        BinaryReferences(url)
+
+
+def test_shared_inline(mem):
+    blob = bytes(range(256)) * 4
+    url = "memory://binref/refs.bin"
+    write_binary_refs({f"a/{i}": blob for i in range(10)}, url)
+    assert mem.size(url) < 2 * len(blob)
+    out = BinaryReferences(url)
+    assert all(out[f"a/{i}"] == blob for i in range(10))
+
+
+def test_open_dataset(mem, tmpdir):
+    data = np.arange(100, dtype="f4").reshape(10, 10)
+    ds = xr.Dataset({"data": (("x", "y"), data)})
+    mem.pipe("binref/data.nc", ds.to_netcdf(format="NETCDF3_CLASSIC"))
+    out = NetCDF3ToZarr("memory://binref/data.nc", inline_threshold=0).translate()
+    kerchunk.utils.write_refs(out, f"{tmpdir}/refs.bin", kind="binary")
+
+    fs = fsspec.filesystem(
+        "reference", fo=BinaryReferences(f"{tmpdir}/refs.bin"), remote_protocol="memory"
+    )
+    result = xr.open_dataset(
+        fs.get_mapper(), engine="zarr", backend_kwargs={"consolidated": False}
+    )
+    assert (result.data.values == data).all()
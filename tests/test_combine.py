@@ -1,6 +1,7 @@
 import fsspec
 import fsspec.utils
 import numpy as np
+import ujson
 import dask.array as da
 import pytest
 import xarray as xr
@@ -215,6 +216,11 @@ fs.pipe(
 )
 
 
+def _whole(path):
+    """Reference to the whole of a file, with the size from the listing"""
+    return [f"memory://{path}", 0, fs.size(path)]
+
+
 @pytest.fixture(scope="module")
 def refs():
     return {
@@ -277,6 +283,83 @@ def test_get_coos(refs, selector, expected):
     assert dict(g.attrs)
 
 
+def test_coos_without_loading(refs):
+    dropped = []
+
+    def preproc(refs):
+        dropped.append(refs.pop("static/0.0", None))
+        return refs
+
+    mzz = MultiZarrToZarr(
+        [refs["single1"], refs["single2"]],
+        remote_protocol="memory",
+        concat_dims=["time"],
+        coo_map={"time": "INDEX"},
+        identical_dims=["x", "y"],
+        preprocess=preproc,
+    )
+    mzz.first_pass()
+    assert mzz._fss is None
+    assert not dropped
+    assert mzz.coos["time"].tolist() == [0, 1]
+    out = mzz.translate()
+    assert mzz._fss is None
+    assert len(dropped) == 2
+
+    z = xr.open_dataset(
+        "reference://",
+        backend_kwargs={
+            "storage_options": {"fo": out, "remote_protocol": "memory"},
+            "consolidated": False,
+        },
+        engine="zarr",
+    )
+    assert z.time.values.tolist() == [0, 1]
+    assert (z.data[1].values == arr).all()
+
+
+def test_coos_without_loading_paths(refs, monkeypatch):
+    from fsspec.implementations.memory import MemoryFileSystem
+
+    files = []
+    for i in range(5):
+        fn = f"memory://batched/in{i}.json"
+        with fsspec.open(fn, "wt") as f:
+            f.write(ujson.dumps(refs[f"single{i % 2 + 1}"]))
+        files.append(fn)
+    cats = []
+    cat = MemoryFileSystem.cat
+
+    def record_cat(self, path, *args, **kwargs):
+        cats.append(path)
+        return cat(self, path, *args, **kwargs)
+
+    monkeypatch.setattr(MemoryFileSystem, "cat", record_cat)
+    mzz = MultiZarrToZarr(
+        files[::-1],
+        remote_protocol="memory",
+        concat_dims=["time"],
+        coo_map={"time": "INDEX"},
+        identical_dims=["x", "y"],
+        batch_size=2,
+    )
+    out = mzz.translate()
+    assert mzz._fss is None
+    # inputs fetched in batches of two, in the order given
+    assert cats == [files[4:2:-1], files[2:0:-1], files[:1]]
+
+    z = xr.open_dataset(
+        "reference://",
+        backend_kwargs={
+            "storage_options": {"fo": out, "remote_protocol": "memory"},
+            "consolidated": False,
+        },
+        engine="zarr",
+    )
+    assert z.time.values.tolist() == [0, 1, 2, 3, 4]
+    assert (z.data[1].values == arr).all()
+
+
 def test_coo_vars(refs):
     mzz = MultiZarrToZarr(
         [refs["simple1"], refs["simple_var1"]],
@@ -353,8 +436,8 @@ def test_single_append(refs):
         decode_cf=False,
     )
     assert z.data.shape == (3, 10, 10)
-    assert out["refs"]["data/1.0.0"] == ["memory:///single2.zarr/data/0.0.0"]
-    assert out["refs"]["data/2.0.0"] == ["memory:///single3.zarr/data/0.0.0"]
+    assert out["refs"]["data/1.0.0"] == _whole("/single2.zarr/data/0.0.0")
+    assert out["refs"]["data/2.0.0"] == _whole("/single3.zarr/data/0.0.0")
     assert z.time.values.tolist() == [1, 2, 3]
 
 
@@ -387,9 +470,9 @@ def test_single_append_cf(refs, mapper, dtype):
         engine="zarr",
     )
     assert z.data.shape == (3, 10, 10)
-    assert out["refs"]["data/0.0.0"] == ["memory:///cfstdtime1.zarr/data/0.0.0"]
-    assert out["refs"]["data/1.0.0"] == ["memory:///cfstdtime2.zarr/data/0.0.0"]
-    assert out["refs"]["data/2.0.0"] == ["memory:///cfstdtime3.zarr/data/0.0.0"]
+    assert out["refs"]["data/0.0.0"] == _whole("/cfstdtime1.zarr/data/0.0.0")
+    assert out["refs"]["data/1.0.0"] == _whole("/cfstdtime2.zarr/data/0.0.0")
+    assert out["refs"]["data/2.0.0"] == _whole("/cfstdtime3.zarr/data/0.0.0")
     np.testing.assert_equal(
         z.time.values,
         np.array(
@@ -437,8 +520,8 @@ def test_single_append_parquet(refs):
         decode_cf=False,
     )
     assert z.data.shape == (3, 10, 10)
-    assert out["data/1.0.0"] == ["memory:///single2.zarr/data/0.0.0"]
-    assert out["data/2.0.0"] == ["memory:///single3.zarr/data/0.0.0"]
+    assert out["data/1.0.0"] == _whole("/single2.zarr/data/0.0.0")
+    assert out["data/2.0.0"] == _whole("/single3.zarr/data/0.0.0")
     assert z.time.values.tolist() == [1, 2, 3]
 
 
@@ -547,6 +630,7 @@ def test_run_twice(refs):
 
 def test_outfile_postprocess(refs):
     def post_process(ref):
+        assert type(ref) is dict  # not the internal compact store
         # renamed "data" array to "a_data"; to rename a coordinate, one would nee
         # to alter attributes of arrays pointing to it
         return {("a_" + k if k.startswith("data") else k): v for k, v in ref.items()}
@@ -791,6 +875,99 @@ def test_no_inline():
         mzz_inline.translate()
 
 
+def test_metrics(refs):
+    calls = []
+    mzz = MultiZarrToZarr(
+        [refs["single1"], refs["single2"]],
+        remote_protocol="memory",
+        concat_dims=["time"],
+        inline_threshold=10000,
+        callbacks=[lambda stage, report: calls.append(stage)],
+    )
+    mzz.translate()
+    report = mzz.report
+    assert set(report["stages"]) == {
+        "load_inputs",
+        "first_pass",
+        "store_coords",
+        "second_pass",
+        "inline",
+        "output",
+    }
+    assert report["n_inputs"] == 2
+    assert report["keys"] > 0
+    assert report["requests"] >= report["keys"]
+    assert report["bytes_fetched"] > 0
+    assert report["peak_refs"] == len(mzz.out)
+    assert calls[-1] == "output"
+
+    mzz = MultiZarrToZarr(
+        [refs["single1"], refs["single2"]],
+        remote_protocol="memory",
+        concat_dims=["time"],
+    )
+    mzz.translate()
+    assert mzz.report is None
+
+
+def test_metrics_lazy_output(refs, tmpdir, monkeypatch):
+    from fsspec.implementations.reference import LazyReferenceMapper
+
+    def no_len(self):
+        raise AssertionError("references counted")
+
+    monkeypatch.setattr(LazyReferenceMapper, "__len__", no_len)
+    out = LazyReferenceMapper.create(str(tmpdir), record_size=10)
+    mzz = MultiZarrToZarr(
+        [refs["single1"], refs["single2"]],
+        remote_protocol="memory",
+        concat_dims=["time"],
+        out=out,
+        metrics=True,
+    )
+    mzz.translate()
+    assert mzz.report["peak_refs"] is None
+    assert mzz.report["keys"] > 0
+
+
+def test_compact_references():
+    refs = kerchunk.combine.CompactReferences()
+    refs[".zgroup"] = b'{"zarr_format": 2}'
+    refs["a/0"] = ["memory://file", 0, 10]
+    refs["a/1"] = ["memory://file", 10, 10]
+    refs["a/2"] = ["memory://other"]
+    refs["b/0"] = b"data"
+    refs["c"] = [None, 1, 2]
+    assert refs.urls == ["memory://file", "memory://other"]
+    assert refs["a/1"] == ["memory://file", 10, 10]
+    assert refs["a/2"] == ["memory://other"]
+    assert refs["c"] == [None, 1, 2]
+
+    refs["a/1"] = b"inlined"
+    assert refs["a/1"] == b"inlined"
+    refs["b/0"] = ["memory://file", 20, 5]
+    assert refs["b/0"] == ["memory://file", 20, 5]
+    del refs["a/0"]
+    assert "a/0" not in refs
+    with pytest.raises(KeyError):
+        refs["a/0"]
+    assert dict(refs) == {
+        ".zgroup": b'{"zarr_format": 2}',
+        "a/1": b"inlined",
+        "a/2": ["memory://other"],
+        "b/0": ["memory://file", 20, 5],
+        "c": [None, 1, 2],
+    }
+    assert len(refs) == 5
+
+    # rows freed by removal are reused, so repeated overwrites do not grow
+    for i in range(10):
+        refs["a/1"] = b"inlined"
+        refs["a/1"] = ["memory://file", i, 10]
+    assert refs["a/1"] == ["memory://file", 9, 10]
+    assert len(refs._tables["a"].url) == 3
+
+
 def test_merge_vars():
     a = dict({"version": 1, "refs": dict({"item1": 1})})
     b = dict({"version": 1, "refs": dict({"item2": 2})})
@@ -803,6 +980,68 @@ def test_merge_vars():
     assert list(merge["refs"]) == ["item1", "item2"]
 
 
+def test_merge_vars_conflicts():
+    a = {"version": 1, "refs": {".zgroup": '{"zarr_format": 2}', "item": "one"}}
+    b = {"version": 1, "refs": {".zgroup": '{ "zarr_format": 2 }', "item": "two"}}
+    merge = kerchunk.combine.merge_vars([a, b])
+    assert merge["refs"]["item"] == "two"
+    merge = kerchunk.combine.merge_vars([a, b], conflicts="first")
+    assert merge["refs"]["item"] == "one"
+    assert a["refs"]["item"] == "one"  # inputs not mutated
+    with pytest.raises(ValueError, match="item"):
+        kerchunk.combine.merge_vars([a, b], conflicts="raise")
+
+    # paths not in sorted order are still taken in the order given
+    fs = fsspec.filesystem("memory")
+    fs.pipe("conflicts/b.json", ujson.dumps(a).encode())
+    fs.pipe("conflicts/a.json", ujson.dumps(b).encode())
+    files = ["memory://conflicts/b.json", "memory://conflicts/a.json"]
+    merge = kerchunk.combine.merge_vars(files, conflicts="first")
+    assert merge["refs"]["item"] == "one"
+    merge = kerchunk.combine.merge_vars(files)
+    assert merge["refs"]["item"] == "two"
+
+
+def test_merge_vars_parquet(tmpdir):
+    pytest.importorskip("fastparquet")
+    from fsspec.implementations.reference import LazyReferenceMapper
+
+    fs = fsspec.filesystem("memory")
+    for i in range(5):
+        fs.pipe(
+            f"merge/file{i}.json",
+            ujson.dumps(
+                {
+                    "version": 1,
+                    "refs": {
+                        ".zgroup": '{"zarr_format": 2}',
+                        f"v{i}/.zarray": ujson.dumps(
+                            {
+                                "shape": [2],
+                                "chunks": [1],
+                                "dtype": "<i8",
+                                "compressor": None,
+                                "filters": None,
+                                "fill_value": 0,
+                                "order": "C",
+                                "zarr_format": 2,
+                            }
+                        ),
+                        f"v{i}/0": ["memory://data", i, 8],
+                        f"v{i}/1": ["memory://data", i + 8, 8],
+                    },
+                }
+            ).encode(),
+        )
+    out = LazyReferenceMapper.create(str(tmpdir), record_size=10)
+    files = [f"memory://merge/file{i}.json" for i in range(5)]
+    merged = kerchunk.combine.merge_vars(files, out=out, batch_size=2)
+    assert merged is out
+    out = LazyReferenceMapper(str(tmpdir))
+    assert out["v3/1"] == ["memory://data", 11, 8]
+    assert sorted(out.listdir()) == [f"v{i}" for i in range(5)]
+
+
 def test_bad_coo_warning(refs):
     def f(*_, **__):
         return 1
@@ -1,3 +1,5 @@
+import json
+
 import pytest
 
 import fsspec
@@ -139,3 +141,106 @@ def test_fail_irregular_chunk_boundaries(tmpdir):
 
     with pytest.raises(ValueError, match=r"Array at index 0 has irregular chunking.*"):
         kerchunk.combine.concatenate_arrays([ref1, ref2], path="x", check_arrays=True)
+
+
+@pytest.mark.parametrize("parquet", [False, True])
+def test_multi_array(tmpdir, m, parquet):
+    if parquet:
+        pytest.importorskip("fastparquet")
+    fns = []
+    for i in range(3):
+        fn = f"{tmpdir}/out{i}.zarr"
+        g = zarr.open(fn)
+        g.create_dataset("a0", data=np.arange(i * 4, i * 4 + 4), chunks=(2,))
+        g.create_dataset("b1", data=np.ones((4, 3)) * i, chunks=(1, 3))
+        g.create_dataset("scalar", data=1, shape=())
+        ref = kerchunk.zarr.single_zarr(fn, inline=0)
+        with fsspec.open(f"memory://refs{i}.json", "wt") as f:
+            f.write(json.dumps(ref))
+        fns.append(f"memory://refs{i}.json")
+    if parquet:
+        for i, fn in enumerate(fns):
+            kerchunk.df.refs_to_dataframe(fn, f"memory://refs{i}.parq")
+        fns = [f"memory://refs{i}.parq" for i in range(3)]
+
+    out = kerchunk.combine.concatenate_arrays(
+        fns,
+        check_arrays=True,
+        batch_size=2,
+        storage_options={"remote_protocol": "file"},
+    )
+    assert "a0/5" in out["refs"]
+    assert "b1/11.0" in out["refs"]
+
+    mapper = fsspec.get_mapper("reference://", fo=out)
+    g = zarr.open(mapper)
+    assert (g.a0[:] == np.arange(12)).all()
+    assert g.b1.shape == (12, 3)
+    assert (g.b1[8:, :] == 2).all()
+    assert g.scalar[()] == 1
+
+    # inputs not in sorted order are concatenated in the order given
+    out = kerchunk.combine.concatenate_arrays(
+        fns[::-1], storage_options={"remote_protocol": "file"}
+    )
+    g = zarr.open(fsspec.get_mapper("reference://", fo=out))
+    assert (g.a0[:] == np.arange(12).reshape(3, 4)[::-1].ravel()).all()
+    assert (g.b1[:4, :] == 2).all()
+
+    if parquet:
+        from fsspec.implementations.reference import LazyReferenceMapper
+
+        out = LazyReferenceMapper.create(f"{tmpdir}/out.parq", record_size=5)
+        kerchunk.combine.concatenate_arrays(fns, out=out)
+        mapper = fsspec.get_mapper(
+            "reference://",
+            fo=f"{tmpdir}/out.parq",
+            remote_protocol="file",
+            skip_instance_cache=True,
+        )
+        g = zarr.open(mapper)
+        assert (g.a0[:] == np.arange(12)).all()
+        assert (g.b1[8:, :] == 2).all()
+
+
+@pytest.mark.parametrize("sep", [".", "/"])
+def test_copied_arrays(tmpdir, sep):
+    refs = []
+    for i in range(2):
+        fn = f"{tmpdir}/out{i}.zarr"
+        g = zarr.open(fn)
+        kw = {"dimension_separator": sep}
+        g.create_dataset("g/data", data=np.ones((2, 3, 4)) * i, chunks=(1, 3, 2), **kw)
+        g.create_dataset("g/mask", data=np.arange(6).reshape(2, 3), chunks=(1, 3), **kw)
+        g.create_dataset("h/x", data=np.arange(3), chunks=(2,), **kw)
+        refs.append(kerchunk.zarr.single_zarr(fn, inline=0))
+
+    out = kerchunk.combine.concatenate_arrays(refs, axis=2, key_seperator=sep)
+    assert f"g/mask/1{sep}0" in out["refs"]
+    assert "h/.zgroup" in out["refs"]
+    g = zarr.open(fsspec.get_mapper("reference://", fo=out))
+    assert g["g/data"].shape == (2, 3, 8)
+    assert (g["g/data"][:, :, 4:] == 1).all()
+    assert (g["g/mask"][:] == np.arange(6).reshape(2, 3)).all()
+    assert (g["h/x"][:] == np.arange(3)).all()
+
+
+def test_all_arrays_include_coords(tmpdir):
+    refs = []
+    for i in range(2):
+        fn = f"{tmpdir}/out{i}.zarr"
+        g = zarr.open(fn)
+        g.create_dataset("data", data=np.ones((2, 3)) * i, chunks=(1, 3))
+        g.create_dataset("lat", data=np.arange(3), chunks=(3,))
+        refs.append(kerchunk.zarr.single_zarr(fn, inline=0))
+
+    # by default, the 1-D coordinate also has axis 0, and is concatenated
+    g = zarr.open(
+        fsspec.get_mapper("reference://", fo=kerchunk.combine.concatenate_arrays(refs))
+    )
+    assert g.data.shape == (4, 3)
+    assert (g.lat[:] == [0, 1, 2, 0, 1, 2]).all()
+
+    # with path, other arrays are left out
+    out = kerchunk.combine.concatenate_arrays(refs, path="data")
+    assert not any(k.startswith("lat/") for k in out["refs"])
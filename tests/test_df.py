@@ -62,3 +62,160 @@ def test_1(m, url):
         "raw": {0: None, 1: None, 2: b"data", 3: None},
         "size": {0: 0, 1: 0, 2: 0, 3: 0},
     }
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_streaming_json(m, tmpdir, max_workers):
+    meta = {"shape": [30], "chunks": [1], "filters": None, "compressor": None}
+    refs = {}
+    for var in ["a", "b/c"] + [f"v{i}" for i in range(10)]:
+        # chunks come before their metadata
+        for i in range(30):
+            refs[f"{var}/{i}"] = [f"memory://dätä{i % 3}.file", i * 10, 10]
+        refs[f"{var}/.zarray"] = ujson.dumps(dict(meta, dtype="<i4"))
+    refs["a/7"] = "base64:" + "AAAA" * 10
+    refs["b/c/3"] = 'some "raw" data'
+    refs[".zgroup"] = '{"zarr_format": 2}'
+    # a local file: memory files are shared between open() calls
+    with fsspec.open(f"{tmpdir}/refs.json", "wt") as f:
+        ujson.dump({"version": 1, "templates": {"u": "x"}, "refs": refs}, f)
+
+    refs_to_dataframe(refs, "memory://dict", record_size=4, max_workers=1)
+    # small blocks and too many pending chunks, needing a metadata scan
+    refs_to_dataframe(
+        f"{tmpdir}/refs.json",
+        "memory://json",
+        record_size=4,
+        blocksize=7,
+        max_workers=max_workers,
+    )
+    assert sorted(m.find("dict")) == [
+        f.replace("/json", "/dict") for f in sorted(m.find("json"))
+    ]
+    for path in m.find("json"):
+        if path.endswith(".parq"):
+            pd.testing.assert_frame_equal(
+                pd.read_parquet(f"memory://{path}"),
+                pd.read_parquet(f"memory://{path.replace('/json', '/dict')}"),
+            )
+    assert ujson.loads(m.cat("json/.zmetadata")) == ujson.loads(
+        m.cat("dict/.zmetadata")
+    )
+
+
+def test_get_variables():
+    import zarr
+
+    from kerchunk.df import get_variables
+
+    refs = {
+        ".zgroup": '{"zarr_format": 2}',
+        "a/.zarray": b'{"shape": [2], "chunks": [1]}',
+        "a/0": ["file"],
+        "a/1": ["file"],
+        "g/.zgroup": '{"zarr_format": 2}',
+        "g/.zattrs": '{"x": 1}',
+        "g/h/b/.zarray": '{"shape": [1], "chunks": [1]}',
+        "g/h/b/0": b"data",
+    }
+    expected = {k: v for k, v in refs.items() if "/." in k or k.startswith(".")}
+    zarr.consolidate_metadata(expected)
+    assert get_variables(refs) == [".zgroup", "a", "g", ".zmetadata"]
+    assert refs[".zmetadata"] == ujson.loads(expected[".zmetadata"])
+    assert get_variables(refs, consolidated=False) == [
+        ".zgroup",
+        "a",
+        "g",
+        ".zmetadata",
+    ]
+
+
+def test_compact_profile(m):
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+    from fsspec.implementations.reference import LazyReferenceMapper
+
+    n = 10_000
+    refs = {
+        ".zgroup": '{"zarr_format": 2}',
+        "a/.zarray": ujson.dumps(
+            {"shape": [n + 10], "chunks": [1], "filters": None, "compressor": None}
+        ),
+    }
+    for i in range(n):
+        refs[f"a/{i}"] = [f"s3://bucket/path/file{i // 1000}.nc", 1000 + i * 4096, 4096]
+    refs["a/3"] = ["memory://whole"]
+    refs["a/4"] = b"data"
+    # repeated inlined values are stored once
+    refs["b/.zarray"] = refs["a/.zarray"]
+    blob = bytes(range(250)) * 4
+    for i in range(100):
+        refs[f"b/{i}"] = blob
+
+    refs_to_dataframe(refs, "memory://plain", record_size=n)
+    refs_to_dataframe(refs, "memory://compact", record_size=n, profile="compact")
+    assert m.size("compact/a/refs.0.parq") * 5 < m.size("plain/a/refs.0.parq")
+    with m.open("compact/b/refs.0.parq") as f:
+        meta = pyarrow.parquet.ParquetFile(f).metadata.row_group(0)
+        assert "RLE_DICTIONARY" in meta.column(3).encodings
+
+    lazy = LazyReferenceMapper("memory://compact", fs=m)
+    for k in ["a/0", "a/3", "a/4", "a/9999", "a/.zarray", "b/0", "b/99"]:
+        assert lazy[k] == LazyReferenceMapper("memory://plain", fs=m)[k]
+    assert lazy["a/9999"] == refs["a/9999"]
+    with pytest.raises(KeyError):
+        lazy["a/10005"]
+    with pytest.raises(ValueError):
+        refs_to_dataframe(refs, "memory://other", profile="unknown")
+
+
+@pytest.mark.parametrize("profile", [None, "compact"])
+def test_compact_parquet(m, profile):
+    if profile:
+        pytest.importorskip("pyarrow")
+    from fsspec.implementations.reference import LazyReferenceMapper
+
+    from kerchunk.df import compact_parquet
+
+    refs = {
+        ".zgroup": '{"zarr_format": 2}',
+        "a/.zarray": ujson.dumps(
+            {"shape": [20], "chunks": [1], "filters": None, "compressor": None}
+        ),
+        "g/b/.zarray": ujson.dumps(
+            {"shape": [2, 2], "chunks": [1, 1], "filters": None, "compressor": None}
+        ),
+        "g/b/1.1": b"data",
+    }
+    for i in range(10):
+        refs[f"a/{i}"] = ["memory://file", i * 10, 10]
+    refs["a/15"] = ["memory://other"]
+    refs_to_dataframe(refs, "memory://refs", record_size=3)
+    # stale leftovers
+    m.copy("refs/a/refs.0.parq", "refs/a/refs.20.parq")
+    m.copy("refs/a/refs.0.parq", "refs/old/refs.0.parq")
+
+    compact_parquet("memory://refs", record_size=8, profile=profile)
+    assert not m.exists("refs.compacting") and not m.exists("refs.old")
+    assert sorted(m.ls("refs", detail=False)) == [
+        "/refs/.zmetadata",
+        "/refs/a",
+        "/refs/g",
+    ]
+    # 20 chunks in 3 records, the last empty
+    assert sorted(m.ls("refs/a", detail=False)) == [
+        "/refs/a/refs.0.parq",
+        "/refs/a/refs.1.parq",
+    ]
+    assert ujson.loads(m.cat("refs/.zmetadata"))["record_size"] == 8
+    chunks = {k: v for k, v in refs.items() if "/." not in k and k[0] != "."}
+    lazy = LazyReferenceMapper("memory://refs", fs=m)
+    assert {k: lazy[k] for k in lazy if k in chunks} == chunks
+    assert sorted(k for k in lazy if k not in chunks) == sorted(
+        [".zmetadata", ".zgroup", "a/.zarray", "g/b/.zarray"]
+    )
+
+    compact_parquet("memory://refs", "memory://out", record_size=2)
+    assert len(m.ls("out/a")) == 6
+    lazy = LazyReferenceMapper("memory://out", fs=m)
+    assert {k: lazy[k] for k in lazy if k in chunks} == chunks
@@ -0,0 +1,69 @@
+import gzip
+
+import fsspec
+import numpy as np
+import pytest
+
+from kerchunk import gzindex
+
+data = np.cumsum(np.random.default_rng(0).normal(size=500_000)).astype("f4").tobytes()
+
+
+@pytest.mark.parametrize("members", [1, 3])
+def test_random_access(m, members):
+    step = len(data) // members + 1
+    m.pipe(
+        "data.gz",
+        b"".join(gzip.compress(data[i : i + step]) for i in range(0, len(data), step)),
+    )
+    idx = gzindex.build_index(
+        "memory://data.gz", spacing=100_000, index_url="memory://data.gz.idx"
+    )
+    assert idx.size == len(data)
+    assert len(idx.checkpoints) > 10
+    idx2 = gzindex.GzipIndex.load("memory://data.gz.idx")
+    assert [c[:3] for c in idx2.checkpoints] == [c[:3] for c in idx.checkpoints]
+
+    rng = np.random.default_rng(1)
+    ranges = [(0, 10), (len(data) - 100, len(data)), (step - 50, step + 50)]
+    ranges += [(s, s + 30_000) for s in rng.integers(0, len(data), 10).tolist()]
+    for start, end in ranges:
+        assert idx2.read(start, end) == data[start:end]
+
+    # only the data after the nearest checkpoint is fetched
+    k, cstart, cend = idx2.compressed_range(1_000_000, 1_000_100)
+    assert cend - cstart < len(m.cat("data.gz")) / 10
+
+
+def test_netcdf_references(m):
+    xr = pytest.importorskip("xarray")
+    from kerchunk.netCDF3 import NetCDF3ToZarr
+
+    arr = np.frombuffer(data, dtype="f4").reshape(500, 1000)
+    ds = xr.Dataset(
+        {"data": (("x", "y"), arr), "small": (("z",), np.arange(4))},
+    )
+    bdata = ds.to_netcdf(format="NETCDF3_CLASSIC")
+    m.pipe("data.nc", bdata)
+    m.pipe("data.nc.gz", gzip.compress(bdata))
+
+    refs = NetCDF3ToZarr(
+        "memory://data.nc", inline_threshold=100, max_chunk_size=100_000
+    ).translate()
+    idx = gzindex.build_index(
+        "memory://data.nc.gz", spacing=2**17, index_url="memory://data.nc.gz.idx"
+    )
+    gzindex.gzip_references(refs, idx, source="memory://data.nc")
+    assert not any(isinstance(v, list) for v in refs["refs"].values())
+    m.rm("data.nc")
+
+    out = xr.open_dataset(
+        "reference://",
+        engine="zarr",
+        backend_kwargs={
+            "consolidated": False,
+            "storage_options": {"fo": refs, "remote_protocol": "memory"},
+        },
+    )
+    assert (out.data.values == arr).all()
+    assert (out.small.values == np.arange(4)).all()
@@ -0,0 +1,85 @@
+import fsspec
+import numpy as np
+import pytest
+import ujson
+import xarray as xr
+
+from kerchunk.combine import MultiZarrToZarr
+from kerchunk.netCDF3 import NetCDF3ToZarr
+from kerchunk.sqlite import SQLiteReferences
+
+
+def test_mapping(tmpdir):
+    path = f"{tmpdir}/refs.db"
+    refs = SQLiteReferences(path, batch_size=3)
+    assert len(refs) == 0
+    refs[".zgroup"] = '{"zarr_format": 2}'
+    refs["a/0"] = ["memory://file", 10, 100]
+    refs["a/1"] = ["memory://file"]
+    refs["a/2"] = "base64:" + "AAAA"
+    refs["a/3"] = b"data"
+    assert refs["a/0"] == ["memory://file", 10, 100]
+    assert refs["a/1"] == ["memory://file"]
+    assert refs["a/2"] == b"\x00\x00\x00"
+    assert refs[".zgroup"] == b'{"zarr_format": 2}'
+    del refs["a/3"]
+    assert "a/3" not in refs
+    with pytest.raises(KeyError):
+        refs["a/3"]
+    with pytest.raises(KeyError):
+        del refs["a/4"]
+    assert list(refs) == [".zgroup", "a/0", "a/1", "a/2"]
+    refs["a/1"] = ["memory://other", 0, 5]
+    refs.close()
+
+    # persisted
+    with SQLiteReferences(path) as refs:
+        assert len(refs) == 4
+        assert refs["a/1"] == ["memory://other", 0, 5]
+    with SQLiteReferences(path, mode="w") as refs:
+        assert len(refs) == 0
+
+
+def test_convert(m, tmpdir):
+    pytest.importorskip("fastparquet")
+    refs = {
+        ".zgroup": '{"zarr_format": 2}',
+        "a/.zarray": ujson.dumps(
+            {"shape": [3], "chunks": [1], "filters": None, "compressor": None}
+        ),
+        "a/0": ["memory://file", 10, 100],
+        "a/1": ["memory://file"],
+        "a/2": "data",
+    }
+    db = SQLiteReferences.from_refs(refs, f"{tmpdir}/refs.db")
+    db.to_json("memory://refs.json")
+    assert ujson.loads(m.cat("refs.json"))["refs"] == refs
+
+    db.to_parquet("memory://refs.parq")
+    db2 = SQLiteReferences.from_refs("memory://refs.parq", f"{tmpdir}/refs2.db")
+    for k in refs:
+        if ".z" in k:
+            assert ujson.loads(db2[k]) == ujson.loads(db[k])
+        else:
+            assert db2[k] == db[k]
+
+
+def test_scan_and_combine(m, tmpdir):
+    data = np.arange(20, dtype="f4").reshape(2, 10)
+    for i in range(2):
+        ds = xr.Dataset({"data": (("t", "x"), data[i : i + 1])}, coords={"t": [i]})
+        m.pipe(f"data{i}.nc", ds.to_netcdf(format="NETCDF3_CLASSIC"))
+    singles = []
+    for i in range(2):
+        out = SQLiteReferences(f"{tmpdir}/single{i}.db")
+        assert NetCDF3ToZarr(f"memory://data{i}.nc", out=out).translate() is out
+        singles.append(out)
+
+    out = SQLiteReferences(f"{tmpdir}/combined.db")
+    mzz = MultiZarrToZarr(singles, remote_protocol="memory", concat_dims=["t"], out=out)
+    assert mzz.translate() is out
+    fs = fsspec.filesystem("reference", fo=out, remote_protocol="memory")
+    result = xr.open_dataset(
+        fs.get_mapper(), engine="zarr", backend_kwargs={"consolidated": False}
+    )
+    assert (result.data.values == data).all()
@@ -1,9 +1,11 @@
+import base64
 import io
 
 import fsspec
 import json
 import kerchunk.utils
 import kerchunk.zarr
+import numcodecs
 import numpy as np
 import pytest
 import zarr
@@ -31,6 +33,78 @@ def test_rename_files(m):
     assert out == b'{"version":1,"refs":{"v0":["newerpath",0,0],"bin":"data"}}'
 
 
+@pytest.mark.parametrize("threshold", [2, 100])
+def test_rename_parquet(tmpdir, threshold):
+    pytest.importorskip("fastparquet")
+    pytest.importorskip("pyarrow")
+    import kerchunk.df
+    from fsspec.implementations.reference import LazyReferenceMapper
+
+    refs = {
+        ".zgroup": '{"zarr_format":2}',
+        "a/.zarray": '{"shape":[20],"chunks":[1],"dtype":"<i4","compressor":null,'
+        '"filters":null,"fill_value":0,"order":"C","zarr_format":2}',
+    }
+    for i in range(20):
+        refs[f"a/{i}"] = [f"memory://f{i % 3}", i, 4]
+    refs["a/5"] = b"raw"
+    path = f"{tmpdir}/refs"
+    kerchunk.df.refs_to_dataframe(
+        refs, path, record_size=8, categorical_threshold=threshold
+    )
+    renames = {"memory://f0": "memory://g", "memory://f1": "memory://g"}
+    n = kerchunk.utils.rename_target_parquet(path, renames, url_out=f"{tmpdir}/out")
+    assert n == 3
+    n = kerchunk.utils.rename_target_parquet(path, {"memory://other": "nope"})
+    assert n == 0
+
+    before = LazyReferenceMapper(path)
+    after = LazyReferenceMapper(f"{tmpdir}/out")
+    for i in range(20):
+        key = f"a/{i}"
+        if i == 5:
+            assert after[key] == b"raw"
+        else:
+            assert list(before[key]) == refs[key]
+            url = renames.get(refs[key][0], refs[key][0])
+            assert list(after[key]) == [url] + refs[key][1:]
+
+
+def test_rename_parquet_compact(tmpdir):
+    pq = pytest.importorskip("pyarrow.parquet")
+    import kerchunk.df
+    from fsspec.implementations.reference import LazyReferenceMapper
+
+    refs = {
+        ".zgroup": '{"zarr_format":2}',
+        "a/.zarray": '{"shape":[20],"chunks":[1],"dtype":"<i4","compressor":null,'
+        '"filters":null,"fill_value":0,"order":"C","zarr_format":2}',
+    }
+    for i in range(20):
+        refs[f"a/{i}"] = [f"memory://f{i % 3}", i * 4, 4]
+    path = f"{tmpdir}/refs"
+    kerchunk.df.refs_to_dataframe(refs, path, record_size=20, profile="compact")
+
+    def encodings(fn):
+        rg = pq.ParquetFile(fn).metadata.row_group(0)
+        return {
+            rg.column(i).path_in_schema: (
+                rg.column(i).encodings,
+                rg.column(i).compression,
+                rg.column(i).is_stats_set,
+            )
+            for i in range(rg.num_columns)
+        }
+
+    before = encodings(f"{path}/a/refs.0.parq")
+    assert kerchunk.utils.rename_target_parquet(path, {"memory://f1": "memory://g"})
+    assert encodings(f"{path}/a/refs.0.parq") == before
+    assert "DELTA_BINARY_PACKED" in before["offset"][0]
+    after = LazyReferenceMapper(path)
+    assert after["a/1"] == ["memory://g", 4, 4]
+    assert after["a/2"] == ["memory://f2", 8, 4]
+
+
 def test_inline(m):
     m.pipe("data", b"stuff")
     refs = {
@@ -49,6 +123,37 @@ def test_inline(m):
     assert out == expected
 
 
+def test_inline_coalesce(m, monkeypatch):
+    data = bytes(range(200))
+    m.pipe("data", data)
+    m.pipe("other", b"hello")
+    refs = {f"a/{i}": ["memory://data", i * 2, 2] for i in range(100)}
+    refs["b/0"] = ["memory://other", 1, 3]
+    refs["c/0"] = ["memory://data", 0, 100]  # too big
+
+    calls = []
+    cat_file = type(m).cat_file
+
+    def counting(self, path, start=None, end=None, **kw):
+        calls.append(path)
+        return cat_file(self, path, start=start, end=end, **kw)
+
+    monkeypatch.setattr(type(m), "cat_file", counting)
+    out = kerchunk.utils.do_inline(refs, 10, max_gap=0)
+    assert len(calls) == 2
+    assert out["a/10"] == data[20:22]
+    assert out["a/80"] == b"base64:" + base64.b64encode(data[160:162])
+    assert out["b/0"] == b"ell"
+    assert out["c/0"] == ["memory://data", 0, 100]
+
+    calls.clear()
+    refs["b/1"] = ["memory://other", 0, 1]
+    out = kerchunk.utils.do_inline(refs, 10, max_block=50, batch_size=2)
+    assert len(calls) == 5  # four blocks of data, one of other
+    fs = fsspec.filesystem("reference", fo=out)
+    assert fs.cat("a/99") == data[198:]
+
+
 def test_inline_array():
     refs = {
         ".zgroup": b'{"zarr_format": 2}',
@@ -89,11 +194,213 @@ def test_inline_array():
     assert g.data[:].tolist() == [1, 2]
 
 
+def test_inline_array_many(m):
+    g = zarr.open_group(m.get_mapper("test.zarr"), mode="w")
+    expected = {}
+    for i in range(20):
+        data = np.arange(i * 10, i * 10 + 50, dtype="f8")
+        g.create_dataset(f"c{i}", data=data, chunks=(7,), compressor=numcodecs.Zlib())
+        expected[f"c{i}"] = data
+    sub = g.create_group("sub")
+    sub.create_dataset("x", data=np.arange(12).reshape(3, 4), chunks=(2, 2))
+    sub.create_dataset(
+        "s",
+        data=np.array(["a", "bb", "ccc"], dtype=object),
+        object_codec=numcodecs.VLenUTF8(),
+        chunks=(2,),
+    )
+    g.create_dataset("big", data=np.arange(1000), chunks=(100,))
+    g.c0.attrs["units"] = "m"
+    refs = kerchunk.zarr.single_zarr("memory://test.zarr", inline=0)["refs"]
+
+    out = kerchunk.utils.inline_array(
+        refs,
+        threshold=500,
+        names=["sub.s"],
+        remote_options={"remote_protocol": "memory"},
+    )
+    assert not any(k.startswith("c1/") and k.endswith("/1") for k in out)
+    assert "big/9" in out
+    g2 = zarr.open_group(fsspec.filesystem("reference", fo=out).get_mapper())
+    for name, data in expected.items():
+        assert g2[name].chunks == (50,)
+        assert g2[name].compressor is None
+        assert (g2[name][:] == data).all()
+    assert g2.c0.attrs["units"] == "m"
+    assert (g2.sub.x[:] == np.arange(12).reshape(3, 4)).all()
+    assert g2.sub.s[:].tolist() == ["a", "bb", "ccc"]
+    assert g2.big.chunks == (100,)
+
+
+@pytest.mark.parametrize("kind", ["dict", "parquet"])
+def test_dedup_inline(m, kind):
+    g = zarr.open_group(m.get_mapper("test.zarr"), mode="w")
+    lat = np.linspace(-90, 90, 50)
+    for i in range(3):
+        g.create_dataset(f"lat{i}", data=lat, chunks=(50,), compressor=None)
+    g.create_dataset("level", data=np.full(40, 500.0), chunks=(10,), compressor=None)
+    g.create_dataset("other", data=np.arange(50.0), chunks=(50,), compressor=None)
+    g.create_dataset("small", data=np.zeros(6), chunks=(3,), compressor=None)
+    refs = kerchunk.zarr.single_zarr("memory://test.zarr", inline_threshold=1000)
+    refs = refs["refs"]
+    # a raw copy of the same bytes, not base64
+    refs["lat1/0"] = kerchunk.utils._as_bytes(refs["lat1/0"])
+    if kind == "parquet":
+        kerchunk.utils.write_refs(refs, "memory://refs.parq", kind="parquet")
+        refs = "memory://refs.parq"
+
+    out = kerchunk.utils.dedup_inline(refs, "memory://blobs", min_size=40)
+    # lat once, level once; singletons and small values stay inline
+    assert m.size("blobs") == lat.nbytes + 80
+    for k in ["lat0/0", "lat1/0", "lat2/0", "level/0", "level/3"]:
+        assert out[k][0] == "memory:///blobs"
+    assert out["lat0/0"] == out["lat2/0"]
+    assert not isinstance(out["other/0"], list)
+    assert not isinstance(out["small/0"], list)
+    assert not isinstance(out["lat0/.zarray"], list)
+
+    g2 = zarr.open_group(fsspec.filesystem("reference", fo=out).get_mapper())
+    for i in range(3):
+        assert (g2[f"lat{i}"][:] == lat).all()
+    assert (g2.level[:] == 500).all()
+    assert (g2.other[:] == np.arange(50)).all()
+
+
+@pytest.mark.parametrize("kind", ["dict", "json", "parquet"])
+def test_profile_refs(m, tmpdir, kind):
+    meta = {
+        "shape": [10, 10],
+        "chunks": [2, 5],
+        "dtype": "<f8",
+        "compressor": {"id": "zlib", "level": 1},
+        "filters": None,
+        "fill_value": 0,
+        "order": "C",
+        "zarr_format": 2,
+    }
+    refs = {
+        ".zgroup": '{"zarr_format":2}',
+        "a/.zarray": json.dumps(meta),
+        "a/.zattrs": "{}",
+        "b/.zarray": json.dumps(dict(meta, shape=[4], chunks=[2])),
+    }
+    for i in range(5):
+        for j in range(2):
+            refs[f"a/{i}.{j}"] = [f"memory://f{i}", j * 100, 50 + j * 1000]
+    refs["a/4.1"] = b"\x00\x01\x02"
+    refs["b/0"] = "abcd"
+    refs["b/1"] = ["memory://f0"]
+    if kind == "json":
+        kerchunk.utils.write_refs(refs, "memory://refs.json")
+        source = "memory://refs.json"
+    elif kind == "parquet":
+        pytest.importorskip("fastparquet")
+        from kerchunk.df import refs_to_dataframe
+
+        refs_to_dataframe(refs, f"{tmpdir}/refs", record_size=3)
+        source = f"{tmpdir}/refs"
+    else:
+        source = refs
+
+    report = kerchunk.utils.profile_refs(
+        source,
+        selection={"a": (slice(0, 4), 7), "b": [[0, 4]]},
+        min_chunk_bytes=1000,
+        out="memory://report.json",
+    )
+    assert json.loads(m.cat("report.json")) == json.loads(json.dumps(report))
+    assert report["n_chunks"] == 12
+    assert report["n_inlined"] == 2
+    assert report["inline_bytes"] == 7
+    assert report["n_targets"] == 5
+    assert report["refs_per_target"]["max"] == 3
+
+    a = report["variables"]["a"]
+    assert a["n_chunks"] == 10
+    assert a["n_targets"] == 5
+    assert a["chunk_nbytes"] == 80
+    assert a["compressor"] == "zlib"
+    assert a["ref_bytes"]["count"] == 9
+    assert a["ref_bytes_histogram"] == {"32": 5, "1024": 4}
+    assert report["variables"]["b"]["n_whole_file"] == 1
+    assert any(w.startswith("a:") for w in report["warnings"])
+
+    assert report["selection"]["a"] == {
+        "n_chunks": 2,
+        "n_requests": 2,
+        "n_inlined": 0,
+        "n_missing": 0,
+        "n_targets": 2,
+        "bytes": 2100,
+    }
+    assert report["selection"]["b"]["n_requests"] == 1
+    assert report["selection"]["b"]["n_inlined"] == 1
+
+
+@pytest.mark.parametrize("kind", ["dict", "json"])
+def test_profile_refs_keys(m, monkeypatch, kind):
+    meta = {
+        "shape": [4, 4],
+        "chunks": [2, 2],
+        "dtype": "<i4",
+        "compressor": None,
+        "filters": None,
+        "fill_value": 0,
+        "order": "C",
+        "zarr_format": 2,
+    }
+    # a root-level array, and one in a group with "/" as dimension separator
+    refs = {
+        ".zarray": json.dumps(meta),
+        "g/.zgroup": '{"zarr_format":2}',
+        "g/v/.zarray": json.dumps(dict(meta, dimension_separator="/")),
+    }
+    for i in range(2):
+        for j in range(2):
+            refs[f"{i}.{j}"] = ["memory://root", 0, 16]
+            refs[f"g/v/{i}/{j}"] = ["memory://v", 0, 16]
+    if kind == "json":
+        kerchunk.utils.write_refs(refs, "memory://refs.json")
+        refs = "memory://refs.json"
+
+        # streamed, not loaded whole
+        def no_load(*_, **__):
+            raise AssertionError("loaded whole")
+
+        monkeypatch.setattr(kerchunk.utils.ujson, "load", no_load)
+
+    report = kerchunk.utils.profile_refs(refs, selection={"g/v": (0, slice(None))})
+    assert report["n_metadata"] == 3
+    assert sorted(report["variables"]) == ["", "g/v"]
+    assert report["variables"][""]["n_chunks"] == 4
+    assert report["variables"]["g/v"]["n_chunks"] == 4
+    assert report["variables"]["g/v"]["shape"] == [4, 4]
+    assert report["selection"]["g/v"]["n_requests"] == 2
+
+
 def test_json():
     data = {"a": "a", "b": b"b", "c": [None, None, None], "d": '{"key": 0}'}
     out = kerchunk.utils._encode_for_JSON(data)
     expected = {"a": "a", "b": "b", "c": [None, None, None], "d": '{"key":0}'}
     assert out == expected
+    assert data["b"] == b"b"  # input unchanged
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 100])
+def test_write_refs(m, batch_size):
+    refs = {
+        ".zgroup": b'{"zarr_format": 2}',
+        "a/0": ["memory://url", 0, 10],
+        "a/1": b"\xff\x00",
+        "a/2": "text",
+    }
+    kerchunk.utils.write_refs(refs, "memory://out.json", batch_size=batch_size)
+    with fsspec.open("memory://out.json") as f:
+        assert json.load(f) == kerchunk.utils.consolidate(refs)
+
+    kerchunk.utils.write_refs({}, "memory://empty.json")
+    with fsspec.open("memory://empty.json") as f:
+        assert json.load(f) == {"version": 1, "refs": {}}
 
 
 @pytest.mark.parametrize("chunks", [[10, 10], [5, 10]])
@@ -119,6 +426,67 @@ def test_subchunk_exact(m, chunks):
     assert (g2.data[:] == data).all()
 
 
+@pytest.mark.parametrize("kind", ["dict", "json", "parquet"])
+def test_subchunk_multi(m, tmpdir, kind):
+    store = m.get_mapper("test.zarr")
+    g = zarr.open_group(store, mode="w")
+    data = np.arange(400, dtype="int32").reshape(20, 20)
+    g.create_dataset("a", data=data, chunks=(4, 10), compression=None)
+    g.create_dataset("b", data=data, chunks=(10, 20), compression=None)
+    g.create_dataset("c", data=data[0], chunks=(10,), compression=None)
+    ref = kerchunk.zarr.single_zarr("memory://test.zarr", inline_threshold=0)["refs"]
+    ref["c/0"] = ["memory://test.zarr/c/0"]  # unknown size
+    if kind == "parquet":
+        pytest.importorskip("fastparquet")
+        from kerchunk.df import refs_to_dataframe
+        from fsspec.implementations.reference import LazyReferenceMapper
+
+        refs_to_dataframe(ref, f"{tmpdir}/out", record_size=5)
+        ref = LazyReferenceMapper(f"{tmpdir}/out")
+    elif kind == "json":
+        kerchunk.utils.write_refs(ref, "memory://refs.json")
+        ref = "memory://refs.json"
+
+    calls = []
+    sizes = fsspec.implementations.memory.MemoryFileSystem.sizes
+    fsspec.implementations.memory.MemoryFileSystem.sizes = lambda self, paths: (
+        calls.append(paths) or sizes(self, paths)
+    )
+    try:
+        out = kerchunk.utils.subchunk(ref, {"a": [1, 5], "b": 20, "c": [2]})
+    finally:
+        fsspec.implementations.memory.MemoryFileSystem.sizes = sizes
+    if kind == "dict":
+        assert out is ref
+    elif kind == "parquet":
+        # a new instance, as the one given caches the old chunking
+        assert isinstance(out, LazyReferenceMapper) and out is not ref
+    assert len(calls) == 1  # one bulk size lookup for all whole-file refs
+
+    g2 = zarr.open_group(
+        "reference://", storage_options={"fo": out, "remote_protocol": "memory"}
+    )
+    assert g2.a.chunks == (1, 5)
+    assert g2.b.chunks == (1, 10)
+    assert g2.c.chunks == (2,)
+    assert (g2.a[:] == data).all()
+    assert (g2.b[:] == data).all()
+    assert (g2.c[:] == data[0]).all()
+
+    with pytest.raises(ValueError):
+        kerchunk.utils.subchunk(ref, {"a": [1, 3]})
+
+
+def test_subchunk_empty_ref(m):
+    g = zarr.open_group(m.get_mapper("test.zarr"), mode="w")
+    g.create_dataset("a", shape=(4,), chunks=(4,), dtype="i4", compression=None)
+    ref = {".zgroup": g.store[".zgroup"], "a/.zarray": g.store["a/.zarray"]}
+    # a known size of zero is not looked up as if it were a whole-file reference
+    ref["a/0"] = ["memory://nothing", 0, 0]
+    out = kerchunk.utils.subchunk(ref, "a", 2)
+    assert out["a/0"] == out["a/1"] == ["memory://nothing", 0, 0]
+
+
 @pytest.mark.parametrize("archive", ["zip", "tar"])
 def test_archive(m, archive):
     import zipfile
@@ -150,6 +518,45 @@ def test_archive(m, archive):
     assert fs.cat("c") == data[5:7]
 
 
+def test_archive_index(m, tmpdir):
+    import zipfile
+
+    data = b"piece of data"
+    for i in range(3):
+        with fsspec.open(f"memory://archive{i}", "wb") as f:
+            arc = zipfile.ZipFile(file=f, mode="w")
+            arc.writestr("dir/", b"")
+            arc.writestr("data1", data)
+            # local header differs from the central directory entry
+            with arc.open("data2", "w", force_zip64=True) as mem:
+                mem.write(data * 2)
+            arc.close()
+    refs = {
+        f"{i}/{j}": [f"zip://data{j}::memory://archive{i}"]
+        for i in range(3)
+        for j in (1, 2)
+    }
+    cache = f"{tmpdir}/index.json"
+    refs2 = kerchunk.utils.dereference_archives(refs, index_cache=cache)
+    assert "zip://" not in str(refs2)
+    fs = fsspec.filesystem("reference", fo=refs2)
+    for i in range(3):
+        assert fs.cat(f"{i}/1") == data
+        assert fs.cat(f"{i}/2") == data * 2
+    assert refs["0/1"] == ["zip://data1::memory://archive0"]  # input unchanged
+
+    with open(cache) as f:
+        index = json.load(f)
+    assert set(index) == {"memory://archive0", "memory://archive1", "memory://archive2"}
+    # cached offsets are used while the archive size is unchanged
+    index["memory://archive0"]["members"]["data1"][0] += 1
+    with open(cache, "w") as f:
+        json.dump(index, f)
+    refs3 = kerchunk.utils.dereference_archives(refs, index_cache=cache)
+    assert refs3["0/1"][1] == refs2["0/1"][1] + 1
+    assert refs3["1/1"] == refs2["1/1"]
+
+
 def test_deflate_zip_archive(m):
     import zipfile
     from kerchunk.codecs import DeflateCodec
@@ -170,3 +577,139 @@ def test_deflate_zip_archive(m):
 
     fs = fsspec.filesystem("reference", fo=refs2)
     assert dec.decode(fs.cat("b")) == data
+
+
+def test_plan_read(m):
+    data = np.arange(100, dtype="i4").reshape(10, 10)
+    meta = {
+        "shape": [10, 10],
+        "chunks": [2, 5],
+        "dtype": "<i4",
+        "compressor": None,
+        "filters": None,
+        "fill_value": 0,
+        "order": "C",
+        "zarr_format": 2,
+    }
+    refs = {".zgroup": '{"zarr_format":2}', "a/.zarray": json.dumps(meta)}
+    blobs = {"f0": b"", "f1": b""}
+    for i in range(5):
+        for j in range(2):
+            chunk = data[i * 2 : i * 2 + 2, j * 5 : j * 5 + 5].tobytes()
+            name = f"f{j}"
+            # each chunk followed by a small gap
+            refs[f"a/{i}.{j}"] = [f"memory://{name}", len(blobs[name]), len(chunk)]
+            blobs[name] += chunk + b"-" * 10
+    for name, blob in blobs.items():
+        m.pipe(name, blob)
+    refs["a/0.0"] = data[:2, :5].tobytes()
+    del refs["a/4.1"]
+
+    plan = kerchunk.utils.plan_read(refs, "a", (slice(1, 9), slice(3, 7)))
+    assert len(plan.requests) == 2
+    assert sorted(r[0] for r in plan.requests) == ["memory://f0", "memory://f1"]
+    assert list(plan.inline) == ["a/0.0"]
+    assert plan.missing == ["a/4.1"]
+    out = plan.fetch()
+    assert len(out) == 9
+    for i in range(4):
+        for j in range(2):
+            chunk = data[i * 2 : i * 2 + 2, j * 5 : j * 5 + 5].tobytes()
+            assert out[f"a/{i}.{j}"] == chunk
+
+    # no merging across gaps, one request per referenced chunk
+    plan = kerchunk.utils.plan_read(refs, "a", max_gap=0)
+    assert len(plan.requests) == 8
+    assert plan.fetch()["a/3.1"] == data[6:8, 5:].tobytes()
+
+
+@pytest.mark.parametrize("order", ["C", "F"])
+def test_read_region(m, order):
+    data = np.arange(6 * 8 * 10, dtype="f4").reshape(6, 8, 10)
+    store = {}
+    z = zarr.array(data, store=store, chunks=(4, 4, 10), compressor=None, order=order)
+    refs = {".zgroup": b'{"zarr_format":2}', "a/.zarray": store[".zarray"]}
+    blob = b""
+    for k, v in store.items():
+        if not k.startswith("."):
+            refs[f"a/{k}"] = ["memory://blob", len(blob), len(v)]
+            blob += v
+    m.pipe("blob", blob)
+    refs["a/0.1.0"] = store["0.1.0"]
+    del refs["a/1.1.0"]
+    expected = z[:]
+    expected[4:, 4:] = 0
+
+    for sel in [
+        (slice(None), 5, 7),
+        (slice(1, 5), slice(2, 7), slice(3, 9)),
+        (slice(None, None, 2), slice(7, 1, -3), -1),
+        (2,),
+        None,
+    ]:
+        out = kerchunk.utils.read_region(refs, "a", sel)
+        np.testing.assert_array_equal(out, expected[sel or ...])
+
+    # a point series needs only one element per chunk
+    starts, ends = kerchunk.utils._chunk_runs((4, 4, 10), [0, 1, 3], [4, 2, 4], 4, "C")
+    assert (ends - starts == 4).all()
+    assert len(starts) == 4
+    m.rm("blob")
+    with pytest.raises(FileNotFoundError):
+        kerchunk.utils.read_region(refs, "a", (0, 0, 0), max_gap=0)
+
+    # compressed arrays are read whole chunk by whole chunk
+    store = {}
+    zarr.array(data, store=store, chunks=(4, 4, 10), order=order)
+    refs = {f"a/{k}": v for k, v in store.items()}
+    out = kerchunk.utils.read_region(refs, "a", (slice(3, 5), 4))
+    np.testing.assert_array_equal(out, data[3:5, 4])
+
+
+def test_read_region_fetched_bytes(m, monkeypatch):
+    data = np.random.rand(1000, 20, 20).astype("f4")
+    store = {}
+    zarr.array(data, store=store, chunks=data.shape, compressor=None)
+    m.pipe("d.bin", store["0.0.0"])
+    refs = {
+        "version": 1,
+        "templates": {"u": "memory://d.bin"},
+        "refs": {
+            "v/.zarray": store[".zarray"],
+            "v/0.0.0": ["{{u}}", 0, data.nbytes],
+        },
+    }
+    calls = []
+    cat_file = fsspec.implementations.memory.MemoryFileSystem.cat_file
+
+    def record_file(self, path, start=None, end=None, **kwargs):
+        calls.append(end - start)
+        return cat_file(self, path, start=start, end=end, **kwargs)
+
+    monkeypatch.setattr(
+        fsspec.implementations.memory.MemoryFileSystem, "cat_file", record_file
+    )
+
+    # a point series is 1000 strided values, not the whole chunk
+    out = kerchunk.utils.read_region(refs, "v", (slice(None), 3, 4))
+    np.testing.assert_array_equal(out, data[:, 3, 4])
+    assert len(calls) == 1000
+    assert sum(calls) == 1000 * 4
+
+    # runs with small gaps between them are still fetched together
+    calls.clear()
+    out = kerchunk.utils.read_region(refs, "v", (slice(10, 12), slice(None), 1))
+    np.testing.assert_array_equal(out, data[10:12, :, 1])
+    assert calls == [(2 * 20 - 1) * 20 * 4 + 4]
+
+    # templates are also filled for arrays read whole chunk by whole chunk
+    store = {}
+    zarr.array(data[:2], store=store, chunks=(1, 20, 20))
+    refs["refs"] = {"v/.zarray": store[".zarray"]}
+    blob = b""
+    for k in ["0.0.0", "1.0.0"]:
+        refs["refs"][f"v/{k}"] = ["{{u}}", len(blob), len(store[k])]
+        blob += store[k]
+    m.pipe("d.bin", blob)
+    out = kerchunk.utils.read_region(refs, "v", (1, 5))
+    np.testing.assert_array_equal(out, data[1, 5])
@@ -1,6 +1,8 @@
 import xarray as xr
 import numpy as np
+from fsspec.implementations.memory import MemoryFileSystem
 from kerchunk import netCDF3
+from kerchunk.xarray_backend import ReferenceBackendArray
 
 arr = np.random.rand(1, 10, 10)
 data = xr.DataArray(
@@ -22,3 +24,38 @@ def test_reference_netcdf(m):
         out, engine="kerchunk", storage_options={"remote_protocol": "memory"}
     )
     assert (ds.data == data).all()
+
+
+def test_partial_reads(m, monkeypatch):
+    m.pipe("data.nc3", bdata)
+    out = netCDF3.NetCDF3ToZarr("memory://data.nc3", inline_threshold=0).translate()
+    ds = xr.open_dataset(
+        out,
+        engine="kerchunk",
+        storage_options={"remote_protocol": "memory"},
+        partial_reads=True,
+    )
+    backend = ds.data.variable._data
+    while not isinstance(backend, ReferenceBackendArray):
+        backend = backend.array
+
+    calls = []
+    cat_file = MemoryFileSystem.cat_file
+
+    # cat_ranges on the memory filesystem reads each range with cat_file
+    def record_file(self, path, start=None, end=None, **kwargs):
+        calls.append((path, start, end))
+        return cat_file(self, path, start=start, end=end, **kwargs)
+
+    monkeypatch.setattr(MemoryFileSystem, "cat_file", record_file)
+
+    part = ds.data[3, 2:5].values
+    assert (part == data[3, 2:5]).all()
+    _, offset, size = out["refs"]["data/0.0"]
+    start = offset + (3 * 10 + 2) * arr.itemsize
+    assert calls
+    assert all(s is not None and e is not None for _, s, e in calls)
+    assert all(start <= s and e <= start + 3 * arr.itemsize for _, s, e in calls)
+    assert sum(e - s for _, s, e in calls) == 3 * arr.itemsize < size
+
+    assert (ds.data == data).all()
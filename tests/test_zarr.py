@@ -96,3 +96,128 @@ def test_zarr_json_dump_succeeds(tmpdir, ds):
         inline_threshold=0,
     ).translate()
     ujson.dumps(one)
+
+
+@pytest.mark.parametrize("consolidated", [True, False])
+def test_listing_sizes(tmpdir, ds, consolidated):
+    fn = f"{tmpdir}/test.zarr"
+    ds.to_zarr(fn, consolidated=consolidated)
+    fs = fsspec.filesystem("file")
+
+    refs = kerchunk.zarr.single_zarr(fn, inline_threshold=0)["refs"]
+    assert (".zmetadata" in refs) is consolidated
+    assert ujson.loads(refs["temp/.zarray"])["shape"] == list(ds.temp.shape)
+    for k, v in refs.items():
+        if not k.rsplit("/", 1)[-1].startswith("."):
+            assert v[1:] == [0, fs.size(v[0])]
+
+    out = kerchunk.zarr.single_zarr(fn, inline_threshold=1000)
+    assert isinstance(out["refs"]["x/0"], str)
+    ds2 = xr.open_dataset(out, engine="kerchunk")
+    assert ds.equals(ds2)
+
+
+def _write_v3(path, name, data, chunks, codecs, encoding):
+    """Write a zarr v3 array, sharded if the first codec is sharding_indexed"""
+    import gzip
+    import itertools
+
+    fs = fsspec.filesystem("file", auto_mkdir=True)
+    meta = {
+        "zarr_format": 3,
+        "node_type": "array",
+        "shape": list(data.shape),
+        "data_type": str(data.dtype),
+        "chunk_grid": {"name": "regular", "configuration": {"chunk_shape": chunks}},
+        "chunk_key_encoding": encoding,
+        "fill_value": 0,
+        "codecs": codecs,
+        "dimension_names": ["y", "x"],
+        "attributes": {"units": "m"},
+    }
+    fs.pipe(f"{path}/{name}/zarr.json", ujson.dumps(meta).encode())
+    sharding = codecs[0]["name"] == "sharding_indexed"
+    if sharding:
+        conf = codecs[0]["configuration"]
+        inner = conf["chunk_shape"]
+        compress = conf["codecs"][-1]["name"] == "gzip"
+    sep = encoding["configuration"]["separator"]
+    for index in itertools.product(
+        *(range(-(-s // c)) for s, c in zip(data.shape, chunks))
+    ):
+        block = np.zeros(chunks, dtype=data.dtype)
+        part = data[tuple(slice(i * c, (i + 1) * c) for i, c in zip(index, chunks))]
+        block[tuple(slice(0, s) for s in part.shape)] = part
+        key = sep.join(map(str, index))
+        if encoding["name"] == "default":
+            key = "c" + sep + key
+        if not sharding:
+            fs.pipe(f"{path}/{name}/{key}", block.tobytes())
+            continue
+        body = b""
+        per_shard = [c // i for c, i in zip(chunks, inner)]
+        entries = np.full(per_shard + [2], 2**64 - 1, dtype="<u8")
+        for ind in itertools.product(*(range(n) for n in per_shard)):
+            sub = block[tuple(slice(i * n, (i + 1) * n) for i, n in zip(ind, inner))]
+            if not sub.any():
+                continue  # left empty, to be filled
+            raw = gzip.compress(sub.tobytes()) if compress else sub.tobytes()
+            entries[ind] = len(body), len(raw)
+            body += raw
+        if conf["index_location"] == "start":
+            # offsets are from the start of the shard, after the index
+            entries[..., 0][entries[..., 1] != 2**64 - 1] += entries.nbytes + 4
+            shard = entries.tobytes() + b"\0" * 4 + body  # crc32c is not checked
+        else:
+            shard = body + entries.tobytes() + b"\0" * 4
+        fs.pipe(f"{path}/{name}/{key}", shard)
+
+
+@pytest.mark.parametrize("location", ["start", "end"])
+@pytest.mark.parametrize("compress", [True, False])
+def test_v3_sharded(tmpdir, location, compress):
+    path = f"{tmpdir}/v3.zarr"
+    data = np.arange(90, dtype="f4").reshape(10, 9)
+    data[:2, :3] = 0  # one inner chunk left empty
+    inner = [{"name": "bytes", "configuration": {"endian": "little"}}]
+    if compress:
+        inner.append({"name": "gzip", "configuration": {"level": 1}})
+    sharding = {
+        "name": "sharding_indexed",
+        "configuration": {
+            "chunk_shape": [2, 3],
+            "codecs": inner,
+            "index_codecs": [
+                {"name": "bytes", "configuration": {"endian": "little"}},
+                {"name": "crc32c"},
+            ],
+            "index_location": location,
+        },
+    }
+    fsspec.filesystem("file", auto_mkdir=True).pipe(
+        f"{path}/zarr.json",
+        b'{"zarr_format": 3, "node_type": "group", "attributes": {"title": "t"}}',
+    )
+    encoding = {"name": "default", "configuration": {"separator": "/"}}
+    _write_v3(path, "sharded", data, [4, 6], [sharding], encoding)
+    encoding = {"name": "v2", "configuration": {"separator": "."}}
+    _write_v3(path, "plain", data, [5, 5], inner[:1], encoding)
+
+    refs = kerchunk.zarr.single_zarr(path, inline_threshold=0)["refs"]
+    meta = ujson.loads(refs["sharded/.zarray"])
+    assert meta["chunks"] == [2, 3]
+    assert meta["dtype"] == "<f4"
+    assert (meta["compressor"] or {}).get("id") == ("gzip" if compress else None)
+    # only the inner chunks within the array, and not the empty one
+    assert "sharded/0.0" not in refs
+    assert "sharded/4.2" in refs
+    assert "sharded/5.0" not in refs
+    assert refs["sharded/4.2"][0].endswith("sharded/c/2/1")
+    assert refs["plain/1.1"][1:] == [0, 100]
+
+    ds = xr.open_dataset(refs, engine="kerchunk", mask_and_scale=False)
+    assert ds.attrs["title"] == "t"
+    assert ds.sharded.dims == ("y", "x")
+    assert ds.sharded.attrs["units"] == "m"
+    assert (ds.sharded.values == data).all()
+    assert (ds.plain.values == data).all()